@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Banc de mesure de l'ingestion, sans broker MQTT ni adaptateur Bluetooth
+- zigbee : messages Zigbee2MQTT synthétiques injectés dans Zigbee2MQTTHandler.on_message
+- ble    : publicités synthétiques (ou enregistrées) injectées dans
+           XiaomiAdvertisementScanner.handleDiscovery (mode continu)
+Les lignes sont écrites dans un sink d'enregistrement (mémoire, latence simulée
+en option) ou dans une base PostgreSQL locale (--dsn)
+Affiche pour chaque stratégie d'insertion : débit, latence p50/p99 par message
+et lignes écrites par seconde
+
+Usage:
+  python3 benchmark-ingestion.py zigbee --messages 20000 --sensors 300
+  python3 benchmark-ingestion.py ble --messages 20000 --repeat 5 --db-latency-ms 2
+  python3 benchmark-ingestion.py ble --capture publicites.txt --dsn "host=localhost dbname=bench"
+
+Format d'une capture BLE : une publicité par ligne "MAC SERVICE_DATA_HEX [RSSI]"
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import struct
+import time
+from types import SimpleNamespace
+import config
+from script_loader import load_script
+from timescaledb_sink import TimescaleSink, WRITTEN
+from timescaledb_writer import create_writer
+from deadband import create_filter
+
+STRATEGIES = ('direct', 'batch')
+
+
+class RecordingSink:
+    """Sink local : compte les lignes, avec une latence d'écriture simulée"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows_written = 0
+        self.writes = 0
+
+    def write(self, name, rows):
+        if self.latency:
+            time.sleep(self.latency)
+        self.writes += 1
+        self.rows_written += len(rows)
+        return WRITTEN
+
+    def close(self):
+        pass
+
+
+class FakeScanEntry:
+    """Équivalent minimal de btle.ScanEntry pour handleDiscovery"""
+
+    def __init__(self, addr, data, rssi):
+        self.addr = addr
+        self.rssi = rssi
+        self.data = data
+
+    def getValueText(self, adtype):
+        return self.data if adtype == 22 else None
+
+
+def zigbee_messages(count, sensors, unknown_ratio):
+    """Messages Zigbee2MQTT synthétiques (dont une part de capteurs inconnus)"""
+    base_topic = getattr(config, 'MQTT_BASE_TOPIC', 'zigbee2mqtt')
+    sensor_ids = list(sensors)
+    rng = random.Random(1)
+    for i in range(count):
+        if rng.random() < unknown_ratio:
+            sensor_id = f"inconnu_{rng.randrange(1000)}"
+        else:
+            sensor_id = sensor_ids[i % len(sensor_ids)]
+        payload = {
+            'temperature': round(rng.uniform(15, 25), 1),
+            'humidity': round(rng.uniform(30, 70), 1),
+            'battery': rng.choice((100, 99, 98)),
+            'voltage': rng.choice((3000, 2990)),
+            'linkquality': rng.randrange(40, 255),
+            'update': {'installed_version': 1, 'latest_version': 1, 'state': 'idle'},
+        }
+        yield SimpleNamespace(topic=f"{base_topic}/{sensor_id}", payload=json.dumps(payload).encode())
+
+
+def ble_frame(mac, counter, rng):
+    """Publicité synthétique au format ATC1441 ou pvvx (hexadécimal bluepy)"""
+    mac_bytes = bytes.fromhex(mac.replace(':', ''))
+    temp = rng.randrange(150, 250)
+    if counter % 2:
+        payload = mac_bytes + struct.pack('>hBBHB', temp, rng.randrange(30, 70), 90, 2950, counter & 0xFF)
+    else:
+        payload = mac_bytes[::-1] + struct.pack('<hHHBBB', temp * 10, rng.randrange(3000, 7000),
+                                                2950, 90, counter & 0xFF, 0)
+    return '1a18' + payload.hex()
+
+
+def ble_advertisements(count, sensors, repeat):
+    """Publicités synthétiques : chaque mesure est répétée repeat fois"""
+    macs = list(sensors)
+    rng = random.Random(1)
+    counters = dict.fromkeys(macs, 0)
+    sent = 0
+    while sent < count:
+        mac = macs[sent // repeat % len(macs)]
+        counters[mac] += 1
+        frame = ble_frame(mac, counters[mac], rng)
+        for _ in range(min(repeat, count - sent)):
+            yield FakeScanEntry(mac.lower(), frame, -rng.randrange(40, 95))
+            sent += 1
+
+
+def ble_capture(path):
+    """Publicités enregistrées : "MAC SERVICE_DATA_HEX [RSSI]" par ligne"""
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2 or line.startswith('#'):
+                continue
+            rssi = int(fields[2]) if len(fields) > 2 else -70
+            yield FakeScanEntry(fields[0].lower(), fields[1].lower(), rssi)
+
+
+def make_sink(args):
+    """Sink de destination : base locale (--dsn) ou enregistrement en mémoire"""
+    if args.dsn:
+        sink = TimescaleSink(dsn=args.dsn)
+        if not sink.connect():
+            raise SystemExit("✗ Base locale injoignable")
+        return sink
+    return RecordingSink(args.db_latency_ms / 1000.0)
+
+
+def percentile(sorted_values, fraction):
+    """Percentile d'une liste triée"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(kind, strategy, items, args):
+    """Injecte les messages dans le gestionnaire et mesure chaque appel"""
+    sink = make_sink(args)
+    writer = create_writer(sink).start() if strategy == 'batch' else None
+    deadband = create_filter() if args.deadband else None
+
+    if kind == 'zigbee':
+        module = load_script('lire-capteurs-xiaomi-zigbee.py')
+        handler = module.Zigbee2MQTTHandler(args.sensors_dict, sink, writer, deadband)
+        handler.start_time = time.time()
+        call = lambda msg: handler.on_message(None, None, msg)
+    else:
+        module = load_script('lire-capteurs-xiaomi-broadcast.py')
+        handler = module.XiaomiAdvertisementScanner(args.sensors_dict, sink, continuous=True,
+                                                    writer=writer, deadband=deadband)
+        call = lambda dev: handler.handleDiscovery(dev, False, True)
+
+    latencies = []
+    perf_counter_ns = time.perf_counter_ns
+    output = open(os.devnull, 'w') if not args.verbose else None
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+        for item in items:
+            t0 = perf_counter_ns()
+            call(item)
+            latencies.append(perf_counter_ns() - t0)
+        ingest_elapsed = time.perf_counter() - started
+        if writer:
+            # Vider la file d'attente : compté dans le débit d'écriture
+            writer.stop(timeout=None)
+    total_elapsed = time.perf_counter() - started
+    if output:
+        output.close()
+
+    rows = writer.rows_written if writer else sink.rows_written
+    sink.close()
+    latencies.sort()
+    count = len(latencies)
+    print(f"{kind:6s}  {strategy:6s}  {count:7d} msg  "
+          f"{count / ingest_elapsed:9.0f} msg/s  "
+          f"p50 {percentile(latencies, 0.50) / 1000:8.1f} µs  "
+          f"p99 {percentile(latencies, 0.99) / 1000:8.1f} µs  "
+          f"{rows:7d} lignes  {rows / total_elapsed:9.0f} lignes/s")
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Banc de mesure de l'ingestion Zigbee2MQTT et BLE")
+    parser.add_argument('source', choices=('zigbee', 'ble'))
+    parser.add_argument('--messages', type=int, default=20000, help="nombre de messages synthétiques")
+    parser.add_argument('--sensors', type=int, default=300, help="nombre de capteurs simulés")
+    parser.add_argument('--unknown-ratio', type=float, default=0.2,
+                        help="zigbee : part de messages de capteurs inconnus")
+    parser.add_argument('--repeat', type=int, default=5, help="ble : répétitions de chaque mesure")
+    parser.add_argument('--capture', help="ble : fichier de publicités enregistrées")
+    parser.add_argument('--strategy', choices=STRATEGIES + ('all',), default='all',
+                        help="direct : écriture dans le callback, batch : écrivain par lots")
+    parser.add_argument('--dsn', help="base PostgreSQL locale (sinon sink d'enregistrement en mémoire)")
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help="latence simulée par écriture du sink d'enregistrement")
+    parser.add_argument('--deadband', action='store_true', help="activer le filtre config.DEADBAND")
+    parser.add_argument('--verbose', action='store_true', help="afficher la sortie des gestionnaires")
+    args = parser.parse_args()
+
+    if args.source == 'zigbee':
+        args.sensors_dict = {f"capteur_{i:04d}": f"Capteur {i}" for i in range(args.sensors)}
+    else:
+        args.sensors_dict = {
+            f"A4:C1:38:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}": f"Capteur {i}"
+            for i in range(args.sensors)
+        }
+
+    if args.capture:
+        args.sensors_dict = {}  # capture : tous les capteurs enregistrés
+
+    strategies = STRATEGIES if args.strategy == 'all' else (args.strategy,)
+    for strategy in strategies:
+        if args.source == 'zigbee':
+            items = list(zigbee_messages(args.messages, args.sensors_dict, args.unknown_ratio))
+        elif args.capture:
+            items = list(ble_capture(args.capture))
+        else:
+            items = list(ble_advertisements(args.messages, args.sensors_dict, args.repeat))
+        run(args.source, strategy, items, args)
+
+
+if __name__ == "__main__":
+    main()
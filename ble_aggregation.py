@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Agrégation des publicités BLE reçues par plusieurs passerelles
+- les scanners (--daemon --forward HÔTE:PORT) transmettent chaque nouvelle trame
+  au collecteur en UDP (un datagramme JSON par trame)
+- le collecteur (--collect) regroupe les copies d'une même mesure (MAC, compteur)
+  pendant BLE_AGGREGATION_WINDOW secondes et ne garde que la copie au meilleur RSSI
+"""
+
+import json
+import socket
+import time
+from datetime import datetime
+from ble_decoder import AdvertisementDecoder, frame_counter
+from metrics import REGISTRY
+
+# Métriques (voir metrics.py)
+FRAMES_RECEIVED = REGISTRY.counter('ble_collector_frames_total', "Trames reçues des passerelles")
+FRAMES_DUPLICATE = REGISTRY.counter('ble_collector_duplicates_total', "Copies écartées (même MAC et compteur)")
+GATEWAY_RSSI = REGISTRY.gauge_table('ble_gateway_rssi_dbm', "Dernier RSSI d'un capteur par passerelle",
+                                    ('sensor', 'gateway'))
+
+
+def parse_address(value, default_port=None):
+    """HÔTE:PORT -> (hôte, port)"""
+    host, _, port = value.rpartition(':')
+    if not host:
+        host, port = value, default_port
+    return host, int(port)
+
+
+class FrameForwarder:
+    """Transmet les trames d'une passerelle au collecteur (UDP, sans attente)"""
+
+    def __init__(self, address, gateway=None):
+        self.address = address
+        self.gateway = gateway or socket.gethostname()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.frames_sent = 0
+        self.errors = 0
+
+    def send(self, mac, data, rssi):
+        message = json.dumps({'gateway': self.gateway, 'mac': mac, 'data': data, 'rssi': rssi})
+        try:
+            self.socket.sendto(message.encode(), self.address)
+            self.frames_sent += 1
+        except OSError:
+            self.errors += 1  # collecteur injoignable : la trame est perdue
+
+    def close(self):
+        self.socket.close()
+
+
+class FrameAggregator:
+    """Déduplication des trames entre passerelles par (MAC, compteur)"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        # (MAC, UUID, compteur) -> [fin de la fenêtre, RSSI, MAC, trame, passerelle, horodatage]
+        self.pending = {}
+        # Copies arrivées après la fermeture de la fenêtre
+        self.decoder = AdvertisementDecoder()
+
+    def add(self, mac, data, rssi, gateway):
+        """Ajoute une copie reçue d'une passerelle"""
+        FRAMES_RECEIVED.inc()
+        GATEWAY_RSSI.set((mac, gateway), rssi)
+        counter = frame_counter(data)
+        key = (mac, data[:4], counter if counter is not None else data)
+        entry = self.pending.get(key)
+        if entry is not None:
+            FRAMES_DUPLICATE.inc()
+            if rssi > entry[1]:
+                entry[1], entry[3], entry[4] = rssi, data, gateway
+            return
+        if self.decoder.is_duplicate(mac, data):
+            FRAMES_DUPLICATE.inc()
+            return
+        # Horodatage de la première copie reçue
+        self.pending[key] = [time.monotonic() + self.window, rssi, mac, data, gateway, datetime.now()]
+
+    def expired(self, force=False):
+        """Trames dont la fenêtre est terminée (toutes si force)
+        Retourne une liste de (MAC, trame, RSSI, passerelle, horodatage)"""
+        if not self.pending:
+            return []
+        now = time.monotonic()
+        result = []
+        for key, (deadline, rssi, mac, data, gateway, timestamp) in list(self.pending.items()):
+            if force or now >= deadline:
+                del self.pending[key]
+                result.append((mac, data, rssi, gateway, timestamp))
+        return result
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Décodage des publicités BLE des capteurs Xiaomi LYWSD03MMC (firmware ATC/pvvx)
+Formats pris en charge (Service Data, valeur hexadécimale fournie par bluepy) :
+- ATC1441      UUID 0x181A, 13 octets, big endian
+- pvvx custom  UUID 0x181A, 15 octets, little endian
+- BTHome v2    UUID 0xFCD2, non chiffré
+Les répétitions d'une même mesure (même compteur) sont écartées avant tout
+décodage, directement sur la chaîne hexadécimale
+"""
+
+import struct
+
+# Préfixes hexadécimaux des UUID (little endian dans la trame)
+UUID_ATC = '1a18'
+UUID_BTHOME = 'd2fc'
+
+# Longueurs des trames (UUID compris) en caractères hexadécimaux
+ATC1441_HEX_LEN = 2 * (2 + 13)
+PVVX_HEX_LEN = 2 * (2 + 15)
+
+# MAC, température (0,1 °C), humidité %, batterie %, batterie mV, compteur
+ATC1441_STRUCT = struct.Struct('>6shBBHB')
+# MAC, température (0,01 °C), humidité (0,01 %), batterie mV, batterie %, compteur, flags
+PVVX_STRUCT = struct.Struct('<6shHHBBB')
+
+# BTHome v2 : identifiant d'objet -> (format struct, facteur, clé)
+BTHOME_OBJECTS = {
+    0x00: (struct.Struct('<B'), 1, 'counter'),
+    0x01: (struct.Struct('<B'), 1, 'battery'),
+    0x02: (struct.Struct('<h'), 0.01, 'temperature'),
+    0x03: (struct.Struct('<H'), 0.01, 'humidity'),
+    0x0C: (struct.Struct('<H'), 1, 'battery_mv'),  # 0,001 V = 1 mV
+    0x2E: (struct.Struct('<B'), 1, 'humidity'),
+    0x45: (struct.Struct('<h'), 0.1, 'temperature'),
+}
+# Autres objets connus (ignorés) : identifiant -> longueur en octets
+BTHOME_SKIP = {
+    0x04: 3, 0x05: 3, 0x06: 2, 0x07: 2, 0x08: 2, 0x09: 1, 0x0A: 3, 0x0B: 3,
+    0x0D: 2, 0x0E: 2, 0x0F: 1, 0x10: 1, 0x11: 1, 0x12: 2, 0x13: 2, 0x14: 2,
+    0x15: 1, 0x16: 1, 0x17: 1, 0x18: 1, 0x19: 1, 0x1A: 1, 0x1B: 1, 0x1C: 1,
+    0x1D: 1, 0x1E: 1, 0x1F: 1, 0x20: 1, 0x21: 1, 0x22: 1, 0x23: 1, 0x24: 1,
+    0x25: 1, 0x26: 1, 0x27: 1, 0x28: 1, 0x29: 1, 0x2A: 1, 0x2B: 1, 0x2C: 1,
+    0x2D: 1, 0x2F: 1, 0x3A: 1, 0x3D: 2, 0x3F: 2, 0x40: 2, 0x41: 2, 0x43: 2,
+    0x44: 2, 0x46: 1,
+}
+
+
+def frame_counter(data):
+    """Extrait le compteur de trame de la chaîne hexadécimale (sans la décoder)
+    Retourne None si le format n'a pas de compteur"""
+    prefix = data[:4]
+    if prefix == UUID_ATC:
+        if len(data) == ATC1441_HEX_LEN:
+            return data[28:30]
+        if len(data) == PVVX_HEX_LEN:
+            return data[30:32]
+    elif prefix == UUID_BTHOME and data[6:8] == '00':
+        # BTHome : l'objet "packet id" (0x00) est placé en premier
+        return data[8:10]
+    return None
+
+
+def decode_atc1441(raw):
+    """Décode une trame ATC1441 (UUID compris)"""
+    _, temp, humidity, battery, battery_mv, counter = ATC1441_STRUCT.unpack_from(raw, 2)
+    return {
+        'format': 'atc1441',
+        'temperature': temp / 10.0,
+        'humidity': humidity,
+        'battery': battery,
+        'battery_mv': battery_mv,
+        'counter': counter,
+    }
+
+
+def decode_pvvx(raw):
+    """Décode une trame pvvx custom (UUID compris)"""
+    _, temp, humidity, battery_mv, battery, counter, _ = PVVX_STRUCT.unpack_from(raw, 2)
+    return {
+        'format': 'pvvx',
+        'temperature': temp / 100.0,
+        'humidity': humidity / 100.0,
+        'battery': battery,
+        'battery_mv': battery_mv,
+        'counter': counter,
+    }
+
+
+def decode_bthome(raw):
+    """Décode une trame BTHome v2 non chiffrée (UUID compris)"""
+    device_info = raw[2]
+    if device_info & 0x01 or device_info >> 5 != 2:
+        return None  # chiffrée ou version non prise en charge
+    reading = {'format': 'bthome', 'counter': 0}
+    pos = 3
+    size = len(raw)
+    while pos < size:
+        object_id = raw[pos]
+        pos += 1
+        if object_id in BTHOME_OBJECTS:
+            fmt, factor, key = BTHOME_OBJECTS[object_id]
+            value = fmt.unpack_from(raw, pos)[0]
+            reading[key] = value * factor if factor != 1 else value
+            pos += fmt.size
+        elif object_id in BTHOME_SKIP:
+            pos += BTHOME_SKIP[object_id]
+        else:
+            break  # objet inconnu : longueur inconnue, arrêter là
+    if 'temperature' not in reading:
+        return None
+    return reading
+
+
+def decode(data):
+    """Décode la valeur hexadécimale d'un Service Data
+    Retourne un dictionnaire (temperature, humidity, battery, battery_mv, counter)
+    ou None si le format n'est pas reconnu"""
+    prefix = data[:4]
+    if prefix == UUID_ATC:
+        if len(data) == ATC1441_HEX_LEN:
+            return decode_atc1441(bytes.fromhex(data))
+        if len(data) == PVVX_HEX_LEN:
+            return decode_pvvx(bytes.fromhex(data))
+    elif prefix == UUID_BTHOME:
+        return decode_bthome(bytes.fromhex(data))
+    return None
+
+
+class AdvertisementDecoder:
+    """Décodeur avec élimination des trames répétées par (MAC, compteur)"""
+
+    def __init__(self):
+        self.last_counters = {}
+        self.frames_seen = 0
+        self.frames_duplicate = 0
+
+    def is_duplicate(self, mac, data):
+        """Vrai si la trame répète la précédente mesure de ce capteur"""
+        self.frames_seen += 1
+        counter = frame_counter(data)
+        if counter is None:
+            return False
+        key = (mac, data[:4])
+        if self.last_counters.get(key) == counter:
+            self.frames_duplicate += 1
+            return True
+        self.last_counters[key] = counter
+        return False
+
+    def feed(self, mac, data):
+        """Décode une trame si elle n'est pas une répétition, sinon None"""
+        if self.is_duplicate(mac, data):
+            return None
+        return decode(data)
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import psycopg2
 from datetime import datetime
 import time
 import random
@@ -9,10 +8,15 @@ import logging
 import sys
 import requests
 import os
+import threading
 from btlewrap import available_backends, BluepyBackend, GatttoolBackend, PygattBackend
 from mitemp_bt.mitemp_bt_poller import MiTempBtPoller, MI_TEMPERATURE, MI_HUMIDITY, MI_BATTERY
-from syslog import syslog
 import config
+from timescaledb_sink import get_sink, FAILED
+from sensor_schema import build_rows
+from last_values import LAST_VALUES
+from sensor_registry import SENSOR_REGISTRY
+from log_setup import fields, get_logger
  
  
 capteurs={
@@ -31,47 +35,15 @@ capteurs={
 }
  
 
-if len(sys.argv)!=2:
-    print(u'Paramètres attendus : ')
-    print(u'- Capteur : 1, 2, 3 ou 4')
-    exit()
-parametre = sys.argv[1]
- 
- 
-# Connexion à TimescaleDB
-connection_string = (
-    f"host={config.TIMESCALEDB_HOST} "
-    f"port={config.TIMESCALEDB_PORT} "
-    f"user={config.TIMESCALEDB_USER} "
-    f"password={config.TIMESCALEDB_PASSWORD} "
-    f"dbname={config.TIMESCALEDB_DATABASE} "
-    f"sslmode={config.TIMESCALEDB_SSLMODE}"
-)
-conn = psycopg2.connect(connection_string)
- 
- 
-def write_timescaledb(mac, capteur, measurement, value):
-    """Écrit les données dans TimescaleDB"""
-    try:
-        cursor = conn.cursor()
-        timestamp = datetime.now()
-        
-        # Insertion dans TimescaleDB
-        # Adapter le nom de la table selon votre schéma
-        query = """
-            INSERT INTO sensor_data (time, mac, capteur, measurement, value)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (timestamp, mac, capteur, measurement, value))
-        conn.commit()
-        cursor.close()
-        return True
-    except Exception as e:
-        print(f"Erreur lors de l'écriture dans TimescaleDB: {e}")
-        conn.rollback()
-        return False
- 
- 
+def load_capteurs():
+    """Capteurs de la section gatt de SENSORS_FILE (relu s'il a changé), sinon la table ci-dessus"""
+    return SENSOR_REGISTRY.sensors('gatt', capteurs)
+
+
+# Messages aussi envoyés à syslog (par le thread de journalisation)
+log = get_logger('gatt', use_syslog=True)
+
+
 def get_value(poller,MI):
     value=False
     try:
@@ -83,37 +55,131 @@ def get_value(poller,MI):
     return value
  
  
-for line in capteurs:
-    if line==parametre:
-        syslog(str(line)+u'...')
-        capteur = capteurs[line]
-        if 'mac' in capteur:
-            mac = capteur['mac']
-            poller = False
-            try:
-                poller = MiTempBtPoller(mac, BluepyBackend)
-            except:
-                print(line, mac, "Problème de communication avec le capteur")
-                
-
-                
-            if poller:
-                temperature = get_value(poller,MI_TEMPERATURE)
-                if temperature:
-                    write_timescaledb(mac, line, 'MI_TEMPERATURE', temperature)
-                humidity = get_value(poller,MI_HUMIDITY)
-                if humidity:
-                    write_timescaledb(mac, line, 'MI_HUMIDITY', humidity)
-                battery = get_value(poller,MI_BATTERY)
-                if battery:
-                    write_timescaledb(mac, line, 'MI_BATTERY', battery)
-                    
-                print(mac,poller,temperature,humidity,battery)
-                    
-                    
-                syslog(str(line)+u' : '+str(mac)+u' : '+str(temperature)+u' : '+str(humidity)+u' : '+str(battery))
-
-# Fermer la connexion à la fin
-conn.close()
+def poll_capteur(line, mac):
+    """Interroge un capteur et retourne les lignes à écrire dans TimescaleDB
+    (liste de (requête du sink, lignes))"""
+    rows = []
+    log.debug("interrogation", extra=fields(capteur=line, mac=mac))
+    poller = False
+    try:
+        poller = MiTempBtPoller(mac, BluepyBackend)
+    except:
+        log.warning("problème de communication avec le capteur", extra=fields(capteur=line, mac=mac))
+    
+    if poller:
+        temperature = get_value(poller,MI_TEMPERATURE)
+        humidity = get_value(poller,MI_HUMIDITY)
+        battery = get_value(poller,MI_BATTERY)
+        values = {
+            'temperature': temperature or None,
+            'humidity': humidity or None,
+            'battery': battery or None,
+        }
+        # Lignes selon le schéma configuré (sensor_data et/ou sensor_readings)
+        timestamp = datetime.now()
+        rows = build_rows(timestamp, mac, line, values)
+        LAST_VALUES.update('gatt', mac, dict(values, name=line, timestamp=timestamp))
+            
+        log.info("lecture", extra=fields(capteur=line, mac=mac, temperature=temperature,
+                                         humidity=humidity, battery=battery))
+    return rows
+ 
+ 
+# Interrogations abandonnées (timeout) dont le thread tourne encore : la
+# connexion BLE reste ouverte jusqu'à leur fin (pas d'annulation possible)
+abandoned = []
+
+
+def stuck_polls():
+    """Nombre d'interrogations abandonnées encore en cours"""
+    abandoned[:] = [thread for thread in abandoned if thread.is_alive()]
+    return len(abandoned)
+
+
+def poll_all(capteurs, timeout=30):
+    """Interroge tous les capteurs l'un après l'autre
+    btlewrap sérialise les connexions BLE d'un processus (verrou de classe) :
+    des interrogations en parallèle ne feraient qu'attendre ce verrou et
+    dépasseraient leur timeout sans avoir communiqué avec le capteur
+    Chaque interrogation a lieu dans un thread : un capteur qui ne répond pas en
+    timeout secondes est abandonné et son résultat éventuel arrivé plus tard est
+    ignoré. Une interrogation bloquée garde le verrou de connexion : les capteurs
+    suivants ne sont pas interrogés avant sa fin"""
+    results = {}
+    lock = threading.Lock()
+    ignored = set()   # capteurs abandonnés (et tous après la fin de l'appel)
+    
+    def worker(line, mac):
+        rows = poll_capteur(line, mac)
+        with lock:
+            if line not in ignored:
+                results[line] = rows
+    
+    pending = [(line, capteur['mac']) for line, capteur in capteurs.items() if 'mac' in capteur]
+    for index, (line, mac) in enumerate(pending):
+        if stuck_polls():
+            log.warning("connexion BLE occupée par une interrogation bloquée, capteurs non interrogés",
+                        extra=fields(capteurs=','.join(line for line, mac in pending[index:])))
+            break
+        # Thread démon : un capteur bloqué n'empêche pas le script de se terminer
+        thread = threading.Thread(target=worker, args=(line, mac), daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            log.warning("pas de réponse du capteur, abandon",
+                        extra=fields(capteur=line, mac=mac, timeout=timeout))
+            with lock:
+                ignored.add(line)
+            abandoned.append(thread)
+    
+    # Une seule écriture groupée pour tous les capteurs
+    with lock:
+        ignored.update(capteurs)
+        snapshot = dict(results)
+    rows = []
+    for line in sorted(snapshot):
+        rows.extend(snapshot[line])
+    return rows
+ 
+ 
+def write_rows(sink, rows):
+    """Écriture groupée des lignes (liste de (requête du sink, lignes)), une par requête
+    Retourne False si une écriture a échoué (lignes perdues)"""
+    rows_by_statement = {}
+    for statement, statement_rows in rows:
+        rows_by_statement.setdefault(statement, []).extend(statement_rows)
+    ok = True
+    for statement, statement_rows in rows_by_statement.items():
+        if sink.write(statement, statement_rows) == FAILED:
+            ok = False
+    return ok
+
+
+def main():
+    capteurs = load_capteurs()
+    if len(sys.argv)!=2 or (sys.argv[1] not in capteurs and sys.argv[1]!='tous'):
+        print(u'Paramètres attendus : ')
+        print(u'- Capteur : ' + ', '.join(capteurs))
+        print(u'- ou "tous" pour interroger tous les capteurs en une seule exécution')
+        exit()
+    parametre = sys.argv[1]
+
+    if parametre == 'tous':
+        rows = poll_all(
+            capteurs,
+            timeout=getattr(config, 'GATT_TIMEOUT', 30),
+        )
+    else:
+        capteur = capteurs[parametre]
+        rows = poll_capteur(parametre, capteur['mac']) if 'mac' in capteur else []
+
+    # Connexion à TimescaleDB (journal local si injoignable) et écriture groupée
+    sink = get_sink()
+    write_rows(sink, rows)
+
+    # Fermer la connexion à la fin
+    sink.close()
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Agent de collecte : un seul processus pour toutes les sources de mesures
+(au lieu d'un script lancé par cron pour chacune)
+- une seule connexion TimescaleDB (journal local si injoignable) partagée par les plugins
+- chaque plugin périodique est exécuté dans son propre thread toutes les interval
+  secondes (une interrogation GATT lente ne retarde pas la lecture du DHT22)
+- les plugins continus (BLE, Zigbee2MQTT) sont relancés après une erreur
+Les plugins sont décrits dans collector_plugins.py et activés par config.COLLECTOR_PLUGINS
+
+Usage:
+  python3 collector-agent.py                   # plugins de config.COLLECTOR_PLUGINS
+  python3 collector-agent.py --only dht22 gatt # sous-ensemble des plugins configurés
+  python3 collector-agent.py --once            # une exécution des plugins périodiques (test)
+"""
+
+import argparse
+import signal
+import sys
+import threading
+import time
+import traceback
+import config
+from timescaledb_sink import get_sink
+from collector_plugins import create_plugins
+import metrics
+import last_values
+import profiling
+from metrics import REGISTRY
+
+# Métriques (voir metrics.py)
+RUNS = REGISTRY.counter('collector_runs_total', "Exécutions des plugins périodiques")
+ERRORS = REGISTRY.counter('collector_errors_total', "Exécutions de plugins en erreur")
+RUN_SECONDS = REGISTRY.gauge_table('collector_run_seconds', "Durée de la dernière exécution", ('plugin',))
+LAST_SUCCESS = REGISTRY.gauge_table('collector_last_success_timestamp_seconds',
+                                    "Fin de la dernière exécution réussie (epoch)", ('plugin',))
+
+
+class PluginRunner:
+    """Exécution d'un plugin dans un thread dédié"""
+
+    def __init__(self, plugin, sink, stop_event, retry_delay=30.0):
+        self.plugin = plugin
+        self.sink = sink
+        self.stop_event = stop_event
+        self.retry_delay = retry_delay
+        self.thread = None
+        self.ready = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f"plugin-{self.plugin.name}", daemon=True)
+        self.thread.start()
+        return self
+
+    def setup(self):
+        """Chargement du plugin, réessayé jusqu'à ce qu'il réussisse (matériel absent au démarrage)"""
+        while not self.ready and not self.stop_event.is_set():
+            try:
+                self.plugin.setup()
+                self.ready = True
+            except Exception as e:
+                ERRORS.inc()
+                print(f"✗ {self.plugin.name} : initialisation impossible ({e}), nouvel essai dans {self.retry_delay} s")
+                self.stop_event.wait(self.retry_delay)
+        return self.ready
+
+    def run_once(self):
+        """Une exécution du plugin périodique (les erreurs sont affichées, pas propagées)"""
+        started = time.monotonic()
+        try:
+            self.plugin.poll(self.sink)
+            LAST_SUCCESS.set((self.plugin.name,), round(time.time(), 3))
+        except Exception:
+            ERRORS.inc()
+            print(f"✗ {self.plugin.name} : erreur pendant l'exécution")
+            traceback.print_exc()
+        finally:
+            RUNS.inc()
+            RUN_SECONDS.set((self.plugin.name,), round(time.monotonic() - started, 3))
+
+    def _run(self):
+        if not self.setup():
+            return
+        try:
+            if self.plugin.continuous:
+                self._listen()
+            else:
+                self._poll()
+        finally:
+            try:
+                self.plugin.close()
+            except Exception as e:
+                print(f"✗ {self.plugin.name} : fermeture ({e})")
+
+    def _poll(self):
+        # Cadence fixe : l'exécution suivante est prévue interval secondes après
+        # le début de la précédente ; une exécution trop longue décale le planning
+        next_run = time.monotonic()
+        while not self.stop_event.is_set():
+            self.run_once()
+            next_run += self.plugin.interval
+            now = time.monotonic()
+            if next_run < now:
+                print(f"⚠️  {self.plugin.name} : exécution plus longue que l'intervalle ({self.plugin.interval} s)")
+                next_run = now
+            self.stop_event.wait(next_run - now)
+
+    def _listen(self):
+        while not self.stop_event.is_set():
+            try:
+                self.plugin.listen(self.sink, self.stop_event)
+            except Exception:
+                ERRORS.inc()
+                print(f"✗ {self.plugin.name} : erreur de la source continue")
+                traceback.print_exc()
+            if not self.stop_event.is_set():
+                print(f"⏱️  {self.plugin.name} : relance dans {self.retry_delay} s")
+                self.stop_event.wait(self.retry_delay)
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Agent de collecte multi-sources vers TimescaleDB")
+    parser.add_argument('--only', nargs='+', metavar='PLUGIN', help="plugins configurés à exécuter")
+    parser.add_argument('--once', action='store_true',
+                        help="une exécution de chaque plugin périodique puis arrêt")
+    parser.add_argument('--profile', metavar='MODES',
+                        help="profilage : timers, cprofile, tracemalloc ou all (voir profiling.py)")
+    args = parser.parse_args()
+
+    # Profilage à la demande (--profile ou TELEGRAF_PROFILE) ; les plugins
+    # instrumentent les fonctions de leur script au chargement
+    profiling.start_from_config(args.profile, 'collector')
+    profiling.instrument(profiling.sink_methods())
+
+    plugins = create_plugins()
+    if args.only:
+        plugins = [plugin for plugin in plugins if plugin.name in args.only]
+    if args.once:
+        plugins = [plugin for plugin in plugins if not plugin.continuous]
+    if not plugins:
+        print("✗ Aucun plugin configuré (COLLECTOR_PLUGINS dans config.py)")
+        sys.exit(1)
+
+    # Une seule connexion pour tous les plugins (reconnexion et journal local)
+    sink = get_sink()
+    stop_event = threading.Event()
+    retry_delay = getattr(config, 'COLLECTOR_RETRY_DELAY', 30.0)
+    runners = [PluginRunner(plugin, sink, stop_event, retry_delay) for plugin in plugins]
+
+    try:
+        if args.once:
+            # Test : une erreur d'initialisation est affichée telle quelle
+            for runner in runners:
+                runner.plugin.setup()
+                runner.run_once()
+                runner.plugin.close()
+            return
+
+        metrics.start_from_config()
+        last_values.start_from_config()
+        # systemd arrête le service par SIGTERM
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        for runner in runners:
+            description = 'continu' if runner.plugin.continuous else f"toutes les {runner.plugin.interval:g} s"
+            print(f"▶️  {runner.plugin.name} ({description})")
+            runner.start()
+        while not stop_event.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        print("\n⚠️  Interruption")
+    finally:
+        stop_event.set()
+        for runner in runners:
+            if runner.thread:
+                runner.thread.join(timeout=15.0)
+        sink.close()
+        print("✓ Déconnexion TimescaleDB")
+
+
+if __name__ == "__main__":
+    main()
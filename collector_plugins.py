@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Sources de mesures de l'agent de collecte (collector-agent.py)
+Chaque source existante devient un plugin qui réutilise les fonctions de son script :
+- dht22     : DHT22 de la machine (get-temperature-humidity-timescaledb.py), périodique
+- gatt      : capteurs MiTemp interrogés en GATT (capteur-temperature-to-timescaledb.py), périodique
+- ble       : publicités BLE ATC/BTHome (lire-capteurs-xiaomi-broadcast.py), continu
+- zigbee    : capteurs Zigbee2MQTT (lire-capteurs-xiaomi-zigbee.py), continu
+- file_info : informations de fichiers (file-info-to-timescaledb.py), périodique
+
+Un plugin périodique implémente poll(sink), appelé toutes les interval secondes ;
+un plugin continu implémente listen(sink, stop_event), qui rend la main à l'arrêt
+Les dépendances matérielles (board, bluepy, btlewrap, paho) ne sont importées
+que par setup(), pour les seuls plugins activés
+"""
+
+import os
+import socket
+from datetime import datetime, timezone
+import config
+from deadband import create_filter
+from last_values import LAST_VALUES
+from timescaledb_sink import FAILED
+import profiling
+from sensor_registry import SENSOR_REGISTRY
+from script_loader import load_script
+
+
+class CollectorPlugin:
+    """Source de mesures de l'agent de collecte"""
+
+    name = None
+    default_interval = 60.0
+    # Source continue (listen) plutôt que périodique (poll)
+    continuous = False
+
+    def __init__(self, options=None):
+        self.options = dict(options or {})
+        self.interval = float(self.options.get('interval', self.default_interval))
+
+    def setup(self):
+        """Chargement du script et ouverture du matériel (une fois, avant la première exécution)"""
+
+    def poll(self, sink):
+        """Interrogation périodique : écrit les mesures dans le sink partagé
+        Lève une exception si l'écriture a échoué (exécution comptée en erreur)"""
+        raise NotImplementedError
+
+    def listen(self, sink, stop_event):
+        """Source continue : écrit les mesures jusqu'à ce que stop_event soit positionné"""
+        raise NotImplementedError
+
+    def close(self):
+        """Libère les ressources (capteur, fichiers)"""
+
+
+class DHT22Plugin(CollectorPlugin):
+    """DHT22 de la machine : médiane de plusieurs lectures (voir dht_sampler.py)"""
+
+    name = 'dht22'
+    default_interval = 60.0
+
+    def setup(self):
+        import board
+        import adafruit_dht
+        self.script = load_script('get-temperature-humidity-timescaledb.py')
+        self.device = adafruit_dht.DHT22(getattr(board, self.options.get('pin', 'D4')))
+        self.hostname = socket.gethostname()
+        # Processus longue durée : état de la bande morte en mémoire
+        self.deadband = create_filter()
+
+    def poll(self, sink):
+        result = self.script.read_sensor(self.device)
+        if result['samples'] < getattr(config, 'DHT22_MIN_SAMPLES', 1):
+            print(f"⚠️  DHT22 : {result['samples']} lecture(s) valide(s), {result['errors']} erreur(s)")
+            return
+        timestamp = datetime.now(timezone.utc)
+        LAST_VALUES.update('dht22', self.hostname, {
+            'name': self.hostname, 'temperature': result['temperature'], 'humidity': result['humidity'],
+            'samples': result['samples'], 'timestamp': timestamp})
+        rows = []
+        for measurement in ('temperature', 'humidity'):
+            value = result[measurement]
+            if self.deadband is None or self.deadband.allow(self.hostname, measurement, value):
+                rows.append((timestamp, self.hostname, measurement, value))
+        if rows:
+            rows.append((timestamp, self.hostname, 'samples', result['samples']))
+            if sink.write('sensor_data_host', rows) == FAILED:
+                # Lignes perdues : ne pas filtrer la prochaine valeur
+                if self.deadband:
+                    self.deadband.forget_rows('sensor_data_host', rows)
+                raise RuntimeError("écriture DHT22 en échec")
+
+    def close(self):
+        self.device.exit()
+
+
+class GattPlugin(CollectorPlugin):
+    """Capteurs MiTemp interrogés en GATT (une connexion BLE à la fois, voir poll_all)"""
+
+    name = 'gatt'
+    default_interval = 300.0
+
+    def setup(self):
+        self.script = load_script('capteur-temperature-to-timescaledb.py')
+
+    def poll(self, sink):
+        # Les interrogations abandonnées ne peuvent pas être annulées : attendre
+        # leur fin plutôt que d'ouvrir de nouvelles connexions BLE à chaque cycle
+        stuck = self.script.stuck_polls()
+        if stuck:
+            raise RuntimeError(f"{stuck} interrogation(s) GATT bloquée(s) encore en cours, cycle sauté")
+        rows = self.script.poll_all(
+            # Registre relu à chaque exécution (section gatt de SENSORS_FILE)
+            self.options.get('sensors') or self.script.load_capteurs(),
+            timeout=getattr(config, 'GATT_TIMEOUT', 30),
+        )
+        if not self.script.write_rows(sink, rows):
+            raise RuntimeError("écriture des lectures GATT en échec")
+
+
+class BroadcastPlugin(CollectorPlugin):
+    """Publicités BLE des capteurs ATC1441 / pvvx / BTHome en scan passif continu"""
+
+    name = 'ble'
+    continuous = True
+
+    def setup(self):
+        self.script = load_script('lire-capteurs-xiaomi-broadcast.py')
+        profiling.instrument(self.script.PROFILED_METHODS)
+
+    def listen(self, sink, stop_event):
+        # Option sensors : liste fixe, non remplacée par le registre rechargé à chaud
+        sensors = self.options.get('sensors')
+        self.script.scan_daemon(
+            sensors or SENSOR_REGISTRY.sensors('bluetooth'), sink=sink,
+            restart_interval=getattr(config, 'BLE_SCAN_RESTART_INTERVAL', 600),
+            stop_event=stop_event, watch=not sensors,
+        )
+
+
+class ZigbeePlugin(CollectorPlugin):
+    """Capteurs Zigbee via les messages MQTT de Zigbee2MQTT"""
+
+    name = 'zigbee'
+    continuous = True
+
+    def setup(self):
+        self.script = load_script('lire-capteurs-xiaomi-zigbee.py')
+        profiling.instrument(self.script.PROFILED_METHODS)
+
+    def listen(self, sink, stop_event):
+        sensors = self.options.get('sensors')
+        self.script.listen_mqtt(sensors or SENSOR_REGISTRY.sensors('zigbee'), sink=sink,
+                                stop_event=stop_event, watch=not sensors)
+
+
+class FileInfoPlugin(CollectorPlugin):
+    """Informations de fichiers : cibles (fichier, dossier ou glob) et/ou manifeste"""
+
+    name = 'file_info'
+    default_interval = 3600.0
+
+    def setup(self):
+        self.script = load_script('file-info-to-timescaledb.py')
+        self.cache = self.script.StatCache(
+            self.options.get('cache') or getattr(config, 'FILE_INFO_CACHE', self.script.DEFAULT_CACHE_PATH))
+
+    def targets(self):
+        """Cibles (cible, name) ; le manifeste est relu à chaque exécution"""
+        targets = [(target, None) if isinstance(target, str) else tuple(target)
+                   for target in self.options.get('targets', ())]
+        manifest = self.options.get('manifest')
+        if manifest and os.path.exists(manifest):
+            targets.extend(self.script.read_manifest(manifest))
+        return targets
+
+    def poll(self, sink):
+        file_infos, skipped, errors = self.script.collect(
+            self.targets(), self.options.get('name'), self.options.get('recursive', False), self.cache,
+            self.options.get('heartbeat', getattr(config, 'FILE_INFO_HEARTBEAT', None)))
+        written = self.script.write_file_infos(
+            file_infos, self.cache,
+            self.options.get('fingerprint', getattr(config, 'FILE_INFO_FINGERPRINT', False)),
+            getattr(config, 'FILE_INFO_HASH_WORKERS', 4), sink)
+        if errors:
+            print(f"⚠️  file_info : {errors} fichiers illisibles")
+        if not written:
+            raise RuntimeError(f"écriture de {len(file_infos)} fichiers en échec")
+
+
+# Nom dans config.COLLECTOR_PLUGINS -> classe du plugin
+PLUGINS = {plugin.name: plugin for plugin in (DHT22Plugin, GattPlugin, BroadcastPlugin, ZigbeePlugin, FileInfoPlugin)}
+
+
+def create_plugins(plugins_config=None):
+    """Plugins configurés par config.COLLECTOR_PLUGINS ({nom: options})"""
+    if plugins_config is None:
+        plugins_config = getattr(config, 'COLLECTOR_PLUGINS', {})
+    plugins = []
+    for name, options in plugins_config.items():
+        if name not in PLUGINS:
+            raise ValueError(f"Plugin inconnu: {name} (disponibles : {', '.join(PLUGINS)})")
+        plugins.append(PLUGINS[name](options))
+    return plugins
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Filtre d'enregistrement par bande morte (deadband) avec battement de cœur
+Une mesure n'est écrite que si elle s'écarte de la dernière valeur écrite
+de plus que la bande morte, ou si le dernier enregistrement est plus ancien
+que l'intervalle de battement de cœur (heartbeat)
+La valeur est mémorisée dès qu'elle est acceptée : une écriture perdue (file
+d'attente pleine, erreur) doit être signalée par forget() / forget_rows() pour
+que la valeur suivante soit écrite ; sinon l'écart est borné par le heartbeat
+"""
+
+import json
+import os
+import threading
+import time
+import config
+
+DEFAULT_STATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class DeadbandFilter:
+    """Dernière valeur écrite par (capteur, mesure) et décision d'écriture"""
+
+    def __init__(self, deadbands, heartbeat=900, default_deadband=0.0, state_path=None):
+        self.deadbands = dict(deadbands)
+        self.heartbeat = heartbeat
+        self.default_deadband = default_deadband
+        # Fichier d'état pour les scripts lancés par cron (sinon mémoire seule)
+        self.state_path = state_path
+        self.last = {}
+        # last est modifié par les threads de réception (allow) et d'écriture (forget)
+        self.lock = threading.Lock()
+        self.rows_kept = 0
+        self.rows_skipped = 0
+        if state_path:
+            self.load()
+
+    def allow(self, sensor, measurement, value, now=None):
+        """Vrai si la valeur doit être écrite (et la mémorise comme dernière valeur)"""
+        if value is None:
+            return False
+        now = time.time() if now is None else now
+        key = f"{sensor}|{measurement}"
+        with self.lock:
+            previous = self.last.get(key)
+            if previous is not None:
+                last_value, last_time = previous
+                deadband = self.deadbands.get(measurement, self.default_deadband)
+                if abs(value - last_value) < deadband and now - last_time < self.heartbeat:
+                    self.rows_skipped += 1
+                    return False
+            self.last[key] = (value, now)
+            self.rows_kept += 1
+        return True
+
+    def forget(self, sensor, measurement=None):
+        """Oublie la dernière valeur écrite (toutes les mesures du capteur par défaut)
+        À appeler quand l'écriture d'une valeur acceptée a échoué"""
+        with self.lock:
+            if measurement is not None:
+                self.last.pop(f"{sensor}|{measurement}", None)
+                return
+            prefix = f"{sensor}|"
+            for key in [key for key in self.last if key.startswith(prefix)]:
+                del self.last[key]
+
+    def forget_rows(self, statement, rows):
+        """Oublie les valeurs de lignes non écrites (rappel d'écriture perdue)
+        Lignes par mesure (time, capteur, ..., mesure, valeur) ; sensor_readings :
+        une ligne par lecture, toutes les mesures du capteur"""
+        for row in rows:
+            if statement == 'sensor_readings':
+                self.forget(row[1])
+            else:
+                self.forget(row[1], row[-2])
+
+    def filter_rows(self, sensor, rows, measurement_index=-2, value_index=-1):
+        """Ne garde que les lignes à écrire (mesure et valeur en fin de ligne par défaut)"""
+        return [row for row in rows if self.allow(sensor, row[measurement_index], row[value_index])]
+
+    def load(self):
+        """Charge l'état depuis le fichier (ignoré s'il est absent ou illisible)"""
+        try:
+            with open(self.state_path) as f:
+                self.last = {key: tuple(value) for key, value in json.load(f).items()}
+        except (OSError, ValueError):
+            self.last = {}
+
+    def save(self):
+        """Enregistre l'état dans le fichier (écriture atomique)"""
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with self.lock:
+            state = dict(self.last)
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def create_filter(state_name=None):
+    """Crée le filtre configuré par config.DEADBAND (None si désactivé)
+    state_name : nom du fichier d'état pour un script lancé par cron"""
+    deadbands = getattr(config, 'DEADBAND', None)
+    if not deadbands:
+        return None
+    state_path = None
+    if state_name:
+        state_dir = getattr(config, 'DEADBAND_STATE_DIR', DEFAULT_STATE_DIR)
+        state_path = os.path.join(state_dir, f"deadband-{state_name}.json")
+    return DeadbandFilter(
+        deadbands,
+        heartbeat=getattr(config, 'DEADBAND_HEARTBEAT', 900),
+        state_path=state_path,
+    )
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Échantillonnage du capteur DHT22 dans un budget de temps
+- plusieurs lectures espacées d'au moins 2,1 secondes après la fin de la lecture
+  précédente (adafruit_dht renvoie les valeurs en cache dans les 2 secondes qui
+  suivent une lecture : une lecture plus rapprochée serait un doublon)
+- les erreurs de lecture (RuntimeError : checksum, timeout) sont réessayées
+- les valeurs hors plage ou trop éloignées de la médiane sont écartées
+- le résultat est la médiane des lectures retenues, avec leur nombre
+"""
+
+import statistics
+import time
+
+# Plage de mesure du DHT22
+TEMPERATURE_RANGE = (-40.0, 80.0)
+HUMIDITY_RANGE = (0.0, 100.0)
+
+# Écart maximum à la médiane (en plus de 3 écarts absolus médians)
+MAX_DEVIATION = {'temperature': 2.0, 'humidity': 5.0}
+
+# Intervalle minimum entre la fin d'une lecture et la suivante (secondes)
+MIN_INTERVAL = 2.1
+
+
+def in_range(temperature, humidity):
+    """Vrai si la lecture est dans la plage du capteur"""
+    return (TEMPERATURE_RANGE[0] <= temperature <= TEMPERATURE_RANGE[1]
+            and HUMIDITY_RANGE[0] <= humidity <= HUMIDITY_RANGE[1])
+
+
+def reject_outliers(values, max_deviation):
+    """Écarte les valeurs trop éloignées de la médiane (à partir de 3 valeurs)"""
+    if len(values) < 3:
+        return values
+    median = statistics.median(values)
+    mad = statistics.median(abs(value - median) for value in values)
+    limit = max(3 * mad, max_deviation)
+    return [value for value in values if abs(value - median) <= limit]
+
+
+def sample(read, samples=5, budget=15.0, interval=MIN_INTERVAL):
+    """Lit le capteur jusqu'à samples fois en budget secondes
+    read() retourne (température, humidité) et lève RuntimeError en cas d'échec
+    Retourne un dictionnaire : temperature, humidity (médianes ou None),
+    samples (lectures retenues), errors, rejected"""
+    interval = max(interval, MIN_INTERVAL)
+    deadline = time.monotonic() + budget
+    readings = []
+    errors = 0
+    rejected = 0
+    while len(readings) < samples:
+        try:
+            temperature, humidity = read()
+            if temperature is None or humidity is None or not in_range(temperature, humidity):
+                rejected += 1
+            else:
+                readings.append((temperature, humidity))
+        except RuntimeError:
+            errors += 1  # erreur fréquente du DHT22 : nouvel essai
+        # Intervalle compté depuis la fin de la lecture (horodatage du cache du pilote)
+        finished = time.monotonic()
+        if len(readings) >= samples or finished + interval > deadline:
+            break
+        time.sleep(interval)
+
+    temperatures = reject_outliers([t for t, h in readings], MAX_DEVIATION['temperature'])
+    humidities = reject_outliers([h for t, h in readings], MAX_DEVIATION['humidity'])
+    rejected += len(readings) - min(len(temperatures), len(humidities))
+    return {
+        'temperature': round(statistics.median(temperatures), 2) if temperatures else None,
+        'humidity': round(statistics.median(humidities), 2) if humidities else None,
+        'samples': min(len(temperatures), len(humidities)),
+        'errors': errors,
+        'rejected': rejected,
+    }
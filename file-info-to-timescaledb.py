@@ -1,21 +1,65 @@
 #!/usr/bin/env python3
-import psycopg2
+"""
+Informations de fichiers (date de modification, taille) envoyées dans TimescaleDB
+
+Usage:
+  python3 file-info-to-timescaledb.py <chemin_du_fichier> <name>
+  python3 file-info-to-timescaledb.py --name sauvegardes /srv/backups '/srv/db/*.dump' [--recursive]
+  python3 file-info-to-timescaledb.py --manifest fichiers.txt
+
+Manifeste : une cible par ligne "<fichier|dossier|glob> [name]" (# pour un commentaire)
+Les dossiers sont parcourus avec os.scandir ; toutes les lignes sont écrites en
+un seul lot. Avec FILE_INFO_HEARTBEAT, un fichier inchangé (même inode, date de
+modification et taille que lors de la dernière écriture) n'est réécrit qu'après
+FILE_INFO_HEARTBEAT secondes
+
+Avec --fingerprint (ou FILE_INFO_FINGERPRINT), une empreinte du contenu est
+écrite dans la colonne fingerprint (ALTER TABLE file_info ADD COLUMN fingerprint TEXT).
+Elle est calculée par blocs (lectures de FILE_INFO_CHUNK_SIZE octets) avec
+xxhash si installé (pip install xxhash), sinon blake2b, dans un pool de threads,
+et n'est recalculée que si l'inode, la date de modification ou la taille change
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import argparse
+import glob
+import hashlib
+import json
 import sys
 import os
 import socket
+import time
 import config
+from timescaledb_sink import TimescaleSink, FAILED
+from spool import Spool
+
+# Cache local : chemin -> [inode, mtime (ns), taille, dernière écriture (epoch), empreinte]
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'file-info-cache.json')
 
+# Empreinte du contenu : hachage rapide non cryptographique si disponible
+try:
+    import xxhash
+    HASH_NAME = 'xxh3'
+    new_hash = xxhash.xxh3_64
+except ImportError:
+    HASH_NAME = 'blake2b'
 
-def get_file_info(file_path, name):
-    """Récupère les informations d'un fichier"""
+    def new_hash(data=b''):
+        return hashlib.blake2b(data, digest_size=16)
+
+# Pas de mmap : un fichier tronqué pendant le hachage (sauvegarde ou journal
+# réécrit) provoquerait un SIGBUS, fatal pour le processus
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def get_file_info(file_path, name, file_stats=None):
+    """Récupère les informations d'un fichier
+    file_stats : résultat de stat déjà connu (parcours d'un dossier)"""
     try:
-        if not os.path.exists(file_path):
-            print(f"Erreur: Le fichier '{file_path}' n'existe pas")
-            return None
-        
         # Récupérer les statistiques du fichier
-        file_stats = os.stat(file_path)
+        if file_stats is None:
+            file_stats = os.stat(file_path)
         
         # Date de dernière modification (timestamp)
         modification_time = datetime.fromtimestamp(file_stats.st_mtime)
@@ -35,87 +79,294 @@ def get_file_info(file_path, name):
             'name': name,
             'hostname': hostname,
             'modification_time': modification_time,
-            'file_size': file_size
+            'file_size': file_size,
+            'stat': file_stats
         }
+    except FileNotFoundError:
+        print(f"Erreur: Le fichier '{file_path}' n'existe pas")
+        return None
     except Exception as e:
         print(f"Erreur lors de la récupération des informations du fichier: {e}")
         return None
 
 
-def write_to_timescaledb(file_info):
-    """Écrit les informations du fichier dans TimescaleDB"""
+def print_file_info(file_info):
+    """Affiche les informations du fichier"""
+    # Formater la date (YYYY-MM-DD HH:MM)
+    date_formatted = file_info['modification_time'].strftime('%Y-%m-%d %H:%M')
+    
+    # Convertir la taille en Mo
+    size_mb = file_info['file_size'] / (1024 * 1024)
+    
+    print(f"Host: {file_info['hostname']} | Name: {file_info['name']} | Fichier: {file_info['file_name']} | Dernière modification: {date_formatted} | Taille: {size_mb:.1f} Mo")
+
+
+def file_fingerprint(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Empreinte du contenu : hachage des empreintes de blocs de chunk_size octets
+    (lectures dans un tampon réutilisé : un fichier tronqué donne une erreur ou une
+    empreinte du contenu lu, jamais l'arrêt du processus)"""
+    combined = new_hash()
+    with open(file_path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            combined.update(new_hash(view[:count]).digest())
+    return f"{HASH_NAME}/{chunk_size // 1024}k:{combined.hexdigest()}"
+
+
+def add_fingerprints(file_infos, cache=None, workers=4, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Ajoute l'empreinte de chaque fichier (reprise du cache si le fichier est inchangé)"""
+    to_hash = []
+    for file_info in file_infos:
+        cached = cache.fingerprint(file_info['file_path'], file_info['stat']) if cache else None
+        if cached and cached.startswith(f"{HASH_NAME}/{chunk_size // 1024}k:"):
+            file_info['fingerprint'] = cached
+        else:
+            to_hash.append(file_info)
+
+    def compute(file_info):
+        try:
+            return file_fingerprint(file_info['file_path'], chunk_size)
+        except OSError as e:
+            print(f"Erreur lors du calcul de l'empreinte de '{file_info['file_path']}': {e}")
+            return None
+
+    # Le hachage libère le GIL : les fichiers sont lus et hachés en parallèle
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for file_info, fingerprint in zip(to_hash, executor.map(compute, to_hash)):
+            file_info['fingerprint'] = fingerprint
+    return len(to_hash)
+
+
+def file_info_row(file_info, timestamp, fingerprint=False):
+    """Ligne file_info de TimescaleDB"""
+    row = (
+        timestamp,
+        file_info['file_path'],
+        file_info['file_name'],
+        file_info['name'],
+        file_info['hostname'],
+        file_info['modification_time'],
+        file_info['file_size']
+    )
+    if fingerprint:
+        row += (file_info.get('fingerprint'),)
+    return row
+
+
+def write_to_timescaledb(file_infos, fingerprint=False, sink=None):
+    """Écrit les informations des fichiers dans TimescaleDB (un seul lot)
+    sink : connexion partagée (laissée ouverte), sinon une connexion le temps de l'écriture"""
+    if isinstance(file_infos, dict):
+        file_infos = [file_infos]
+    timestamp = datetime.now()
+    rows = [file_info_row(file_info, timestamp, fingerprint) for file_info in file_infos]
+    statement = 'file_info_fingerprint' if fingerprint else 'file_info'
+    
+    # Connexion à TimescaleDB (journal local si injoignable)
+    own_sink = sink is None
+    if own_sink:
+        sink = TimescaleSink(spool=Spool())
     try:
-        # Connexion à TimescaleDB
-        connection_string = (
-            f"host={config.TIMESCALEDB_HOST} "
-            f"port={config.TIMESCALEDB_PORT} "
-            f"user={config.TIMESCALEDB_USER} "
-            f"password={config.TIMESCALEDB_PASSWORD} "
-            f"dbname={config.TIMESCALEDB_DATABASE} "
-            f"sslmode={config.TIMESCALEDB_SSLMODE}"
-        )
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        timestamp = datetime.now()
-        
-        # Insertion dans TimescaleDB
-        query = """
-            INSERT INTO file_info (time, file_path, file_name, name, host, modification_time, file_size)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (
-            timestamp,
-            file_info['file_path'],
-            file_info['file_name'],
-            file_info['name'],
-            file_info['hostname'],
-            file_info['modification_time'],
-            file_info['file_size']
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        # Formater la date (YYYY-MM-DD HH:MM)
-        date_formatted = file_info['modification_time'].strftime('%Y-%m-%d %H:%M')
-        
-        # Convertir la taille en Mo
-        size_mb = file_info['file_size'] / (1024 * 1024)
-        
-        print(f"Host: {file_info['hostname']} | Name: {file_info['name']} | Fichier: {file_info['file_name']} | Dernière modification: {date_formatted} | Taille: {size_mb:.1f} Mo")
-        
+        if own_sink and not sink.connect():
+            print(f"Écriture dans le journal local ({sink.spool.path})")
+        if sink.write(statement, rows) == FAILED:
+            return False
+        for file_info in file_infos:
+            print_file_info(file_info)
         return True
-    except Exception as e:
-        print(f"Erreur lors de l'écriture dans TimescaleDB: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
+    finally:
+        if own_sink:
+            sink.close()
+
+
+class StatCache:
+    """Dernier état écrit de chaque fichier, conservé entre deux exécutions"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Cache illisible, ignoré ({self.path}): {e}")
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def key(file_stats):
+        return [file_stats.st_ino, file_stats.st_mtime_ns, file_stats.st_size]
+
+    def unchanged(self, file_path, file_stats):
+        """Vrai si le fichier est identique à la dernière écriture"""
+        entry = self.entries.get(file_path)
+        return entry is not None and entry[:3] == self.key(file_stats)
+
+    def last_written(self, file_path):
+        entry = self.entries.get(file_path)
+        return entry[3] if entry else 0
+
+    def fingerprint(self, file_path, file_stats):
+        """Empreinte connue si le fichier n'a pas changé"""
+        entry = self.entries.get(file_path)
+        if entry is not None and len(entry) > 4 and entry[:3] == self.key(file_stats):
+            return entry[4]
+        return None
+
+    def update(self, file_path, file_stats, written_at, fingerprint=None):
+        self.entries[file_path] = self.key(file_stats) + [written_at, fingerprint]
+
+
+def scan_directory(path, recursive=False):
+    """Fichiers d'un dossier avec leur stat (os.scandir)"""
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        yield entry.path, entry.stat()
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        yield from scan_directory(entry.path, recursive)
+                except OSError as e:
+                    print(f"Erreur: {entry.path}: {e}")
+    except OSError as e:
+        print(f"Erreur: Le dossier '{path}' n'est pas lisible: {e}")
+
+
+def iter_target(target, recursive=False):
+    """Fichiers d'une cible : fichier, dossier ou motif glob -> (chemin, stat ou None)"""
+    if glob.has_magic(target):
+        for path in sorted(glob.iglob(target, recursive=True)):
+            if os.path.isdir(path):
+                yield from scan_directory(path, recursive)
+            else:
+                yield path, None
+    elif os.path.isdir(target):
+        yield from scan_directory(target, recursive)
+    else:
+        yield target, None
+
+
+def read_manifest(path):
+    """Cibles d'un manifeste : (cible, name ou None)"""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 1)
+            targets.append((fields[0], fields[1] if len(fields) > 1 else None))
+    return targets
+
+
+def collect(targets, default_name=None, recursive=False, cache=None, heartbeat=None):
+    """Informations des fichiers à écrire (les fichiers inchangés récemment écrits sont ignorés)"""
+    file_infos = []
+    skipped = 0
+    errors = 0
+    now = time.time()
+    seen = set()
+    for target, name in targets:
+        if not name:
+            # Par défaut : nom du dossier de la cible
+            directory = os.path.dirname(target) if glob.has_magic(target) else target
+            name = default_name or os.path.basename(os.path.normpath(directory)) or target
+        for file_path, file_stats in iter_target(target, recursive):
+            if file_path in seen:
+                continue
+            seen.add(file_path)
+            file_info = get_file_info(file_path, name, file_stats)
+            if file_info is None:
+                errors += 1
+                continue
+            if cache is not None and heartbeat:
+                if (cache.unchanged(file_path, file_info['stat'])
+                        and now - cache.last_written(file_path) < heartbeat):
+                    skipped += 1
+                    continue
+            file_infos.append(file_info)
+    return file_infos, skipped, errors
+
+
+def write_file_infos(file_infos, cache, fingerprint=False, workers=4, sink=None):
+    """Calcule les empreintes, écrit les fichiers en un seul lot et met à jour le cache
+    Retourne False si l'écriture a échoué"""
+    if not file_infos:
+        return True
+    if fingerprint:
+        started = time.monotonic()
+        hashed = add_fingerprints(file_infos, cache, workers,
+                                  getattr(config, 'FILE_INFO_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+        if hashed:
+            print(f"🔑 {hashed} empreintes calculées en {time.monotonic() - started:.1f} s")
+
+    # Envoyer toutes les données à TimescaleDB en un seul lot
+    if not write_to_timescaledb(file_infos, fingerprint, sink):
         return False
+    written_at = time.time()
+    for file_info in file_infos:
+        # Conserver une empreinte déjà connue si elle n'a pas été recalculée
+        known = file_info.get('fingerprint') or cache.fingerprint(file_info['file_path'], file_info['stat'])
+        cache.update(file_info['file_path'], file_info['stat'], written_at, known)
+    cache.save()
+    return True
 
 
 def main():
     """Fonction principale"""
-    if len(sys.argv) != 3:
-        print("Usage: python3 file-info-to-timescaledb.py <chemin_du_fichier> <name>")
-        print("\nExemple:")
-        print("  python3 file-info-to-timescaledb.py /var/log/syslog logs_system")
+    parser = argparse.ArgumentParser(
+        description="Informations de fichiers vers TimescaleDB",
+        epilog="Exemple : python3 file-info-to-timescaledb.py /var/log/syslog logs_system")
+    parser.add_argument('targets', nargs='*', help="fichiers, dossiers ou motifs glob")
+    parser.add_argument('--name', help="name des cibles de la ligne de commande (par défaut : nom du dossier)")
+    parser.add_argument('--manifest', help="fichier de cibles : une ligne '<cible> [name]'")
+    parser.add_argument('--recursive', action='store_true', help="parcourir les sous-dossiers")
+    parser.add_argument('--cache', default=getattr(config, 'FILE_INFO_CACHE', DEFAULT_CACHE_PATH),
+                        help="cache local de l'état des fichiers")
+    parser.add_argument('--heartbeat', type=float, default=getattr(config, 'FILE_INFO_HEARTBEAT', None),
+                        help="réécrire un fichier inchangé au plus toutes les N secondes")
+    parser.add_argument('--fingerprint', action='store_true',
+                        default=getattr(config, 'FILE_INFO_FINGERPRINT', False),
+                        help="écrire une empreinte du contenu (colonne fingerprint)")
+    parser.add_argument('--workers', type=int, default=getattr(config, 'FILE_INFO_HASH_WORKERS', 4),
+                        help="fichiers hachés en parallèle")
+    args = parser.parse_args()
+
+    # Forme historique : <chemin_du_fichier> <name>
+    if (len(args.targets) == 2 and not args.name and not args.manifest
+            and not glob.has_magic(args.targets[1]) and not os.path.exists(args.targets[1])):
+        targets = [(args.targets[0], args.targets[1])]
+    else:
+        targets = [(target, args.name) for target in args.targets]
+    if args.manifest:
+        targets.extend(read_manifest(args.manifest))
+    if not targets:
+        parser.print_usage()
         sys.exit(1)
-    
-    file_path = sys.argv[1]
-    name = sys.argv[2]
-    
-    # Récupérer les informations du fichier
-    file_info = get_file_info(file_path, name)
-    
-    if file_info is None:
+
+    cache = StatCache(args.cache)
+    file_infos, skipped, errors = collect(targets, args.name, args.recursive, cache, args.heartbeat)
+
+    if not write_file_infos(file_infos, cache, args.fingerprint, args.workers):
         sys.exit(1)
-    
-    # Envoyer les données à TimescaleDB
-    success = write_to_timescaledb(file_info)
-    
-    if not success:
+    print(f"✓ {len(file_infos)} fichiers écrits, {skipped} inchangés ignorés")
+    if errors:
         sys.exit(1)
 
 
@@ -1,38 +1,39 @@
 #!/usr/bin/env python3
-import psycopg2
 from datetime import datetime, timezone
+import sys
 import board
 import adafruit_dht
-from syslog import syslog
 import socket
 import config
+from timescaledb_sink import TimescaleSink, FAILED
+from spool import Spool
+from deadband import create_filter
+from dht_sampler import sample
+from log_setup import fields, get_logger
 
+# Messages aussi envoyés à syslog (par le thread de journalisation)
+log = get_logger('dht22', use_syslog=True)
 
-def write_timescaledb(conn, measurement, value, hostname):
-    """Écrit les données dans TimescaleDB"""
-    try:
-        cursor = conn.cursor()
-        timestamp = datetime.now(timezone.utc)
-        
-        # Insertion dans TimescaleDB
-        # Adapter le nom de la table selon votre schéma
-        query = """
-            INSERT INTO sensor_data (time, host, measurement, value)
-            VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query, (timestamp, hostname, measurement, value))
-        conn.commit()
-        cursor.close()
-        return True
-    except Exception as e:
-        print(f"Erreur lors de l'écriture dans TimescaleDB: {e}")
-        conn.rollback()
-        return False
+
+def write_timescaledb(sink, values, hostname):
+    """Écrit les mesures (nom -> valeur) d'une même lecture dans TimescaleDB
+    (ou dans le journal local), un seul horodatage et une seule requête"""
+    timestamp = datetime.now(timezone.utc)
+    rows = [(timestamp, hostname, measurement, value) for measurement, value in values.items()]
+    return sink.write('sensor_data_host', rows) != FAILED
+
+
+def read_sensor(dhtDevice):
+    """Médiane de DHT22_SAMPLES lectures en DHT22_BUDGET secondes au plus (voir dht_sampler.py)"""
+    samples = getattr(config, 'DHT22_SAMPLES', 5)
+    budget = getattr(config, 'DHT22_BUDGET', 15.0)
+    return sample(lambda: (dhtDevice.temperature, dhtDevice.humidity), samples, budget)
 
 
 def main() -> None:
-    conn = None
+    sink = None
     dhtDevice = None
+    exit_code = 0
     hostname = socket.gethostname()
     
     try:
@@ -41,51 +42,71 @@ def main() -> None:
         print(f"Hostname: {hostname}")
         dhtDevice = adafruit_dht.DHT22(board.D4)
         
-        print("Lecture de la température...")
-        temperature = dhtDevice.temperature
+        # Plusieurs lectures dans le budget de temps, médiane des valeurs retenues
+        samples = getattr(config, 'DHT22_SAMPLES', 5)
+        budget = getattr(config, 'DHT22_BUDGET', 15.0)
+        print(f"Lecture du capteur ({samples} lectures, {budget} s maximum)...")
+        result = read_sensor(dhtDevice)
+        temperature = result['temperature']
+        humidity = result['humidity']
+        sample_count = result['samples']
+        print(f"Lectures retenues: {sample_count} (erreurs: {result['errors']}, écartées: {result['rejected']})")
         print(f'Temperature lue: {temperature}°C')
-        
-        print("Lecture de l'humidité...")
-        humidity = dhtDevice.humidity
         print(f'Humidity lue: {humidity}%')
+        if sample_count < getattr(config, 'DHT22_MIN_SAMPLES', 1):
+            print("Pas assez de lectures valides du capteur")
+            log.error("pas assez de lectures valides", extra=fields(samples=sample_count, errors=result['errors']))
+            temperature = humidity = None
+            exit_code = 1
+        
+        # Filtre : n'écrire que les valeurs qui changent (ou le battement de cœur)
+        deadband = create_filter('dht22')
+        if deadband:
+            if temperature is not None and not deadband.allow(hostname, 'temperature', temperature):
+                print("Température inchangée (bande morte), non écrite")
+                temperature = None
+            if humidity is not None and not deadband.allow(hostname, 'humidity', humidity):
+                print("Humidité inchangée (bande morte), non écrite")
+                humidity = None
         
         # Connexion à TimescaleDB seulement si on a des données
         if temperature is not None or humidity is not None:
             print("Connexion à TimescaleDB...")
-            connection_string = (
-                f"host={config.TIMESCALEDB_HOST} "
-                f"port={config.TIMESCALEDB_PORT} "
-                f"user={config.TIMESCALEDB_USER} "
-                f"password={config.TIMESCALEDB_PASSWORD} "
-                f"dbname={config.TIMESCALEDB_DATABASE} "
-                f"sslmode={config.TIMESCALEDB_SSLMODE} "
-                f"connect_timeout=5"
-            )
-            conn = psycopg2.connect(connection_string)
-            print("Connecté à TimescaleDB")
-            
-            # Écriture dans TimescaleDB
-            if temperature is not None:
-                print(f"Écriture de la température ({temperature}°C) dans TimescaleDB...")
-                write_timescaledb(conn, 'temperature', temperature, hostname)
-                syslog(f'DHT22 - {hostname} - temperature: {temperature}°C')
-                print("Température écrite avec succès")
+            # Journal local : conserve les lignes quand TimescaleDB est injoignable
+            sink = TimescaleSink(spool=Spool())
+            if sink.connect():
+                print("Connecté à TimescaleDB")
+            else:
+                print(f"Écriture dans le journal local ({sink.spool.path})")
             
-            if humidity is not None:
-                print(f"Écriture de l'humidité ({humidity}%) dans TimescaleDB...")
-                write_timescaledb(conn, 'humidity', humidity, hostname)
-                syslog(f'DHT22 - {hostname} - humidity: {humidity}%')
-                print("Humidité écrite avec succès")
+            # Écriture dans TimescaleDB, avec la qualité : nombre de lectures
+            # dont la médiane a été écrite
+            values = {name: value for name, value in (('temperature', temperature), ('humidity', humidity))
+                      if value is not None}
+            values['samples'] = sample_count
+            print(f"Écriture de {', '.join(values)} dans TimescaleDB...")
+            if write_timescaledb(sink, values, hostname):
+                print("Mesures écrites avec succès")
+            elif deadband:
+                # Valeurs perdues : ne pas les filtrer à la prochaine exécution
+                for measurement in values:
+                    deadband.forget(hostname, measurement)
+            log.info("lecture", extra=fields(host=hostname, temperature=temperature, humidity=humidity,
+                                             samples=sample_count))
         else:
             print("Aucune donnée valide à écrire dans TimescaleDB")
         
+        # État de la bande morte enregistré après les écritures (valeurs perdues oubliées)
+        if deadband:
+            deadband.save()
+        
     except KeyboardInterrupt:
         print("\nInterruption par l'utilisateur (CTRL+C)")
-        syslog("Script interrompu par l'utilisateur")
+        log.warning("script interrompu par l'utilisateur")
     except Exception as error:
         print(f"ERREUR: {error}")
         print(f"Type d'erreur: {type(error).__name__}")
-        syslog(f"Erreur DHT22: {error}")
+        log.error("erreur DHT22", extra=fields(erreur=error))
         raise error
     finally:
         # Fermer les ressources
@@ -93,10 +114,13 @@ def main() -> None:
         if dhtDevice:
             print("Fermeture du capteur DHT22...")
             dhtDevice.exit()
-        if conn:
+        if sink:
             print("Fermeture de la connexion TimescaleDB...")
-            conn.close()
+            sink.close()
         print("Script terminé")
+    
+    if exit_code:
+        sys.exit(exit_code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Import de captures enregistrées pendant une coupure de la passerelle
+Les fichiers sont lus en flux, décodés avec les mêmes fonctions que les
+listeners (Zigbee2MQTTHandler, XiaomiAdvertisementScanner) en conservant
+l'horodatage d'origine, puis chargés avec COPY par gros lots
+
+Formats :
+- mosquitto : mosquitto_sub -v -F '%I %t %p' (ou '%U %t %p') -t 'zigbee2mqtt/#'
+- z2m-log   : journal Zigbee2MQTT (lignes "MQTT publish: topic '...', payload '...'")
+- btmon     : btmon -T (rapports d'advertising LE avec Service Data)
+
+Usage:
+  python3 import-captures.py mosquitto dump.txt
+  python3 import-captures.py z2m-log log/2024-01-15*/log.log
+  python3 import-captures.py btmon capture.txt.gz --batch-size 100000 --dry-run
+"""
+
+import argparse
+import gzip
+import re
+import sys
+import time
+from datetime import datetime
+from ble_decoder import UUID_ATC, UUID_BTHOME
+from script_loader import load_script
+from sensor_registry import SENSOR_REGISTRY
+from timescaledb_sink import TimescaleSink, WRITTEN
+
+FORMATS = ('mosquitto', 'z2m-log', 'btmon')
+
+# Journal Zigbee2MQTT (anciens et nouveaux formats de ligne)
+Z2M_TIME = re.compile(r'(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?)')
+Z2M_PUBLISH = re.compile(r"MQTT publish: topic '([^']+)', payload '(.*)'")
+
+# btmon -T
+BTMON_EVENT_TIME = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?)\s*$')
+BTMON_ADDRESS = re.compile(r'^\s+Address: ([0-9A-F]{2}(?::[0-9A-F]{2}){5})')
+BTMON_SERVICE_DATA = re.compile(r'^\s+Service Data(?: \(UUID 0x([0-9a-f]{4})\))?:(?: .*\(0x([0-9a-f]{4})\))?\s*([0-9a-f]*)\s*$')
+BTMON_DATA = re.compile(r'^\s+Data(?:\[\d+\])?: ([0-9a-f]+)\s*$')
+BTMON_RSSI = re.compile(r'^\s+RSSI: (-?\d+) dBm')
+# UUID décodés, tels qu'affichés par btmon (0x181a, bluepy : 1a18)
+BTMON_UUIDS = tuple(uuid[2:] + uuid[:2] for uuid in (UUID_ATC, UUID_BTHOME))
+
+
+def read_lines(paths):
+    """Lignes des fichiers (.gz accepté, - pour l'entrée standard)"""
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            yield from f
+
+
+def local_time(value):
+    """Horodatage au format de sensor_data.time (heure locale sans fuseau)"""
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def parse_timestamp(value):
+    """Horodatage ISO 8601 ou Unix (secondes)"""
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        return local_time(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+def parse_mosquitto(lines):
+    """mosquitto_sub -F '%I %t %p' -> (horodatage, topic, payload)"""
+    for line in lines:
+        fields = line.rstrip('\n').split(' ', 2)
+        if len(fields) < 3:
+            continue
+        try:
+            timestamp = parse_timestamp(fields[0])
+        except ValueError:
+            continue
+        yield timestamp, fields[1], fields[2]
+
+
+def parse_z2m_log(lines):
+    """Journal Zigbee2MQTT -> (horodatage, topic, payload)"""
+    for line in lines:
+        if 'MQTT publish' not in line:
+            continue
+        publish = Z2M_PUBLISH.search(line)
+        found = Z2M_TIME.search(line)
+        if not publish or not found:
+            continue
+        yield datetime.fromisoformat(found.group(1).replace('T', ' ')), publish.group(1), publish.group(2)
+
+
+def parse_btmon(lines):
+    """btmon -T -> (horodatage, MAC, service data hexadécimal bluepy, RSSI)
+    Le service data est préfixé de l'UUID 16 bits en petit-boutiste comme
+    dev.getValueText(22) (ex. 1a18... pour 0x181a)"""
+    timestamp = mac = uuid = data = rssi = None
+    pending_uuid = None
+
+    def report():
+        if timestamp and mac and uuid and data:
+            return timestamp, mac, uuid[2:] + uuid[:2] + data, rssi if rssi is not None else 0
+        return None
+
+    for line in lines:
+        if line.startswith(('>', '<', '@', '=')):
+            # Nouvel événement HCI
+            found = report()
+            if found:
+                yield found
+            mac = uuid = data = rssi = pending_uuid = None
+            event_time = BTMON_EVENT_TIME.search(line)
+            timestamp = datetime.fromisoformat(event_time.group(1)) if event_time else None
+            continue
+        address = BTMON_ADDRESS.match(line)
+        if address:
+            # Plusieurs rapports dans un même événement
+            found = report()
+            if found:
+                yield found
+            mac, uuid, data, rssi = address.group(1), None, None, None
+            continue
+        service = BTMON_SERVICE_DATA.match(line)
+        if service:
+            service_uuid = service.group(1) or service.group(2)
+            if service_uuid in BTMON_UUIDS:
+                if service.group(3):
+                    uuid, data = service_uuid, service.group(3)
+                else:
+                    pending_uuid = service_uuid  # données sur la ligne suivante
+            continue
+        if pending_uuid:
+            found_data = BTMON_DATA.match(line)
+            if found_data:
+                uuid, data, pending_uuid = pending_uuid, found_data.group(1), None
+                continue
+        found_rssi = BTMON_RSSI.match(line)
+        if found_rssi:
+            rssi = int(found_rssi.group(1))
+    found = report()
+    if found:
+        yield found
+
+
+def zigbee_rows(messages, sensors_dict):
+    """Messages MQTT -> (requête du sink, ligne) via Zigbee2MQTTHandler"""
+    module = load_script('lire-capteurs-xiaomi-zigbee.py')
+    handler = module.Zigbee2MQTTHandler(sensors_dict)
+    handler.verbose = False
+    for timestamp, topic, payload in messages:
+        sensor_id = handler.topics.get(topic)
+        if sensor_id is None:
+            continue
+        try:
+            rows_by_statement = handler.record(sensor_id, module.json_loads(payload), timestamp)
+        except Exception:
+            continue  # payload non JSON (état texte, availability...)
+        for statement, rows in rows_by_statement:
+            for row in rows:
+                yield statement, row
+
+
+class RowCollector:
+    """Remplace l'écrivain par lots du scanner : conserve les lignes produites"""
+
+    def __init__(self):
+        self.rows = []
+
+    def put_many(self, rows, statement=None):
+        self.rows.extend((statement, row) for row in rows)
+
+
+def ble_rows(advertisements, sensors_dict):
+    """Publicités BLE -> (requête du sink, ligne) via XiaomiAdvertisementScanner"""
+    module = load_script('lire-capteurs-xiaomi-broadcast.py')
+    collector = RowCollector()
+    scanner = module.XiaomiAdvertisementScanner(sensors_dict, continuous=True, writer=collector)
+    scanner.verbose = False
+    for timestamp, mac, data, rssi in advertisements:
+        if sensors_dict and mac not in sensors_dict:
+            continue
+        # Une capture contient chaque mesure plusieurs fois (compteur identique)
+        if scanner.decoder.is_duplicate(mac, data):
+            continue
+        scanner.parse_atc_format(mac, data, rssi, timestamp)
+        if collector.rows:
+            yield from collector.rows
+            collector.rows = []
+
+
+def batches(rows, size):
+    """Regroupe le flux de lignes en lots {requête du sink: lignes}"""
+    batch = {}
+    count = 0
+    for statement, row in rows:
+        batch.setdefault(statement, []).append(row)
+        count += 1
+        if count >= size:
+            yield batch
+            batch = {}
+            count = 0
+    if batch:
+        yield batch
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Import de captures MQTT et BLE dans TimescaleDB")
+    parser.add_argument('format', choices=FORMATS)
+    parser.add_argument('files', nargs='+', help="fichiers de capture (.gz accepté, - pour stdin)")
+    parser.add_argument('--batch-size', type=int, default=50000, help="lignes par COPY")
+    parser.add_argument('--all-sensors', action='store_true',
+                        help="btmon : importer tous les capteurs (pas seulement BLUETOOTH_SENSORS)")
+    parser.add_argument('--dry-run', action='store_true', help="décoder sans écrire dans TimescaleDB")
+    args = parser.parse_args()
+
+    lines = read_lines(args.files)
+    if args.format == 'btmon':
+        sensors = {} if args.all_sensors else SENSOR_REGISTRY.sensors('bluetooth')
+        rows = ble_rows(parse_btmon(lines), sensors)
+    else:
+        messages = parse_mosquitto(lines) if args.format == 'mosquitto' else parse_z2m_log(lines)
+        rows = zigbee_rows(messages, SENSOR_REGISTRY.sensors('zigbee'))
+
+    sink = None
+    if not args.dry_run:
+        sink = TimescaleSink()
+        if not sink.connect(attempts=3):
+            sys.exit(1)
+
+    total = 0
+    started = time.monotonic()
+    try:
+        for batch in batches(rows, args.batch_size):
+            for statement, statement_rows in batch.items():
+                if sink and sink.copy(statement, statement_rows) != WRITTEN:
+                    print(f"✗ Import interrompu après {total} lignes")
+                    sys.exit(1)
+                total += len(statement_rows)
+            elapsed = time.monotonic() - started
+            print(f"📥 {total} lignes ({total / elapsed:.0f} lignes/s)")
+    except KeyboardInterrupt:
+        print(f"\n⚠️  Interruption après {total} lignes")
+        sys.exit(1)
+    finally:
+        if sink:
+            sink.close()
+
+    action = "décodées" if args.dry_run else "importées"
+    print(f"✓ {total} lignes {action} en {time.monotonic() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
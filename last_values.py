@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Dernière lecture de chaque capteur, servie en JSON par les listeners
+(Zigbee2MQTT, BLE en continu, agent de collecte) sans requête TimescaleDB
+- GET /latest               : tous les capteurs
+- GET /latest/<id ou nom>   : un capteur (identifiant Zigbee, adresse MAC ou nom)
+Requêtes conditionnelles : chaque réponse a un ETag ; avec If-None-Match, la
+réponse est 304 si rien n'a changé. Attente d'un changement (long-polling) :
+?wait=30 garde la requête ouverte jusqu'à la prochaine lecture (ou 304 après 30 s)
+Écoute en HTTP local (LAST_VALUES_PORT) et/ou sur un socket Unix (LAST_VALUES_SOCKET) :
+  curl --unix-socket /run/script-telegraf/latest.sock http://localhost/latest
+"""
+
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import config
+
+# Attente maximum d'une requête ?wait= (secondes)
+MAX_WAIT = 300
+
+# Les versions repartent de 0 au redémarrage : l'ETag inclut l'heure de démarrage
+START_TOKEN = format(int(time.time()), 'x')
+
+
+def json_default(value):
+    """Dates au format ISO 8601"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode(data):
+    return json.dumps(data, default=json_default, ensure_ascii=False).encode()
+
+
+class LastValueCache:
+    """Capteur -> dernière lecture, avec un numéro de version par mise à jour"""
+
+    def __init__(self):
+        self.values = {}
+        self.version = 0
+        self.condition = threading.Condition()
+        # Réponse complète encodée une seule fois par version
+        self.encoded = (None, b'')
+
+    def update(self, source, sensor, reading):
+        """Mémorise une lecture (ignorée si plus ancienne que la lecture connue)"""
+        timestamp = reading.get('timestamp')
+        with self.condition:
+            current = self.values.get(sensor)
+            if current and timestamp and current.get('timestamp') and timestamp < current['timestamp']:
+                return
+            self.version += 1
+            self.values[sensor] = dict(reading, id=sensor, source=source, version=self.version)
+            self.condition.notify_all()
+
+    def find(self, key):
+        """Lecture d'un capteur par identifiant ou par nom (None si inconnu)"""
+        value = self.values.get(key) or self.values.get(key.upper())
+        if value is None:
+            value = next((value for value in self.values.values() if value.get('name') == key), None)
+        return value
+
+    def snapshot(self, key=None):
+        """(version, corps JSON) de tous les capteurs ou d'un capteur ((None, None) si inconnu)"""
+        with self.condition:
+            if key is None:
+                if self.encoded[0] != self.version:
+                    self.encoded = (self.version, encode({'version': self.version, 'sensors': self.values}))
+                return self.encoded
+            value = self.find(key)
+            if value is None:
+                return None, None
+            return value['version'], encode(value)
+
+    def wait(self, key, version, timeout):
+        """Attend une version différente de version (tous les capteurs ou un capteur)"""
+        def changed():
+            if key is None:
+                return self.version != version
+            value = self.find(key)
+            return value is not None and value['version'] != version
+        with self.condition:
+            return self.condition.wait_for(changed, timeout)
+
+
+LAST_VALUES = LastValueCache()
+
+
+def etag(version):
+    return f'"{START_TOKEN}-{version}"'
+
+
+class LastValuesRequestHandler(BaseHTTPRequestHandler):
+    """GET /latest et /latest/<capteur>"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        if not parts or parts[0] != 'latest' or len(parts) > 2:
+            self.send_error(404)
+            return
+        key = parts[1] if len(parts) == 2 else None
+
+        version, body = LAST_VALUES.snapshot(key)
+        if body is None:
+            self.send_error(404, "Capteur inconnu")
+            return
+        known = self.headers.get('If-None-Match')
+        if known == etag(version):
+            # Long-polling : attendre la prochaine lecture
+            try:
+                wait = min(float(parse_qs(url.query).get('wait', ['0'])[0]), MAX_WAIT)
+            except ValueError:
+                wait = 0
+            if wait <= 0 or not LAST_VALUES.wait(key, version, wait):
+                self.send_response(304)
+                self.send_header('ETag', known)
+                self.end_headers()
+                return
+            version, body = LAST_VALUES.snapshot(key)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag(version))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Socket Unix : pas d'adresse client
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass  # pas de ligne de log par requête
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serveur HTTP sur un socket Unix (accès limité par les droits du fichier)"""
+    daemon_threads = True
+
+
+def start_http_server(port, address='127.0.0.1'):
+    """Démarre le serveur HTTP local dans un thread séparé"""
+    server = ThreadingHTTPServer((address, port), LastValuesRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='last-values-http', daemon=True).start()
+    return server
+
+
+def start_unix_server(path):
+    """Démarre le serveur sur un socket Unix dans un thread séparé"""
+    if os.path.exists(path):
+        os.unlink(path)  # socket d'une exécution précédente
+    server = UnixHTTPServer(path, LastValuesRequestHandler)
+    os.chmod(path, 0o660)
+    threading.Thread(target=server.serve_forever, name='last-values-unix', daemon=True).start()
+    return server
+
+
+_started_from_config = False
+
+
+def start_from_config():
+    """Démarre les serveurs configurés (LAST_VALUES_PORT, LAST_VALUES_SOCKET), une fois par processus"""
+    global _started_from_config
+    if _started_from_config:
+        return
+    _started_from_config = True
+    port = getattr(config, 'LAST_VALUES_PORT', None)
+    if port:
+        address = getattr(config, 'LAST_VALUES_ADDRESS', '127.0.0.1')
+        start_http_server(port, address)
+        print(f"🌡️  Dernières valeurs : http://{address}:{port}/latest")
+    path = getattr(config, 'LAST_VALUES_SOCKET', None)
+    if path:
+        start_unix_server(path)
+        print(f"🌡️  Dernières valeurs : socket {path}")
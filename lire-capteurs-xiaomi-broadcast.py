@@ -3,76 +3,123 @@
 
 """
 Script pour lire les capteurs Xiaomi via les publicités BLE
-Format ATC (firmware pvvx)
+Formats ATC1441, pvvx custom et BTHome (firmware pvvx)
 Envoie les données dans TimescaleDB
+
+Usage:
+  python3 lire-capteurs-xiaomi-broadcast.py            # scan de 30 s (cron)
+  python3 lire-capteurs-xiaomi-broadcast.py --daemon   # scan passif continu
+  python3 lire-capteurs-xiaomi-broadcast.py --daemon --forward collecteur:5170  # passerelle
+  python3 lire-capteurs-xiaomi-broadcast.py --collect  # collecteur multi-passerelles
 """
 
 import sys
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
 from bluepy import btle
-import struct
 from datetime import datetime
-import psycopg2
 import config
-from zoneinfo import ZoneInfo
+import ble_decoder
+from ble_aggregation import FrameAggregator, FrameForwarder, parse_address
+from timescaledb_sink import get_sink, FAILED
+from timescaledb_writer import create_writer
+from deadband import create_filter
+from sensor_schema import build_rows
+import metrics
+import last_values
+import profiling
+from log_setup import READINGS, fields, get_logger
+from metrics import REGISTRY
+from last_values import LAST_VALUES
+from sensor_registry import SENSOR_REGISTRY
+
+log = get_logger('ble')
+
+# Métriques (voir metrics.py)
+ADVERTISEMENTS = REGISTRY.counter('ble_advertisements_total', "Publicités BLE reçues (capteurs connus)")
+DUPLICATES = REGISTRY.counter('ble_duplicates_total', "Publicités écartées (même compteur de mesure)")
+PARSE_ERRORS = REGISTRY.counter('ble_parse_errors_total', "Publicités non décodables")
 
 class XiaomiAdvertisementScanner(btle.DefaultDelegate):
     """Scanner de publicités BLE pour capteurs Xiaomi"""
     
-    def __init__(self, sensors_dict=None, db_conn=None):
+    def __init__(self, sensors_dict=None, sink=None, continuous=False, writer=None, deadband=None,
+                 forwarder=None):
         btle.DefaultDelegate.__init__(self)
         self.sensors_dict = sensors_dict or {}
-        self.db_conn = db_conn
+        self.sink = sink
+        # Mode continu : une lecture à chaque changement du compteur de mesure
+        self.continuous = continuous
+        self.writer = writer
+        # Filtre : n'écrire que les valeurs qui changent (ou le battement de cœur)
+        self.deadband = deadband
+        self.decoder = ble_decoder.AdvertisementDecoder()
         self.devices_data = {}
+        # Affichage d'une ligne par lecture (désactivé pour un import en masse)
+        self.verbose = True
+        # Passerelle : trames transmises au collecteur au lieu d'être écrites
+        self.forwarder = forwarder
+        
+    def update_sensors(self, sensors_dict):
+        """Applique un nouveau registre de capteurs pendant le scan (rechargement à chaud)
+        Remplacement d'un bloc : filtre des adresses et noms changent ensemble"""
+        self.sensors_dict = sensors_dict or {}
+        log.info("registre appliqué", extra=fields(capteurs=len(self.sensors_dict)))
         
     def handleDiscovery(self, dev, isNewDev, isNewData):
         """Appelé pour chaque appareil découvert ou mis à jour"""
-        if self.sensors_dict and dev.addr.upper() not in self.sensors_dict:
+        mac = dev.addr.upper()
+        if self.sensors_dict and mac not in self.sensors_dict:
             return
         
-        # N'afficher qu'une fois par capteur
-        if dev.addr.upper() in self.devices_data:
+        # N'afficher qu'une fois par capteur (sauf en mode continu)
+        if not self.continuous and mac in self.devices_data:
             return
-            
-        for (adtype, desc, value) in dev.getScanData():
-            # Service Data - UUID 0x181a (ATC format)
-            if adtype == 22 and value.startswith('1a18'):
-                self.parse_atc_format(dev.addr.upper(), value, dev.rssi)
-                break  # Une seule fois par capteur
+        
+        # Service Data - UUID 0x181a (ATC1441 / pvvx) ou 0xfcd2 (BTHome)
+        data = dev.getValueText(22)
+        if not data:
+            return
+        ADVERTISEMENTS.inc()
+        
+        # Mode continu : écarter les répétitions d'une même mesure avant décodage
+        if self.continuous and self.decoder.is_duplicate(mac, data):
+            DUPLICATES.inc()
+            return
+        if self.forwarder:
+            self.forwarder.send(mac, data, dev.rssi)
+            return
+        self.parse_atc_format(mac, data, dev.rssi)
     
-    def parse_atc_format(self, mac, data, rssi):
-        """Parse le format ATC (UUID 0x181a)"""
+    def parse_atc_format(self, mac, data, rssi, timestamp=None):
+        """Parse les formats ATC1441, pvvx custom et BTHome
+        timestamp : heure de réception (maintenant par défaut, import de captures)"""
         try:
-            bytes_data = bytes.fromhex(data)
-            if len(bytes_data) < 13:
+            reading = ble_decoder.decode(data)
+            if reading is None:
                 return
-            
-            payload = bytes_data[2:]  # Ignorer UUID
-            
-            # Temperature (2 octets) - signed int16, big endian, en dixièmes de degré
-            temp_raw = struct.unpack('>h', payload[6:8])[0]
-            temperature = temp_raw / 10.0
-            
-            # Humidity (1 octet)
-            humidity = payload[8]
-            
-            # Battery % (1 octet)
-            battery_pct = payload[9]
-            
-            # Battery mV (2 octets) - unsigned int16, big endian
-            battery_mv = struct.unpack('>H', payload[10:12])[0]
-            
-            # Counter (1 octet)
-            counter = payload[12] if len(payload) > 12 else 0
+            temperature = reading['temperature']
+            humidity = reading.get('humidity')
+            battery_pct = reading.get('battery')
+            battery_mv = reading.get('battery_mv')
+            counter = reading['counter']
+            REGISTRY.seen('ble', mac)
             
             # Récupérer le nom du capteur
             name = self.sensors_dict.get(mac, "???")
+            timestamp = timestamp or datetime.now()
             
-            # Heure actuelle en timezone Paris
-            now_paris = datetime.now(ZoneInfo("Europe/Paris"))
-            time_str = now_paris.strftime("%Y-%m-%d %H:%M")
-            
-            # Affichage sur une seule ligne
-            print(f"{time_str}  {name}  {mac}  🌡️ {temperature:5.1f}°C  💧 {humidity:2d}%  🔋 {battery_pct:3d}% ({battery_mv} mV)  📡 {rssi:3d} dBm  🔢 {counter:3d}")
+            if self.verbose:
+                # Une ligne par lecture seulement avec LOG_LEVEL = "DEBUG" (sinon résumé périodique)
+                READINGS.count('ble', mac)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("lecture", extra=fields(
+                        capteur=name, mac=mac, temperature=temperature, humidity=humidity, battery=battery_pct,
+                        battery_mv=battery_mv, rssi=rssi, counter=counter))
             
             # Stockage
             self.devices_data[mac] = {
@@ -83,50 +130,65 @@ class XiaomiAdvertisementScanner(btle.DefaultDelegate):
                 'battery_mv': battery_mv,
                 'rssi': rssi,
                 'counter': counter,
-                'timestamp': datetime.now()
+                'timestamp': timestamp
             }
+            LAST_VALUES.update('ble', mac, self.devices_data[mac])
             
-            # Écriture dans TimescaleDB
-            if self.db_conn:
-                self.write_timescaledb(mac, name, temperature, humidity, battery_pct, battery_mv)
+            # Écriture dans TimescaleDB (ou dans le journal local)
+            if self.writer or self.sink:
+                self.write_timescaledb(mac, name, temperature, humidity, battery_pct, battery_mv, rssi, timestamp)
             
         except Exception as e:
-            pass
+            PARSE_ERRORS.inc()
+            log.warning("publicité non décodable", extra=fields(mac=mac, data=data, erreur=e))
     
-    def write_timescaledb(self, mac, capteur, temperature, humidity, battery_pct, battery_mv):
+    def write_timescaledb(self, mac, capteur, temperature, humidity, battery_pct, battery_mv, rssi=None, timestamp=None):
         """Écrit les données dans TimescaleDB"""
-        try:
-            cursor = self.db_conn.cursor()
-            timestamp = datetime.now()
-            
-            # Insertion température
-            query = """
-                INSERT INTO sensor_data (time, mac, capteur, measurement, value)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(query, (timestamp, mac, capteur, 'MI_TEMPERATURE', temperature))
-            
-            # Insertion humidité
-            cursor.execute(query, (timestamp, mac, capteur, 'MI_HUMIDITY', humidity))
-            
-            # Insertion batterie (%)
-            cursor.execute(query, (timestamp, mac, capteur, 'MI_BATTERY', battery_pct))
-            
-            # # Insertion voltage batterie (mV)
-            # cursor.execute(query, (timestamp, mac, capteur, 'MI_BATTERY_MV', battery_mv))
-            
-            self.db_conn.commit()
-            cursor.close()
-        except Exception as e:
-            print(f"✗ Erreur TimescaleDB pour {capteur}: {e}")
-            self.db_conn.rollback()
+        values = {
+            'temperature': temperature,
+            # Humidité et batterie (%) peuvent manquer dans une trame BTHome
+            'humidity': humidity,
+            'battery': battery_pct,
+            'voltage': battery_mv,
+            'rssi': rssi,
+        }
+        # sensor_data : voltage batterie (mV) et RSSI non écrits
+        rows_by_statement = build_rows(timestamp or datetime.now(), mac, capteur, values,
+                                       narrow_fields=('temperature', 'humidity', 'battery'),
+                                       deadband=self.deadband)
+        for statement, rows in rows_by_statement:
+            # Mode continu : écriture par lots dans un thread séparé (ne bloque pas le scan)
+            if self.writer:
+                self.writer.put_many(rows, statement)
+            elif self.sink.write(statement, rows) == FAILED and self.deadband:
+                # Lignes perdues : ne pas filtrer la prochaine valeur
+                self.deadband.forget_rows(statement, rows)
+
 
+# Fonctions instrumentées par le profilage (voir profiling.py)
+PROFILED_METHODS = ((XiaomiAdvertisementScanner, ('handleDiscovery', 'parse_atc_format', 'write_timescaledb')),)
 
-def scan_advertisements(sensors_dict, db_conn=None, duration=30):
+
+def print_ble_error(e):
+    """Affiche une erreur Bluetooth avec les solutions possibles"""
+    error_msg = str(e)
+    if "Invalid Index" in error_msg or "le on" in error_msg:
+        print("✗ Erreur Bluetooth: Adaptateur non disponible ou occupé")
+        print("💡 Solutions:")
+        print("   1. Vérifiez que l'adaptateur Bluetooth est activé: hciconfig")
+        print("   2. Redémarrez le service Bluetooth: sudo systemctl restart bluetooth")
+        print("   3. Assurez-vous qu'aucun autre processus n'utilise le BLE")
+    else:
+        print(f"✗ Erreur BLE: {error_msg}")
+
+
+def scan_advertisements(sensors_dict, sink=None, duration=30):
     """Scanner les publicités BLE des capteurs"""
     
+    # Lancé par cron : la dernière valeur écrite est conservée dans un fichier
+    deadband = create_filter('ble')
     scanner = btle.Scanner()
-    delegate = XiaomiAdvertisementScanner(sensors_dict, db_conn)
+    delegate = XiaomiAdvertisementScanner(sensors_dict, sink, deadband=deadband)
     scanner.withDelegate(delegate)
     
     try:
@@ -141,52 +203,161 @@ def scan_advertisements(sensors_dict, db_conn=None, duration=30):
             if len(delegate.devices_data) >= len(sensors_dict):
                 break
         
-        print()  # Ligne vide finale
+        print(f"✓ {len(delegate.devices_data)}/{len(sensors_dict)} capteurs lus")
         return delegate.devices_data
         
     except btle.BTLEException as e:
-        error_msg = str(e)
-        if "Invalid Index" in error_msg or "le on" in error_msg:
-            print("✗ Erreur Bluetooth: Adaptateur non disponible ou occupé")
-            print("💡 Solutions:")
-            print("   1. Vérifiez que l'adaptateur Bluetooth est activé: hciconfig")
-            print("   2. Redémarrez le service Bluetooth: sudo systemctl restart bluetooth")
-            print("   3. Assurez-vous qu'aucun autre processus n'utilise le BLE")
-        else:
-            print(f"✗ Erreur BLE: {error_msg}")
+        print_ble_error(e)
         return {}
+    finally:
+        if deadband:
+            deadband.save()
+
+
+def scan_daemon(sensors_dict, sink=None, restart_interval=600, retry_delay=5, forwarder=None, stop_event=None,
+                watch=True):
+    """Scan passif continu : une lecture à chaque nouvelle mesure d'un capteur
+    forwarder : trames transmises au collecteur (pas d'écriture locale)
+    stop_event : arrêt demandé par l'agent de collecte (sinon jusqu'à Ctrl+C)
+    watch : sensors_dict vient du registre, rechargé à chaud (False : liste fixe)"""
+    stop_event = stop_event or threading.Event()
+    
+    # Métriques : endpoint HTTP et/ou ligne de statistiques (METRICS_*)
+    metrics.start_from_config()
+    last_values.start_from_config()
+    writer = create_writer(sink, name='ble').start() if sink else None
+    delegate = XiaomiAdvertisementScanner(sensors_dict, sink, continuous=True, writer=writer,
+                                          deadband=None if forwarder else create_filter(),
+                                          forwarder=forwarder)
+    if writer and delegate.deadband:
+        # Lignes perdues par l'écrivain : la bande morte ne doit pas les considérer écrites
+        writer.on_lost = delegate.deadband.forget_rows
+    # Rechargement à chaud du registre (SENSORS_FILE)
+    unwatch = SENSOR_REGISTRY.watch('bluetooth', delegate.update_sensors) if watch else lambda: None
+    scanner = btle.Scanner()
+    scanner.withDelegate(delegate)
+    
+    if forwarder:
+        print(f"📤 Trames transmises au collecteur {forwarder.address[0]}:{forwarder.address[1]}")
+    print("🔍 Scan passif continu (Ctrl+C pour arrêter)...\n")
+    try:
+        while not stop_event.is_set():
+            try:
+                # Le scan est relancé périodiquement (filtre de doublons du contrôleur)
+                scanner.start(passive=True)
+                started = time.monotonic()
+                while time.monotonic() - started < restart_interval and not stop_event.is_set():
+                    scanner.process(timeout=1.0)
+                scanner.stop()
+            except btle.BTLEException as e:
+                print_ble_error(e)
+                print(f"⏱️  Nouvel essai dans {retry_delay} s")
+                try:
+                    scanner.stop()
+                except Exception:
+                    pass
+                stop_event.wait(retry_delay)
+    finally:
+        # Écrire les lignes restantes avant de quitter
+        unwatch()
+        if writer:
+            writer.stop()
+            if writer.rows_dropped:
+                print(f"⚠️  {writer.rows_dropped} lignes perdues (file d'attente pleine)")
+
+
+def collect(sensors_dict, sink=None, port=5170, window=2.0, watch=True):
+    """Collecteur multi-passerelles : une lecture par mesure, copie au meilleur RSSI
+    watch : sensors_dict vient du registre, rechargé à chaud (False : liste fixe)"""
+    
+    metrics.start_from_config()
+    last_values.start_from_config()
+    writer = create_writer(sink, name='ble-collector').start() if sink else None
+    delegate = XiaomiAdvertisementScanner(sensors_dict, sink, continuous=True, writer=writer,
+                                          deadband=create_filter())
+    if writer and delegate.deadband:
+        writer.on_lost = delegate.deadband.forget_rows
+    unwatch = SENSOR_REGISTRY.watch('bluetooth', delegate.update_sensors) if watch else lambda: None
+    aggregator = FrameAggregator(window)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', port))
+    sock.settimeout(min(window / 2, 1.0))
+    
+    print(f"📥 Collecteur BLE en écoute sur le port UDP {port} (fenêtre {window} s, Ctrl+C pour arrêter)...\n")
+    try:
+        while True:
+            try:
+                message, address = sock.recvfrom(4096)
+                frame = json.loads(message)
+                mac = frame['mac'].upper()
+                sensors = delegate.sensors_dict
+                if not sensors or mac in sensors:
+                    aggregator.add(mac, frame['data'], int(frame['rssi']), frame.get('gateway') or address[0])
+            except socket.timeout:
+                pass
+            except (ValueError, KeyError, TypeError, AttributeError):
+                PARSE_ERRORS.inc()
+            
+            for mac, data, rssi, gateway, timestamp in aggregator.expired():
+                delegate.parse_atc_format(mac, data, rssi, timestamp)
+    finally:
+        # Écrire les mesures en attente et les lignes restantes avant de quitter
+        unwatch()
+        for mac, data, rssi, gateway, timestamp in aggregator.expired(force=True):
+            delegate.parse_atc_format(mac, data, rssi, timestamp)
+        sock.close()
+        if writer:
+            writer.stop()
+            if writer.rows_dropped:
+                print(f"⚠️  {writer.rows_dropped} lignes perdues (file d'attente pleine)")
 
 
 def main():
     """Fonction principale"""
     
-    # Récupérer les capteurs depuis config
-    sensors = config.BLUETOOTH_SENSORS
+    parser = argparse.ArgumentParser(description="Lecture des capteurs Xiaomi via les publicités BLE")
+    parser.add_argument('--daemon', action='store_true',
+                        help="scan passif continu, une lecture à chaque nouvelle mesure")
+    parser.add_argument('--forward', metavar='HÔTE:PORT',
+                        help="passerelle : scan passif continu, trames transmises au collecteur")
+    parser.add_argument('--collect', action='store_true',
+                        help="collecteur : agréger les trames transmises par les passerelles")
+    parser.add_argument('--profile', metavar='MODES',
+                        help="profilage : timers, cprofile, tracemalloc ou all (voir profiling.py)")
+    args = parser.parse_args()
     
-    # Connexion à TimescaleDB
-    connection_string = (
-        f"host={config.TIMESCALEDB_HOST} "
-        f"port={config.TIMESCALEDB_PORT} "
-        f"user={config.TIMESCALEDB_USER} "
-        f"password={config.TIMESCALEDB_PASSWORD} "
-        f"dbname={config.TIMESCALEDB_DATABASE} "
-        f"sslmode={config.TIMESCALEDB_SSLMODE}"
-    )
+    # Profilage à la demande (--profile ou TELEGRAF_PROFILE)
+    profiling.start_from_config(args.profile, 'ble')
+    profiling.instrument(PROFILED_METHODS + profiling.sink_methods())
     
-    conn = None
+    # Récupérer les capteurs (fichier SENSORS_FILE rechargé à chaud, sinon config)
+    sensors = SENSOR_REGISTRY.sensors('bluetooth')
+    
+    if args.forward:
+        # Passerelle : pas de connexion à TimescaleDB
+        forwarder = FrameForwarder(parse_address(args.forward, getattr(config, 'BLE_COLLECTOR_PORT', 5170)),
+                                   getattr(config, 'BLE_GATEWAY_NAME', None))
+        try:
+            scan_daemon(sensors, restart_interval=getattr(config, 'BLE_SCAN_RESTART_INTERVAL', 600),
+                        forwarder=forwarder)
+        finally:
+            forwarder.close()
+        return
+    
+    # Connexion à TimescaleDB (journal local si injoignable)
+    sink = get_sink()
     try:
-        conn = psycopg2.connect(connection_string)
-        
-        # Scanner les publicités et envoyer dans TimescaleDB
-        scan_advertisements(sensors, db_conn=conn, duration=30)
-        
-    except Exception as e:
-        print(f"✗ Erreur connexion TimescaleDB: {e}")
-        # Scanner quand même sans base de données
-        scan_advertisements(sensors, duration=30)
+        if args.collect:
+            collect(sensors, sink=sink, port=getattr(config, 'BLE_COLLECTOR_PORT', 5170),
+                    window=getattr(config, 'BLE_AGGREGATION_WINDOW', 2.0))
+        elif args.daemon:
+            scan_daemon(sensors, sink=sink,
+                        restart_interval=getattr(config, 'BLE_SCAN_RESTART_INTERVAL', 600))
+        else:
+            # Scanner les publicités et envoyer dans TimescaleDB
+            scan_advertisements(sensors, sink=sink, duration=30)
     finally:
-        if conn:
-            conn.close()
+        sink.close()
 
 
 if __name__ == "__main__":
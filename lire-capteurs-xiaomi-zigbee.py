@@ -5,16 +5,49 @@
 Script pour lire les capteurs de température Xiaomi Mijia LYWSD03MMC via Zigbee2MQTT
 Les capteurs ont été flashés pour fonctionner en Zigbee
 Envoie les données dans TimescaleDB
+
+Usage:
+  python3 lire-capteurs-xiaomi-zigbee.py            # client MQTT threadé
+  python3 lire-capteurs-xiaomi-zigbee.py --asyncio  # pipeline asyncio (réception, décodage, écriture)
 """
 
 import sys
+import argparse
+import asyncio
 import json
+import logging
+import threading
 from datetime import datetime
-import psycopg2
 import config
-from zoneinfo import ZoneInfo
 import paho.mqtt.client as mqtt
 import time
+from timescaledb_sink import get_sink, FAILED
+from timescaledb_writer import create_writer
+from deadband import create_filter
+from sensor_schema import build_rows
+import metrics
+import last_values
+import profiling
+from log_setup import READINGS, fields, get_logger
+from metrics import REGISTRY
+from last_values import LAST_VALUES
+from sensor_registry import SENSOR_REGISTRY
+
+# Métriques (voir metrics.py)
+MESSAGES = REGISTRY.counter('zigbee_messages_total', "Messages MQTT reçus")
+MESSAGES_IGNORED = REGISTRY.counter('zigbee_messages_ignored_total', "Messages ignorés (capteur inconnu ou lecture incomplète)")
+PARSE_ERRORS = REGISTRY.counter('zigbee_parse_errors_total', "Messages en erreur (JSON invalide, valeur inattendue)")
+MESSAGES_COALESCED = REGISTRY.counter('zigbee_messages_coalesced_total', "Messages fusionnés dans une lecture en attente")
+MESSAGES_DROPPED = REGISTRY.counter('zigbee_messages_dropped_total', "Messages perdus (file de décodage pleine, --asyncio)")
+
+log = get_logger('zigbee')
+
+# Décodeur JSON plus rapide si disponible (pip install orjson)
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # Forcer l'affichage immédiat dans les logs
 sys.stdout.reconfigure(line_buffering=True)
@@ -23,151 +56,256 @@ sys.stderr.reconfigure(line_buffering=True)
 class Zigbee2MQTTHandler:
     """Gestionnaire MQTT pour capteurs Zigbee"""
     
-    def __init__(self, sensors_dict, db_conn=None):
+    def __init__(self, sensors_dict, sink=None, writer=None, deadband=None, coalesce_window=0):
         self.sensors_dict = sensors_dict
-        self.db_conn = db_conn
+        self.sink = sink
+        self.writer = writer
+        # Filtre : n'écrire que les valeurs qui changent (ou le battement de cœur)
+        self.deadband = deadband
         self.devices_data = {}
         self.client = None
         self.start_time = None
         self.message_count = 0
+        # Affichage d'une ligne par lecture (désactivé pour un import en masse)
+        self.verbose = True
+        # Topic MQTT -> ID du capteur, pour écarter les autres messages avant décodage
+        self.topics = {f"{config.MQTT_BASE_TOPIC}/{sensor_id}": sensor_id for sensor_id in sensors_dict}
+        # Fusion des rafales : messages d'un capteur regroupés pendant coalesce_window
+        # secondes (les dernières valeurs l'emportent), une seule lecture écrite
+        self.coalesce_window = coalesce_window
+        self.pending = {}  # ID du capteur -> [fin de la fenêtre, payload fusionné, horodatage]
+        self.pending_lock = threading.Lock()
         
     def on_connect(self, client, userdata, flags, rc):
         """Callback appelé lors de la connexion au broker MQTT"""
         if rc == 0:
             print("✓ Connecté au broker MQTT\n")
             self.start_time = time.time()
-            # S'abonner aux topics des capteurs
-            for sensor_id in self.sensors_dict.keys():
-                topic = f"{config.MQTT_BASE_TOPIC}/{sensor_id}"
+            if getattr(config, 'MQTT_WILDCARD', False):
+                # Un seul abonnement pour tous les appareils (le filtre se fait par topic)
+                topic = f"{config.MQTT_BASE_TOPIC}/+"
                 client.subscribe(topic)
-                print(f"📡 Abonné à: {topic}")
+                print(f"📡 Abonné à: {topic} ({len(self.topics)} capteurs)")
+            else:
+                # S'abonner aux topics des capteurs
+                for topic in self.topics:
+                    client.subscribe(topic)
+                    print(f"📡 Abonné à: {topic}")
             print()
         else:
             print(f"✗ Erreur connexion MQTT: code {rc}")
     
+    def update_sensors(self, sensors_dict):
+        """Applique un nouveau registre de capteurs sans reconnexion (rechargement à chaud)
+        Les tables sont remplacées d'un bloc : un message en cours de traitement voit
+        l'ancien ou le nouveau registre, jamais un mélange"""
+        topics = {f"{config.MQTT_BASE_TOPIC}/{sensor_id}": sensor_id for sensor_id in sensors_dict}
+        added = topics.keys() - self.topics.keys()
+        removed = self.topics.keys() - topics.keys()
+        # Noms avant topics : un nouveau topic accepté a toujours son nom
+        self.sensors_dict = sensors_dict
+        self.topics = topics
+        client = self.client
+        if client is not None and client.is_connected() and not getattr(config, 'MQTT_WILDCARD', False):
+            for topic in sorted(added):
+                client.subscribe(topic)
+            for topic in sorted(removed):
+                client.unsubscribe(topic)
+        log.info("registre appliqué", extra=fields(capteurs=len(topics), ajoutes=len(added), retires=len(removed)))
+    
     def on_message(self, client, userdata, msg):
         """Callback appelé lors de la réception d'un message MQTT"""
         try:
-            self.message_count += 1
-            elapsed = int(time.time() - self.start_time) if self.start_time else 0
-            
-            # Parser le payload JSON
-            payload = json.loads(msg.payload.decode())
-            
-            # Extraire l'ID du capteur depuis le topic
-            sensor_id = msg.topic.split('/')[-1]
-            
-            # Vérifier que c'est un de nos capteurs
-            if sensor_id not in self.sensors_dict:
-                return
-            
-            # Extraire les données
-            temperature = payload.get('temperature')
-            humidity = payload.get('humidity')
-            battery = payload.get('battery')
-            voltage = payload.get('voltage')
-            linkquality = payload.get('linkquality')
-            
-            # Extraire les informations de mise à jour (pour affichage uniquement)
-            update_info = payload.get('update', {})
-            installed_version = update_info.get('installed_version')
-            latest_version = update_info.get('latest_version')
-            
-            if temperature is None or humidity is None:
-                return
-            
-            # Récupérer le nom du capteur
-            name = self.sensors_dict[sensor_id]
-            
-            # Heure actuelle en timezone Paris
-            now_paris = datetime.now(ZoneInfo("Europe/Paris"))
-            time_str = now_paris.strftime("%Y-%m-%d %H:%M")
-            
-            # Affichage sur une seule ligne
-            battery_str = f"{battery:5.1f}%" if battery is not None else "  N/A"
-            voltage_str = f"({voltage} mV)" if voltage is not None else ""
-            linkq_str = f"{linkquality:3d}" if linkquality is not None else "N/A"
-            
-            # Versions firmware (affichage uniquement)
-            version_str = ""
-            if installed_version and latest_version:
-                version_str = f"  📦 v{installed_version}"
-                if installed_version < latest_version:
-                    version_str += f" ⚠️ MAJ dispo: v{latest_version}"
-            
-            print(f"{time_str}  {name}  {sensor_id}  🌡️ {temperature:5.1f}°C  💧 {humidity:5.1f}%  🔋 {battery_str} {voltage_str}  📡 {linkq_str}{version_str}")
-            
-            # Stockage
-            self.devices_data[sensor_id] = {
-                'name': name,
-                'temperature': temperature,
-                'humidity': humidity,
-                'battery': battery,
-                'voltage': voltage,
-                'linkquality': linkquality,
-                'timestamp': datetime.now()
-            }
+            rows_by_statement = self.process_message(msg)
             
             # Écriture dans TimescaleDB
-            if self.db_conn:
-                self.write_timescaledb(sensor_id, name, temperature, humidity, battery, voltage, linkquality)
+            if rows_by_statement and (self.writer or self.sink):
+                self.write_timescaledb(rows_by_statement)
             
         except Exception as e:
-            print(f"✗ Erreur traitement message: {e}")
+            PARSE_ERRORS.inc()
+            log.warning("erreur de traitement du message", extra=fields(topic=msg.topic, erreur=e))
+    
+    def process_message(self, msg):
+        """Décode, valide, affiche et mémorise un message
+        Retourne les lignes à écrire : liste de (requête du sink, lignes)"""
+        self.message_count += 1
+        MESSAGES.inc()
+        
+        # Vérifier que c'est un de nos capteurs avant de décoder le JSON
+        # (écarte aussi bridge/* et les appareils inconnus)
+        sensor_id = self.topics.get(msg.topic)
+        if sensor_id is None:
+            MESSAGES_IGNORED.inc()
+            return []
+        
+        # Parser le payload JSON
+        payload = json_loads(msg.payload)
+        
+        if self.coalesce_window:
+            # Fermer d'abord les fenêtres terminées (dont celle de ce capteur)
+            rows_by_statement = self.flush_pending()
+            self.coalesce(sensor_id, payload)
+            return rows_by_statement
+        return self.record(sensor_id, payload, datetime.now())
+    
+    def coalesce(self, sensor_id, payload):
+        """Fusionne un message dans la lecture en attente du capteur"""
+        with self.pending_lock:
+            entry = self.pending.get(sensor_id)
+            if entry is None:
+                self.pending[sensor_id] = [time.monotonic() + self.coalesce_window, dict(payload), datetime.now()]
+                return
+            MESSAGES_COALESCED.inc()
+            entry[1].update((key, value) for key, value in payload.items() if value is not None)
+            entry[2] = datetime.now()
+    
+    def flush_pending(self, force=False):
+        """Lectures dont la fenêtre de fusion est terminée (toutes si force)
+        Retourne les lignes à écrire : liste de (requête du sink, lignes)"""
+        if not self.pending:
+            return []
+        result = []
+        now = time.monotonic()
+        with self.pending_lock:
+            for sensor_id, (deadline, payload, timestamp) in list(self.pending.items()):
+                if force or now >= deadline:
+                    del self.pending[sensor_id]
+                    # Une lecture invalide n'empêche pas d'écrire les autres
+                    try:
+                        result.extend(self.record(sensor_id, payload, timestamp))
+                    except Exception as e:
+                        PARSE_ERRORS.inc()
+                        log.warning("erreur de traitement de la lecture fusionnée",
+                                    extra=fields(capteur=sensor_id, erreur=e))
+        return result
+    
+    def record(self, sensor_id, payload, timestamp):
+        """Valide, affiche et mémorise une lecture
+        Retourne les lignes à écrire : liste de (requête du sink, lignes)"""
+        
+        # Extraire les données
+        temperature = payload.get('temperature')
+        humidity = payload.get('humidity')
+        battery = payload.get('battery')
+        voltage = payload.get('voltage')
+        linkquality = payload.get('linkquality')
+        
+        # Extraire les informations de mise à jour (pour affichage uniquement)
+        update_info = payload.get('update') or {}
+        installed_version = update_info.get('installed_version')
+        latest_version = update_info.get('latest_version')
+        
+        if temperature is None or humidity is None:
+            MESSAGES_IGNORED.inc()
+            return []
+        REGISTRY.seen('zigbee', sensor_id)
+        
+        # Récupérer le nom du capteur
+        # (capteur retiré du registre pendant le traitement : identifiant comme nom)
+        name = self.sensors_dict.get(sensor_id, sensor_id)
+        
+        if self.verbose:
+            # Une ligne par lecture seulement avec LOG_LEVEL = "DEBUG" (sinon résumé périodique)
+            READINGS.count('zigbee', sensor_id)
+            if log.isEnabledFor(logging.DEBUG):
+                update = latest_version if installed_version and latest_version and installed_version < latest_version else None
+                log.debug("lecture", extra=fields(
+                    capteur=name, id=sensor_id, temperature=temperature, humidity=humidity, battery=battery,
+                    voltage=voltage, linkquality=linkquality, firmware=installed_version, maj_disponible=update))
+        
+        # Stockage
+        self.devices_data[sensor_id] = {
+            'name': name,
+            'temperature': temperature,
+            'humidity': humidity,
+            'battery': battery,
+            'voltage': voltage,
+            'linkquality': linkquality,
+            'timestamp': timestamp
+        }
+        LAST_VALUES.update('zigbee', sensor_id, self.devices_data[sensor_id])
+        
+        return self.timescaledb_rows(timestamp, sensor_id, name, temperature, humidity, battery, voltage, linkquality)
     
-    def write_timescaledb(self, mac, capteur, temperature, humidity, battery, voltage, linkquality):
+    def timescaledb_rows(self, timestamp, mac, capteur, temperature, humidity, battery, voltage, linkquality):
+        """Lignes TimescaleDB d'une lecture"""
+        values = {
+            'temperature': temperature,
+            'humidity': humidity,
+            # Batterie (%), voltage batterie (mV) et qualité du lien Zigbee
+            'battery': battery,
+            'voltage': voltage,
+            'linkquality': linkquality,
+        }
+        # Lignes selon le schéma configuré (sensor_data et/ou sensor_readings)
+        return build_rows(timestamp, mac, capteur, values, deadband=self.deadband)
+    
+    def write_timescaledb(self, rows_by_statement):
         """Écrit les données dans TimescaleDB"""
-        try:
-            cursor = self.db_conn.cursor()
-            timestamp = datetime.now()
-            
-            # Insertion température
-            query = """
-                INSERT INTO sensor_data (time, mac, capteur, measurement, value)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(query, (timestamp, mac, capteur, 'MI_TEMPERATURE', temperature))
-            
-            # Insertion humidité
-            cursor.execute(query, (timestamp, mac, capteur, 'MI_HUMIDITY', humidity))
-            
-            # Insertion batterie (%)
-            if battery is not None:
-                cursor.execute(query, (timestamp, mac, capteur, 'MI_BATTERY', battery))
-            
-            # Insertion voltage batterie (mV)
-            if voltage is not None:
-                cursor.execute(query, (timestamp, mac, capteur, 'MI_BATTERY_MV', voltage))
-            
-            # Insertion qualité du lien Zigbee
-            if linkquality is not None:
-                cursor.execute(query, (timestamp, mac, capteur, 'MI_LINKQUALITY', linkquality))
-            
-            self.db_conn.commit()
-            cursor.close()
-        except Exception as e:
-            print(f"✗ Erreur TimescaleDB pour {capteur}: {e}")
-            self.db_conn.rollback()
+        for statement, rows in rows_by_statement:
+            # Écriture par lots dans un thread séparé (ne bloque pas la boucle MQTT)
+            if self.writer:
+                self.writer.put_many(rows, statement)
+            elif self.sink.write(statement, rows) == FAILED and self.deadband:
+                # Lignes perdues : ne pas filtrer la prochaine valeur
+                self.deadband.forget_rows(statement, rows)
 
 
-def listen_mqtt(sensors_dict, db_conn=None, duration=None):
-    """Écoute les messages MQTT des capteurs Zigbee"""
-    
-    handler = Zigbee2MQTTHandler(sensors_dict, db_conn)
-    
-    # Créer le client MQTT
+# Fonctions instrumentées par le profilage (voir profiling.py)
+PROFILED_METHODS = ((Zigbee2MQTTHandler, ('on_message', 'process_message', 'record', 'write_timescaledb')),)
+
+
+def create_mqtt_client(handler):
+    """Crée le client MQTT (authentification et callback de connexion)"""
     import warnings
     warnings.filterwarnings("ignore", category=DeprecationWarning)
     client = mqtt.Client()
     handler.client = client
-    
-    # Configurer les callbacks
     client.on_connect = handler.on_connect
-    client.on_message = handler.on_message
     
     # Authentification si configurée
     if config.MQTT_USERNAME and config.MQTT_PASSWORD:
         client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+    return client
+
+
+def listen_mqtt(sensors_dict, sink=None, duration=None, stop_event=None, watch=True):
+    """Écoute les messages MQTT des capteurs Zigbee
+    stop_event : arrêt demandé par l'agent de collecte (sinon jusqu'à Ctrl+C)
+    watch : sensors_dict vient du registre, rechargé à chaud (False : liste fixe)"""
+    
+    # Métriques : endpoint HTTP et/ou ligne de statistiques (METRICS_*)
+    metrics.start_from_config()
+    last_values.start_from_config()
+    
+    # Les écritures sont faites par lots dans un thread séparé
+    writer = create_writer(sink, name='zigbee').start() if sink else None
+    coalesce_window = getattr(config, 'ZIGBEE_COALESCE_WINDOW', 0)
+    handler = Zigbee2MQTTHandler(sensors_dict, sink, writer, create_filter(), coalesce_window)
+    if writer and handler.deadband:
+        # Lignes perdues par l'écrivain : la bande morte ne doit pas les considérer écrites
+        writer.on_lost = handler.deadband.forget_rows
+    # Rechargement à chaud du registre (SENSORS_FILE)
+    unwatch = SENSOR_REGISTRY.watch('zigbee', handler.update_sensors) if watch else lambda: None
+    
+    client = create_mqtt_client(handler)
+    client.on_message = handler.on_message
+    
+    # Fusion des rafales : écrire les lectures dont la fenêtre est terminée
+    # même si aucun autre message n'arrive
+    stop_flush = threading.Event()
+    if coalesce_window:
+        def flush_loop():
+            while not stop_flush.wait(coalesce_window / 2):
+                # Le thread ne doit pas s'arrêter sur une erreur (fenêtres plus écrites)
+                try:
+                    rows_by_statement = handler.flush_pending()
+                    if rows_by_statement and (writer or sink):
+                        handler.write_timescaledb(rows_by_statement)
+                except Exception as e:
+                    log.error("erreur d'écriture des lectures fusionnées", extra=fields(erreur=e))
+        threading.Thread(target=flush_loop, name='zigbee-coalesce', daemon=True).start()
     
     try:
         # Connexion au broker
@@ -175,7 +313,11 @@ def listen_mqtt(sensors_dict, db_conn=None, duration=None):
         client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
         
         # Boucle d'écoute
-        if duration:
+        if stop_event:
+            client.loop_start()
+            stop_event.wait(duration)
+            client.loop_stop()
+        elif duration:
             print(f"⏱️  Écoute pendant {duration} secondes...\n")
             client.loop_start()
             time.sleep(duration)
@@ -189,45 +331,190 @@ def listen_mqtt(sensors_dict, db_conn=None, duration=None):
     except Exception as e:
         print(f"✗ Erreur MQTT: {e}")
         return {}
+    finally:
+        # Écrire les lectures en attente et les lignes restantes avant de quitter
+        unwatch()
+        stop_flush.set()
+        rows_by_statement = handler.flush_pending(force=True)
+        if rows_by_statement and (writer or sink):
+            handler.write_timescaledb(rows_by_statement)
+        if writer:
+            writer.stop()
+            if writer.rows_dropped:
+                print(f"⚠️  {writer.rows_dropped} lignes perdues (file d'attente pleine)")
+            if writer.rows_spooled:
+                print(f"ℹ️  {writer.rows_spooled} lignes placées dans le journal local")
+
+
+async def decode_stage(handler, messages, rows_queue):
+    """Étape de décodage : messages MQTT -> lignes à écrire"""
+    # Fusion des rafales : réveil périodique pour écrire les fenêtres terminées
+    timeout = handler.coalesce_window / 2 if handler.coalesce_window else None
+    while True:
+        try:
+            msg = await asyncio.wait_for(messages.get(), timeout)
+        except asyncio.TimeoutError:
+            msg = False
+        if msg is None:
+            for item in handler.flush_pending(force=True):
+                await rows_queue.put(item)
+            await rows_queue.put(None)
+            return
+        try:
+            if msg is False:
+                rows_by_statement = handler.flush_pending()
+            else:
+                rows_by_statement = handler.process_message(msg)
+        except Exception as e:
+            PARSE_ERRORS.inc()
+            log.warning("erreur de traitement du message", extra=fields(erreur=e))
+            continue
+        for item in rows_by_statement:
+            # Attend une place si l'écriture prend du retard
+            await rows_queue.put(item)
+
+
+async def write_stage(sink, rows_queue, on_lost=None):
+    """Étape d'écriture : lots de lignes écrits dans un thread (psycopg2 est bloquant)
+    on_lost(requête, lignes) : lignes non écrites (FAILED)"""
+    loop = asyncio.get_running_loop()
+    max_rows = getattr(config, 'BATCH_MAX_ROWS', 500)
+    max_age = getattr(config, 'BATCH_MAX_AGE', 2.0)
+    batch = {}
+    count = 0
+    deadline = None
+    stopping = False
+    while not stopping:
+        timeout = max(0.0, deadline - loop.time()) if count else None
+        try:
+            item = await asyncio.wait_for(rows_queue.get(), timeout)
+            if item is None:
+                stopping = True
+            else:
+                statement, rows = item
+                if not count:
+                    deadline = loop.time() + max_age
+                batch.setdefault(statement, []).extend(rows)
+                count += len(rows)
+        except asyncio.TimeoutError:
+            pass
+        
+        if count and (count >= max_rows or loop.time() >= deadline or stopping):
+            pending, batch, count = batch, {}, 0
+            # Le décodage continue pendant l'écriture (file rows_queue)
+            for statement, rows in pending.items():
+                if await asyncio.to_thread(sink.write, statement, rows) == FAILED and on_lost:
+                    on_lost(statement, rows)
+
+
+async def listen_mqtt_async(sensors_dict, sink, duration=None, watch=True):
+    """Écoute MQTT en pipeline asyncio : réception -> décodage -> écriture
+    Les étapes sont reliées par des files bornées : quand l'écriture prend du retard,
+    le décodage attend ; la réception ne bloque pas le thread paho (keepalive) et
+    les messages qui ne trouvent pas de place sont perdus et comptés : en QoS 0 avec
+    une session propre, le broker ne les conserve pas
+    Ctrl+C : les étapes ne sont pas annulées, elles écrivent les lectures en attente
+    watch : sensors_dict vient du registre, rechargé à chaud (False : liste fixe)"""
+    
+    metrics.start_from_config()
+    last_values.start_from_config()
+    loop = asyncio.get_running_loop()
+    queue_size = getattr(config, 'MQTT_ASYNC_QUEUE_SIZE', 10000)
+    messages = asyncio.Queue(maxsize=queue_size)
+    rows_queue = asyncio.Queue(maxsize=queue_size)
+    REGISTRY.gauge('zigbee_messages_pending', "Messages MQTT en attente de décodage", messages.qsize)
+    REGISTRY.gauge('zigbee_rows_pending', "Lignes en attente d'écriture", rows_queue.qsize)
+    
+    handler = Zigbee2MQTTHandler(sensors_dict, deadband=create_filter(),
+                                 coalesce_window=getattr(config, 'ZIGBEE_COALESCE_WINDOW', 0))
+    unwatch = SENSOR_REGISTRY.watch('zigbee', handler.update_sensors) if watch else lambda: None
+    stages = [
+        asyncio.create_task(decode_stage(handler, messages, rows_queue)),
+        asyncio.create_task(write_stage(sink, rows_queue,
+                                        handler.deadband.forget_rows if handler.deadband else None)),
+    ]
+    
+    def enqueue(msg):
+        try:
+            messages.put_nowait(msg)
+        except asyncio.QueueFull:
+            MESSAGES_DROPPED.inc()
+    
+    def on_message(client, userdata, msg):
+        # Thread réseau paho : ne jamais attendre la boucle asyncio
+        try:
+            loop.call_soon_threadsafe(enqueue, msg)
+        except RuntimeError:
+            pass  # boucle asyncio arrêtée
+    
+    client = create_mqtt_client(handler)
+    client.on_message = on_message
+    
+    try:
+        print(f"🔌 Connexion au broker MQTT {config.MQTT_BROKER}:{config.MQTT_PORT}...")
+        await asyncio.to_thread(client.connect, config.MQTT_BROKER, config.MQTT_PORT, 60)
+        client.loop_start()
+        if duration:
+            print(f"⏱️  Écoute pendant {duration} secondes (asyncio)...\n")
+            await asyncio.sleep(duration)
+        else:
+            print("⏱️  Écoute continue, asyncio (Ctrl+C pour arrêter)...\n")
+            # wait() et non gather() : l'annulation (Ctrl+C) n'atteint pas les
+            # étapes, vidées dans le bloc finally
+            await asyncio.wait(stages)
+        return handler.devices_data
+    
+    except Exception as e:
+        print(f"✗ Erreur MQTT: {e}")
+        return {}
+    finally:
+        # Arrêter la réception puis écrire les lignes restantes (lot en cours,
+        # lignes en file et lectures fusionnées en attente)
+        unwatch()
+        await asyncio.to_thread(client.loop_stop)
+        if not stages[0].done():
+            await messages.put(None)
+        done, pending = await asyncio.wait(stages, timeout=10.0)
+        if pending:
+            log.warning("lignes non écrites à l'arrêt (écriture trop lente)",
+                        extra=fields(lignes=rows_queue.qsize()))
+        if MESSAGES_DROPPED.value:
+            print(f"⚠️  {MESSAGES_DROPPED.value} messages perdus (file de décodage pleine)")
 
 
 def main():
     """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Lecture des capteurs Xiaomi via Zigbee2MQTT")
+    parser.add_argument('--asyncio', action='store_true',
+                        help="pipeline asyncio (réception, décodage et écriture en parallèle)")
+    parser.add_argument('--profile', metavar='MODES',
+                        help="profilage : timers, cprofile, tracemalloc ou all (voir profiling.py)")
+    args = parser.parse_args()
+    
+    # Profilage à la demande (--profile ou TELEGRAF_PROFILE)
+    profiling.start_from_config(args.profile, 'zigbee')
+    profiling.instrument(PROFILED_METHODS + profiling.sink_methods())
     
-    # Récupérer les capteurs depuis config
-    sensors = config.ZIGBEE_SENSORS
+    # Récupérer les capteurs (fichier SENSORS_FILE rechargé à chaud, sinon config)
+    sensors = SENSOR_REGISTRY.sensors('zigbee')
     
-    # Connexion à TimescaleDB
-    connection_string = (
-        f"host={config.TIMESCALEDB_HOST} "
-        f"port={config.TIMESCALEDB_PORT} "
-        f"user={config.TIMESCALEDB_USER} "
-        f"password={config.TIMESCALEDB_PASSWORD} "
-        f"dbname={config.TIMESCALEDB_DATABASE} "
-        f"sslmode={config.TIMESCALEDB_SSLMODE}"
-    )
+    # Connexion à TimescaleDB (reconnexion automatique, journal local si injoignable)
+    sink = get_sink()
+    print()
     
-    conn = None
     try:
-        conn = psycopg2.connect(connection_string)
-        print("✓ Connecté à TimescaleDB\n")
-        
         # Écouter les messages MQTT et envoyer dans TimescaleDB
         # duration=None pour écoute continue (pour tests: duration=60)
-        listen_mqtt(sensors, db_conn=conn, duration=None)
+        if args.asyncio:
+            asyncio.run(listen_mqtt_async(sensors, sink, duration=None))
+        else:
+            listen_mqtt(sensors, sink=sink, duration=None)
         
-    except psycopg2.Error as e:
-        print(f"✗ Erreur connexion TimescaleDB: {e}")
-        print("ℹ️  Écoute sans base de données\n")
-        # Écouter quand même sans base de données
-        listen_mqtt(sensors, duration=None)
     except KeyboardInterrupt:
         print("\n⚠️  Interruption")
     finally:
-        if conn:
-            conn.close()
-            print("\n✓ Déconnexion TimescaleDB")
-
+        sink.close()
+        print("\n✓ Déconnexion TimescaleDB")
 
 if __name__ == "__main__":
     try:
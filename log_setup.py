@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Journalisation des lectures et des erreurs (remplace un print et un syslog par lecture)
+- niveaux : LOG_LEVEL = "DEBUG" affiche chaque lecture, "INFO" (défaut) un résumé
+  par source toutes les LOG_SUMMARY_INTERVAL secondes
+- enregistrements clé=valeur : log.debug("lecture", extra=fields(capteur="salon", temperature=21.5))
+- l'appelant ne fait que placer l'enregistrement dans une file : formatage et
+  écriture (console, syslog) par un thread dédié (QueueHandler / QueueListener)
+- un même message (hors DEBUG) est affiché au plus LOG_RATE_LIMIT fois par
+  LOG_RATE_INTERVAL secondes ; le nombre de messages écartés est signalé ensuite
+- syslog pour les scripts qui l'utilisaient (GATT, DHT22) ou pour tous avec LOG_SYSLOG = True
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import syslog
+import threading
+import time
+import config
+
+ROOT_LOGGER = 'telegraf'
+
+# Niveau Python -> priorité syslog
+SYSLOG_PRIORITIES = {
+    logging.DEBUG: syslog.LOG_DEBUG,
+    logging.INFO: syslog.LOG_INFO,
+    logging.WARNING: syslog.LOG_WARNING,
+    logging.ERROR: syslog.LOG_ERR,
+    logging.CRITICAL: syslog.LOG_CRIT,
+}
+
+_lock = threading.Lock()
+_listener = None
+# Loggers dont les messages vont aussi dans syslog
+_syslog_loggers = set()
+
+
+def fields(**values):
+    """Champs clé=valeur d'un enregistrement (paramètre extra de logging)"""
+    return {'fields': values}
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+    text = str(value)
+    if not text or ' ' in text or '=' in text or '"' in text:
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """<heure> <niveau> <source> <message> clé=valeur ... (champs None omis)"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        text = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            text += ' ' + ' '.join(f"{key}={format_value(value)}" for key, value in values.items()
+                                   if value is not None)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += f" (+{suppressed} messages identiques écartés)"
+        return text
+
+
+class RateLimitFilter(logging.Filter):
+    """Au plus limit enregistrements par (source, message) et par intervalle
+    Les enregistrements DEBUG ne sont pas limités (détail demandé explicitement)"""
+
+    def __init__(self, limit=10, interval=60.0):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.windows = {}  # (source, message) -> [début de l'intervalle, nombre, écartés]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG or not self.limit:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            window[1] += 1
+            if window[1] > self.limit:
+                window[2] += 1
+                return False
+            return True
+
+
+class SyslogHandler(logging.Handler):
+    """syslog(3) (mêmes messages que les anciens appels syslog des scripts)"""
+
+    def emit(self, record):
+        if record.name not in _syslog_loggers and not getattr(config, 'LOG_SYSLOG', False):
+            return
+        try:
+            syslog.syslog(SYSLOG_PRIORITIES.get(record.levelno, syslog.LOG_INFO), self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class ReadingSummary:
+    """Nombre de lectures par source, affiché toutes les interval secondes (niveau INFO)"""
+
+    def __init__(self):
+        self.counts = {}   # source -> [lectures, capteurs vus]
+        # Compteurs mis à jour par les threads MQTT / BLE et remis à zéro par _loop
+        self.lock = threading.Lock()
+        self.thread = None
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.resume")
+
+    def count(self, source, sensor):
+        with self.lock:
+            entry = self.counts.get(source)
+            new = entry is None
+            if new:
+                entry = self.counts[source] = [0, set()]
+            entry[0] += 1
+            entry[1].add(sensor)
+        if new:
+            self._start()
+
+    def _start(self):
+        interval = getattr(config, 'LOG_SUMMARY_INTERVAL', 300)
+        with _lock:
+            if self.thread is None and interval:
+                self.thread = threading.Thread(target=self._loop, args=(interval,), name='log-summary',
+                                               daemon=True)
+                self.thread.start()
+
+    def _loop(self, interval):
+        while True:
+            time.sleep(interval)
+            # Période suivante commencée d'un bloc : aucune lecture perdue entre deux résumés
+            # (sources déjà vues conservées : une source muette est signalée avec 0 lecture)
+            with self.lock:
+                counts, self.counts = self.counts, {source: [0, set()] for source in self.counts}
+            for source, (readings, sensors) in counts.items():
+                self.logger.info("lectures", extra=fields(source=source, lectures=readings, capteurs=len(sensors),
+                                                          periode=f"{interval}s"))
+
+
+READINGS = ReadingSummary()
+
+
+def setup():
+    """Handlers du logger racine (une fois par processus) : file d'attente et thread d'écriture"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        formatter = KeyValueFormatter()
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(formatter)
+        syslog_handler = SyslogHandler()
+        syslog_handler.setFormatter(logging.Formatter('%(message)s'))
+        # Le formatage est fait par le thread d'écriture, pas par l'appelant
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.prepare = lambda record: record
+        queue_handler.addFilter(RateLimitFilter(getattr(config, 'LOG_RATE_LIMIT', 10),
+                                                getattr(config, 'LOG_RATE_INTERVAL', 60.0)))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(getattr(config, 'LOG_LEVEL', 'INFO'))
+        root.addHandler(queue_handler)
+        root.propagate = False
+        _listener = logging.handlers.QueueListener(log_queue, console, syslog_handler)
+        _listener.start()
+        # Écrire les derniers messages avant la fin du processus (scripts lancés par cron)
+        atexit.register(_listener.stop)
+
+
+def get_logger(name, use_syslog=False):
+    """Logger telegraf.<name> ; use_syslog : messages aussi envoyés à syslog"""
+    setup()
+    logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+    if use_syslog:
+        _syslog_loggers.add(logger.name)
+    return logger
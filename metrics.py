@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Métriques d'exécution des listeners (compteurs, histogrammes, dernière réception)
+Exposées au format texte Prometheus sur http://<hôte>:METRICS_PORT/metrics
+et/ou résumées dans une ligne de statistiques toutes les METRICS_LOG_INTERVAL secondes
+Mises à jour depuis plusieurs threads (paho, écrivain, serveur HTTP) : un verrou
+par métrique, non disputé la plupart du temps (quelques dixièmes de microseconde)
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+
+# Bornes des histogrammes de latence (secondes)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def escape_label(value):
+    """Valeur d'étiquette Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Counter:
+    """Compteur monotone"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        # += n'est pas atomique entre threads
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def expose(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+class Gauge:
+    """Valeur instantanée calculée à la lecture"""
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help = help_text
+        self.function = function
+
+    @property
+    def value(self):
+        try:
+            return self.function()
+        except Exception:
+            return float('nan')
+
+    def expose(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.value}"]
+
+
+class GaugeTable:
+    """Jauges étiquetées (ex. RSSI par capteur et passerelle)"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}  # tuple des étiquettes -> valeur
+        # Copie pendant expose() alors qu'un autre thread ajoute une étiquette
+        self.lock = threading.Lock()
+
+    def set(self, labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+    @property
+    def value(self):
+        return len(self.values)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            text = ','.join(f'{name}="{escape_label(label)}"' for name, label in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{text}}} {value}")
+        return lines
+
+
+class GaugeFunctionTable:
+    """Jauges étiquetées calculées à la lecture (ex. file d'attente par écrivain)"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.functions = {}  # tuple des étiquettes -> fonction
+        self.lock = threading.Lock()
+
+    def set(self, labels, function):
+        with self.lock:
+            self.functions[labels] = function
+
+    def remove(self, labels):
+        with self.lock:
+            self.functions.pop(labels, None)
+
+    def _values(self):
+        with self.lock:
+            functions = sorted(self.functions.items())
+        values = []
+        for labels, function in functions:
+            try:
+                values.append((labels, function()))
+            except Exception:
+                values.append((labels, float('nan')))
+        return values
+
+    @property
+    def value(self):
+        """Somme des jauges (ligne de statistiques)"""
+        return sum(value for labels, value in self._values())
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self._values():
+            text = ','.join(f'{name}="{escape_label(label)}"' for name, label in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{text}}} {value}")
+        return lines
+
+
+class Histogram:
+    """Histogramme à bornes fixes (latences)"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, fraction):
+        """Estimation d'un quantile (borne supérieure du bucket)"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        # Copie cohérente (buckets, somme et nombre d'une même série d'observations)
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Ensemble des métriques du processus"""
+
+    def __init__(self):
+        self.metrics = {}
+        # Dernière réception par (source, capteur) : time.time()
+        self.last_seen = {}
+        # Déclarations et seen() depuis plusieurs threads, copies dans expose()/summary()
+        self.lock = threading.Lock()
+
+    def _declare(self, name, metric):
+        with self.lock:
+            return self.metrics.setdefault(name, metric)
+
+    def counter(self, name, help_text):
+        return self._declare(name, Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._declare(name, Histogram(name, help_text, buckets))
+
+    def gauge_table(self, name, help_text, label_names):
+        return self._declare(name, GaugeTable(name, help_text, label_names))
+
+    def gauge_function_table(self, name, help_text, label_names):
+        return self._declare(name, GaugeFunctionTable(name, help_text, label_names))
+
+    def gauge(self, name, help_text, function):
+        """Déclare (ou remplace) une jauge calculée par function()"""
+        with self.lock:
+            self.metrics[name] = Gauge(name, help_text, function)
+            return self.metrics[name]
+
+    def seen(self, source, sensor):
+        """Note la réception d'une lecture d'un capteur"""
+        now = time.time()
+        with self.lock:
+            self.last_seen[(source, sensor)] = now
+
+    def _snapshot(self):
+        """Copie des métriques et des dernières réceptions"""
+        with self.lock:
+            return list(self.metrics.values()), dict(self.last_seen)
+
+    def value(self, name):
+        metric = self.metrics.get(name)
+        return getattr(metric, 'value', 0) if metric else 0
+
+    def expose(self):
+        """Toutes les métriques au format texte Prometheus"""
+        metrics, last_seen = self._snapshot()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        if last_seen:
+            now = time.time()
+            lines.append("# HELP sensor_last_seen_seconds Secondes depuis la dernière lecture du capteur")
+            lines.append("# TYPE sensor_last_seen_seconds gauge")
+            for (source, sensor), seen in sorted(last_seen.items()):
+                lines.append(f'sensor_last_seen_seconds{{source="{source}",sensor="{escape_label(sensor)}"}} '
+                             f'{now - seen:.1f}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Ligne de statistiques lisible"""
+        metrics, last_seen = self._snapshot()
+        parts = []
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    parts.append(f"{metric.name} n={metric.count} p50≤{metric.quantile(0.5) * 1000:g}ms "
+                                 f"p99≤{metric.quantile(0.99) * 1000:g}ms")
+            elif metric.value:
+                parts.append(f"{metric.name}={metric.value:g}")
+        if last_seen:
+            now = time.time()
+            oldest = max(now - seen for seen in last_seen.values())
+            parts.append(f"capteurs={len(last_seen)} plus_ancien={oldest:.0f}s")
+        return ' | '.join(parts)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics : métriques au format texte Prometheus"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = REGISTRY.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # pas de ligne de log par requête
+
+
+def start_http_server(port, address=''):
+    """Démarre le serveur HTTP des métriques dans un thread séparé"""
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_stats_logger(interval):
+    """Affiche une ligne de statistiques toutes les interval secondes"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            print(f"📊 {REGISTRY.summary()}")
+    threading.Thread(target=loop, name='metrics-log', daemon=True).start()
+
+
+_started_from_config = False
+
+
+def start_from_config():
+    """Démarre le serveur HTTP et/ou la ligne de statistiques selon config
+    (une seule fois par processus : plusieurs listeners dans l'agent de collecte)"""
+    global _started_from_config
+    if _started_from_config:
+        return
+    _started_from_config = True
+    port = getattr(config, 'METRICS_PORT', None)
+    if port:
+        start_http_server(port, getattr(config, 'METRICS_ADDRESS', ''))
+        print(f"📊 Métriques : http://{getattr(config, 'METRICS_ADDRESS', '') or '0.0.0.0'}:{port}/metrics")
+    interval = getattr(config, 'METRICS_LOG_INTERVAL', None)
+    if interval:
+        start_stats_logger(interval)
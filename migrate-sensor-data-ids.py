@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Migration des données sensor_data (mac, capteur et measurement en texte) vers
+sensor_values (identifiants entiers, voir sensor_dimensions.py), par tranches
+Seules les mesures absentes de sensor_values (même time, capteur et mesure)
+sont insérées : le script peut être relancé sur une période déjà migrée sans
+créer de doublons, et ne touche pas aux lignes écrites directement en schéma
+ids (SENSOR_SCHEMA = "ids" ou ("narrow", "ids"), avec ou sans équivalent dans sensor_data)
+
+Après la migration, les requêtes existantes peuvent utiliser la vue
+sensor_data_compat, qui a les colonnes de sensor_data
+
+Usage:
+  python3 migrate-sensor-data-ids.py [--start 2024-01-01] [--end 2024-02-01] [--chunk-hours 24]
+"""
+
+import argparse
+import sys
+import time
+from datetime import timedelta
+import psycopg2
+from timescaledb_sink import connection_string
+from sensor_dimensions import create_tables
+from script_loader import load_script
+
+# Les dates et les bornes sont lues comme pour la migration vers sensor_readings
+wide_migration = load_script('migrate-sensor-data-wide.py')
+
+# Capteurs et mesures présents dans sensor_data (dernier nom connu par capteur)
+DIMENSIONS_QUERY = """
+    INSERT INTO sensors (mac, capteur)
+    SELECT DISTINCT ON (mac) mac, capteur
+    FROM sensor_data
+    WHERE mac IS NOT NULL
+    ORDER BY mac, time DESC
+    ON CONFLICT (mac) DO NOTHING;
+
+    INSERT INTO measurements (name)
+    SELECT DISTINCT measurement FROM sensor_data WHERE mac IS NOT NULL
+    ON CONFLICT (name) DO NOTHING;
+"""
+
+# Pas de contrainte d'unicité sur sensor_values (ON CONFLICT impossible) :
+# NOT EXISTS utilise l'index sensor_values_sensor_time_idx
+MIGRATE_QUERY = """
+    INSERT INTO sensor_values (time, sensor_id, measurement_id, value)
+    SELECT d.time, s.id, m.id, d.value
+    FROM sensor_data d
+    JOIN sensors s ON s.mac = d.mac
+    JOIN measurements m ON m.name = d.measurement
+    WHERE d.time >= %s AND d.time < %s
+      AND NOT EXISTS (
+          SELECT 1 FROM sensor_values v
+          WHERE v.sensor_id = s.id AND v.measurement_id = m.id AND v.time = d.time
+      )
+"""
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Migration sensor_data -> sensor_values (identifiants)")
+    parser.add_argument('--start', type=wide_migration.parse_date, help="début (par défaut : première mesure)")
+    parser.add_argument('--end', type=wide_migration.parse_date,
+                        help="fin exclue (par défaut : après la dernière mesure)")
+    parser.add_argument('--chunk-hours', type=float, default=24, help="taille d'une tranche en heures")
+    parser.add_argument('--no-create', action='store_true', help="ne pas créer les tables et la vue")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(connection_string())
+    current = None
+    try:
+        if not args.no_create:
+            create_tables(conn)
+            print("✓ Tables sensors, measurements, sensor_values et vue sensor_data_compat prêtes")
+
+        cursor = conn.cursor()
+        cursor.execute(DIMENSIONS_QUERY)
+        conn.commit()
+        cursor.execute("SELECT count(*) FROM sensors")
+        print(f"✓ {cursor.fetchone()[0]} capteurs dans la table sensors")
+
+        start, end = args.start, args.end
+        if start is None or end is None:
+            first, last = wide_migration.get_bounds(conn)
+            if first is None:
+                print("ℹ️  Aucune donnée à migrer")
+                return
+            start = start or first
+            end = end or last + timedelta(microseconds=1)
+
+        chunk = timedelta(hours=args.chunk_hours)
+        total = 0
+        started = time.monotonic()
+        current = start
+        while current < end:
+            chunk_end = min(current + chunk, end)
+            cursor.execute(MIGRATE_QUERY, (current, chunk_end))
+            conn.commit()
+            total += cursor.rowcount
+            print(f"{current:%Y-%m-%d %H:%M} → {chunk_end:%Y-%m-%d %H:%M}  {cursor.rowcount:8d} mesures")
+            current = chunk_end
+        cursor.close()
+        print(f"✓ {total} mesures migrées en {time.monotonic() - started:.1f} s")
+    except KeyboardInterrupt:
+        # Les tranches déjà validées sont conservées : relancer avec --start
+        conn.rollback()
+        print("\n⚠️  Interruption")
+        if current:
+            print(f"ℹ️  Reprendre avec --start {current.isoformat()}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
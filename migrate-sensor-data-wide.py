@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Migration des données sensor_data (une ligne par mesure) vers la table large
+sensor_readings (une ligne par lecture), par tranches de temps
+Les lignes d'une même lecture partagent le même time, mac et capteur
+Le script peut être relancé sans créer de doublons (ON CONFLICT DO NOTHING)
+Limite : l'ancien script GATT horodatait chaque mesure séparément
+(datetime.now() par mesure) ; ces lectures donnent une ligne partielle par
+mesure, sauf avec --truncate-second qui regroupe les mesures d'un capteur à la
+seconde près (à éviter sur une période déjà écrite en schéma wide ou both :
+les lignes existantes, à la microseconde, ne seraient pas reconnues)
+
+Usage:
+  python3 migrate-sensor-data-wide.py [--start 2024-01-01] [--end 2024-02-01] [--chunk-hours 24]
+                                      [--truncate-second]
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+import psycopg2
+from timescaledb_sink import connection_string
+from sensor_schema import MEASUREMENTS, WIDE_FIELDS, WIDE_TABLE_DDL, WIDE_INDEX_DDL
+
+
+def create_table(conn):
+    """Crée la table sensor_readings (hypertable si TimescaleDB est installé)"""
+    cursor = conn.cursor()
+    cursor.execute(WIDE_TABLE_DDL)
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+    if cursor.fetchone():
+        cursor.execute("SELECT create_hypertable('sensor_readings', 'time', if_not_exists => TRUE)")
+    cursor.execute(WIDE_INDEX_DDL)
+    conn.commit()
+    cursor.close()
+
+
+def migrate_query(truncate_second=False):
+    """Requête de pivot d'une tranche de sensor_data vers sensor_readings
+    truncate_second : lecture = mesures d'un capteur dans la même seconde"""
+    columns = ', '.join(WIDE_FIELDS)
+    pivots = ',\n               '.join(
+        f"max(value) FILTER (WHERE measurement = '{MEASUREMENTS[field]}')"
+        for field in WIDE_FIELDS
+    )
+    measurements = ', '.join(f"'{MEASUREMENTS[field]}'" for field in WIDE_FIELDS)
+    reading_time = "date_trunc('second', time)" if truncate_second else "time"
+    return f"""
+        INSERT INTO sensor_readings (time, mac, capteur, {columns})
+        SELECT {reading_time} AS reading_time, mac, max(capteur),
+               {pivots}
+        FROM sensor_data
+        WHERE time >= %s AND time < %s
+          AND mac IS NOT NULL
+          AND measurement IN ({measurements})
+        GROUP BY reading_time, mac
+        ON CONFLICT DO NOTHING
+    """
+
+
+def get_bounds(conn):
+    """Première et dernière date des mesures à migrer"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT min(time), max(time) FROM sensor_data WHERE mac IS NOT NULL")
+    start, end = cursor.fetchone()
+    cursor.close()
+    return start, end
+
+
+def parse_date(value):
+    """Date ISO (YYYY-MM-DD ou YYYY-MM-DDTHH:MM), heure locale sans fuseau indiqué
+    (comparable aux bornes TIMESTAMPTZ lues dans sensor_data)"""
+    date = datetime.fromisoformat(value)
+    return date if date.tzinfo else date.astimezone()
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Migration sensor_data -> sensor_readings")
+    parser.add_argument('--start', type=parse_date, help="début (par défaut : première mesure)")
+    parser.add_argument('--end', type=parse_date, help="fin exclue (par défaut : après la dernière mesure)")
+    parser.add_argument('--chunk-hours', type=float, default=24, help="taille d'une tranche en heures")
+    parser.add_argument('--no-create', action='store_true', help="ne pas créer la table sensor_readings")
+    parser.add_argument('--truncate-second', action='store_true',
+                        help="regrouper les mesures d'un capteur à la seconde (historique GATT)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(connection_string())
+    current = None
+    try:
+        if not args.no_create:
+            create_table(conn)
+            print("✓ Table sensor_readings prête")
+
+        start, end = args.start, args.end
+        if start is None or end is None:
+            first, last = get_bounds(conn)
+            if first is None:
+                print("ℹ️  Aucune donnée à migrer")
+                return
+            start = start or first
+            end = end or last + timedelta(microseconds=1)
+
+        query = migrate_query(args.truncate_second)
+        chunk = timedelta(hours=args.chunk_hours)
+        total = 0
+        started = time.monotonic()
+        cursor = conn.cursor()
+        current = start
+        while current < end:
+            chunk_end = min(current + chunk, end)
+            cursor.execute(query, (current, chunk_end))
+            conn.commit()
+            total += cursor.rowcount
+            print(f"{current:%Y-%m-%d %H:%M} → {chunk_end:%Y-%m-%d %H:%M}  {cursor.rowcount:8d} lectures")
+            current = chunk_end
+        cursor.close()
+        print(f"✓ {total} lectures migrées en {time.monotonic() - started:.1f} s")
+    except KeyboardInterrupt:
+        # Les tranches déjà validées sont conservées : relancer avec --start
+        conn.rollback()
+        print("\n⚠️  Interruption")
+        if current:
+            print(f"ℹ️  Reprendre avec --start {current.isoformat()}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
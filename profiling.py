@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Profilage à la demande des listeners (Zigbee2MQTT, BLE, agent de collecte)
+Activé par la variable d'environnement TELEGRAF_PROFILE ou l'option --profile,
+avec une liste de modes séparés par des virgules (all : tous) :
+- timers      : durée de chaque appel des fonctions critiques (on_message,
+                handleDiscovery, parse_atc_format, écritures) en histogrammes
+                (voir metrics.py : /metrics et ligne de statistiques)
+- cprofile    : cProfile des mêmes fonctions (tous les threads), fichier .prof
+                écrit toutes les PROFILE_DUMP_INTERVAL secondes et sur SIGUSR1
+                (python3 -m pstats <fichier> ou snakeviz pour l'analyse)
+- tracemalloc : instantané mémoire toutes les PROFILE_TRACEMALLOC_INTERVAL
+                secondes ; les plus fortes croissances depuis le premier
+                instantané sont affichées et l'instantané conservé (.snap)
+Les fichiers sont écrits dans PROFILE_DIR, en gardant les PROFILE_KEEP plus récents
+Exemple : TELEGRAF_PROFILE=timers,cprofile python3 lire-capteurs-xiaomi-zigbee.py
+          kill -USR1 <pid>  # écrire le profil maintenant
+"""
+
+import cProfile
+import functools
+import glob
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import config
+from metrics import REGISTRY
+
+MODES = ('timers', 'cprofile', 'tracemalloc')
+ENVIRONMENT_VARIABLE = 'TELEGRAF_PROFILE'
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+# Modes actifs (vide : profilage désactivé, aucune fonction instrumentée)
+enabled = set()
+_profiler = None
+_dump_requested = threading.Event()
+
+
+def parse_modes(value):
+    """'timers,cprofile' -> {'timers', 'cprofile'} ; '1' ou 'all' -> tous les modes"""
+    modes = set()
+    for mode in (value or '').replace(' ', '').lower().split(','):
+        if mode in ('1', 'all', 'true'):
+            modes.update(MODES)
+        elif mode in MODES:
+            modes.add(mode)
+        elif mode:
+            raise ValueError(f"Mode de profilage inconnu: {mode} (modes : {', '.join(MODES)}, all)")
+    return modes
+
+
+def rotate(pattern, keep):
+    """Supprime les fichiers les plus anciens au-delà de keep"""
+    for path in sorted(glob.glob(pattern))[:-keep or None]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class ThreadProfiler:
+    """cProfile de tous les threads, fichier unique à l'écriture
+    Seul l'appel le plus externe d'une fonction instrumentée active le profil du
+    thread (les appels imbriqués sont inclus)
+    Jusqu'à Python 3.11 : un profil par thread, fusionnés à l'écriture ; à partir
+    de 3.12, cProfile s'appuie sur sys.monitoring, global au processus (un seul
+    profileur actif à la fois) : un profil partagé, actif tant qu'au moins un
+    thread est dans une fonction instrumentée
+    Si le profileur ne peut pas être activé (autre outil de profilage ou débogueur),
+    les fonctions sont appelées sans profil"""
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self.profiles = {}   # thread -> [verrou, cProfile.Profile]
+        self.local = threading.local()
+        self.shared = sys.version_info >= (3, 12)
+        # Profil partagé (3.12+) : nombre d'appels en cours, protégé par le verrou
+        self.lock = threading.Lock()
+        self.profile = cProfile.Profile()
+        self.active_calls = 0
+        self.unavailable = False
+
+    def _unavailable(self, error):
+        if not self.unavailable:
+            self.unavailable = True
+            print(f"✗ Profilage cProfile impossible, fonctions non profilées ({error})")
+
+    def call(self, function, args, kwargs):
+        if self.unavailable or getattr(self.local, 'active', False):
+            return function(*args, **kwargs)
+        self.local.active = True
+        try:
+            if self.shared:
+                return self._call_shared(function, args, kwargs)
+            entry = self.profiles.get(threading.get_ident())
+            if entry is None:
+                entry = self.profiles.setdefault(threading.get_ident(), [threading.Lock(), cProfile.Profile()])
+            # Verrou non disputé sauf pendant l'écriture du profil
+            with entry[0]:
+                try:
+                    entry[1].enable()
+                except ValueError as e:
+                    self._unavailable(e)
+                    return function(*args, **kwargs)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    entry[1].disable()
+        finally:
+            self.local.active = False
+
+    def _call_shared(self, function, args, kwargs):
+        with self.lock:
+            if not self.active_calls:
+                try:
+                    self.profile.enable()
+                except ValueError as e:
+                    self._unavailable(e)
+                    return function(*args, **kwargs)
+            self.active_calls += 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.active_calls -= 1
+                if not self.active_calls:
+                    self.profile.disable()
+
+    def _swap(self):
+        """Profils de la période écoulée (remplacés par des profils vides)"""
+        if self.shared:
+            with self.lock:
+                profile, self.profile = self.profile, cProfile.Profile()
+                if self.active_calls:
+                    profile.disable()
+                    try:
+                        self.profile.enable()
+                    except ValueError as e:
+                        self._unavailable(e)
+            return [profile]
+        profiles = []
+        for entry in list(self.profiles.values()):
+            with entry[0]:
+                profile, entry[1] = entry[1], cProfile.Profile()
+            profiles.append(profile)
+        return profiles
+
+    def dump(self, name):
+        """Écrit les profils de la période écoulée et repart de zéro"""
+        profiles = []
+        for profile in self._swap():
+            profile.create_stats()
+            if profile.stats:
+                profiles.append(profile)
+        if not profiles:
+            return None
+        # Fusion des statistiques des threads
+        stats = pstats.Stats(*profiles)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        stats.dump_stats(path)
+        rotate(os.path.join(self.directory, f"{name}-*.prof"), self.keep)
+        return path
+
+
+def timed(function, label):
+    """Fonction mesurée (histogramme) et/ou profilée selon les modes actifs"""
+    histogram = REGISTRY.histogram(f"profile_{label}_seconds", f"Durée des appels de {label}") \
+        if 'timers' in enabled else None
+    profiler = _profiler
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            if profiler:
+                return profiler.call(function, args, kwargs)
+            return function(*args, **kwargs)
+        finally:
+            if histogram:
+                histogram.observe(time.perf_counter() - started)
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument(methods):
+    """Instrumente les méthodes ((classe, (noms...)), ...) si le profilage est actif
+    À appeler avant la création des objets (les méthodes liées sont capturées)"""
+    if not enabled & {'timers', 'cprofile'}:
+        return
+    for cls, names in methods:
+        for name in names:
+            function = getattr(cls, name)
+            if not getattr(function, 'profiled', False):
+                setattr(cls, name, timed(function, f"{cls.__name__}_{name}".lower()))
+
+
+def _snapshot_growth(baseline, directory, name, keep):
+    """Instantané mémoire : croissance depuis le premier instantané (10 lignes les plus fortes)"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    print(f"🧠 Mémoire suivie : {current / 1024:.0f} Ko (pic {peak / 1024:.0f} Ko)")
+    if baseline is not None:
+        for stat in snapshot.compare_to(baseline, 'lineno')[:10]:
+            if stat.size_diff > 0:
+                print(f"   +{stat.size_diff / 1024:.1f} Ko  {stat.traceback}")
+    os.makedirs(directory, exist_ok=True)
+    snapshot.dump(os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.snap"))
+    rotate(os.path.join(directory, f"{name}-*.snap"), keep)
+    return snapshot
+
+
+def _loop(name, directory, keep, dump_interval, tracemalloc_interval):
+    """Écriture périodique (ou sur signal) des profils et des instantanés mémoire"""
+    baseline = None
+    next_dump = time.monotonic() + dump_interval
+    next_snapshot = time.monotonic() + tracemalloc_interval
+    while True:
+        now = time.monotonic()
+        timeout = min(next_dump if _profiler else float('inf'),
+                      next_snapshot if 'tracemalloc' in enabled else float('inf')) - now
+        requested = _dump_requested.wait(max(timeout, 0))
+        _dump_requested.clear()
+        now = time.monotonic()
+        try:
+            if _profiler and (requested or now >= next_dump):
+                path = _profiler.dump(name)
+                if path:
+                    print(f"⏱️  Profil écrit : {path}")
+                next_dump = now + dump_interval
+            if 'tracemalloc' in enabled and (requested or now >= next_snapshot):
+                snapshot = _snapshot_growth(baseline, directory, name, keep)
+                baseline = baseline or snapshot
+                next_snapshot = now + tracemalloc_interval
+        except OSError as e:
+            print(f"✗ Profilage : écriture impossible ({e})")
+
+
+def start(modes, name):
+    """Active les modes de profilage (thread d'écriture et signal SIGUSR1)"""
+    global _profiler
+    if enabled or not modes:
+        return
+    enabled.update(modes)
+    directory = getattr(config, 'PROFILE_DIR', DEFAULT_PROFILE_DIR)
+    keep = getattr(config, 'PROFILE_KEEP', 12)
+    if 'cprofile' in enabled:
+        _profiler = ThreadProfiler(directory, keep)
+    if 'tracemalloc' in enabled:
+        tracemalloc.start(getattr(config, 'PROFILE_TRACEMALLOC_FRAMES', 1))
+    print(f"⏱️  Profilage actif : {', '.join(sorted(enabled))} (fichiers dans {directory})")
+    if _profiler or 'tracemalloc' in enabled:
+        threading.Thread(target=_loop, name='profiling', daemon=True, args=(
+            name, directory, keep,
+            getattr(config, 'PROFILE_DUMP_INTERVAL', 600),
+            getattr(config, 'PROFILE_TRACEMALLOC_INTERVAL', 900),
+        )).start()
+        # kill -USR1 <pid> : écrire maintenant (le gestionnaire ne fait que réveiller le thread)
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: _dump_requested.set())
+        except ValueError:
+            pass  # pas dans le thread principal
+
+
+def start_from_config(option=None, name='profile'):
+    """Active le profilage demandé par --profile ou TELEGRAF_PROFILE"""
+    start(parse_modes(option or os.environ.get(ENVIRONMENT_VARIABLE)), name)
+
+
+def sink_methods():
+    """Fonctions d'écriture communes (sink et écrivain par lots)"""
+    from timescaledb_sink import TimescaleSink
+    from timescaledb_writer import BatchWriter
+    return ((TimescaleSink, ('write', 'copy')), (BatchWriter, ('_flush',)))
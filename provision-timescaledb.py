@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Mise en place des tables TimescaleDB utilisées par les scripts (peut être relancé)
+- tables et hypertables (intervalle de chunk adapté au volume de chaque table)
+- index composites des requêtes Grafana (capteur + mesure + time DESC)
+- compression native segmentée par capteur et politique de compression
+- politiques de rétention (config.PROVISION_RETENTION)
+- agrégats continus 1 minute, 1 heure et 1 jour (moyenne, min, max, nombre)
+  avec leur politique de rafraîchissement ; un agrégat créé est rempli avec
+  l'historique par tranches de 30 jours (--backfill : aussi les agrégats existants)
+
+Chaque étape vérifie l'état de la base avant de la modifier : une politique
+existante avec d'autres paramètres est remplacée, une compression déjà
+configurée différemment est signalée (elle ne peut pas être modifiée tant que
+des chunks sont compressés). --dry-run affiche les changements sans les faire
+
+Usage:
+  python3 provision-timescaledb.py                      # tables selon SENSOR_SCHEMA + file_info
+  python3 provision-timescaledb.py --tables sensor_data sensor_values
+  python3 provision-timescaledb.py --dry-run
+  python3 provision-timescaledb.py --backfill           # remplir les agrégats créés vides
+"""
+
+import argparse
+import sys
+from datetime import timedelta
+import psycopg2
+import config
+from timescaledb_sink import connection_string
+from sensor_schema import SCHEMA_NARROW, SCHEMA_WIDE, SCHEMA_IDS, WIDE_TABLE_DDL, WIDE_INDEX_DDL, get_schemas
+from sensor_dimensions import DIMENSION_DDL, VALUES_INDEX_DDL, COMPAT_VIEW_DDL
+
+# Agrégats continus : suffixe -> (intervalle du bucket, début et fin de la
+# fenêtre de rafraîchissement, période du rafraîchissement)
+# La rétention des données brutes doit dépasser le plus grand début de fenêtre
+# La politique ne rafraîchit que sa fenêtre : l'historique plus ancien est
+# rempli à la création (Provisioner.backfill)
+AGGREGATES = {
+    '1m': ('1 minute', '2 hours', '1 minute', '1 minute'),
+    '1h': ('1 hour', '2 days', '1 hour', '30 minutes'),
+    '1d': ('1 day', '7 days', '1 day', '12 hours'),
+}
+
+# Description de chaque table : création, hypertable, index, compression, agrégats
+TABLES = {
+    'sensor_data': {
+        'ddl': """
+            CREATE TABLE IF NOT EXISTS sensor_data (
+                time        TIMESTAMPTZ      NOT NULL,
+                mac         TEXT,
+                capteur     TEXT,
+                host        TEXT,
+                measurement TEXT             NOT NULL,
+                value       DOUBLE PRECISION
+            )
+        """,
+        'chunk_interval': '7 days',
+        'indexes': [
+            "CREATE INDEX IF NOT EXISTS sensor_data_mac_measurement_time_idx "
+            "ON sensor_data (mac, measurement, time DESC) WHERE mac IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS sensor_data_host_measurement_time_idx "
+            "ON sensor_data (host, measurement, time DESC) WHERE host IS NOT NULL",
+        ],
+        'segmentby': 'mac, host, measurement',
+        'orderby': 'time DESC',
+        # Colonnes de regroupement et valeurs agrégées
+        'group_by': ('mac', 'capteur', 'host', 'measurement'),
+        'values': ('value',),
+    },
+    'sensor_readings': {
+        'ddl': WIDE_TABLE_DDL,
+        'chunk_interval': '7 days',
+        'indexes': [WIDE_INDEX_DDL],
+        'segmentby': 'mac',
+        'orderby': 'time DESC',
+        'group_by': ('mac', 'capteur'),
+        'values': ('temperature', 'humidity', 'battery', 'voltage', 'rssi', 'linkquality'),
+    },
+    'sensor_values': {
+        # Tables de dimension et vue de compatibilité (voir sensor_dimensions.py)
+        'ddl': DIMENSION_DDL,
+        'view': ('sensor_data_compat', COMPAT_VIEW_DDL),
+        'chunk_interval': '7 days',
+        'indexes': [VALUES_INDEX_DDL],
+        'segmentby': 'sensor_id, measurement_id',
+        'orderby': 'time DESC',
+        'group_by': ('sensor_id', 'measurement_id'),
+        'values': ('value',),
+    },
+    'file_info': {
+        'ddl': """
+            CREATE TABLE IF NOT EXISTS file_info (
+                time              TIMESTAMPTZ NOT NULL,
+                file_path         TEXT        NOT NULL,
+                file_name         TEXT,
+                name              TEXT,
+                host              TEXT,
+                modification_time TIMESTAMPTZ,
+                file_size         BIGINT,
+                fingerprint       TEXT
+            );
+            ALTER TABLE file_info ADD COLUMN IF NOT EXISTS fingerprint TEXT
+        """,
+        'chunk_interval': '30 days',
+        'indexes': [
+            "CREATE INDEX IF NOT EXISTS file_info_path_time_idx ON file_info (file_path, time DESC)",
+            "CREATE INDEX IF NOT EXISTS file_info_name_time_idx ON file_info (name, time DESC)",
+        ],
+        'segmentby': 'host, file_path',
+        'orderby': 'time DESC',
+    },
+}
+
+
+def default_tables():
+    """Tables des schémas configurés (SENSOR_SCHEMA) et file_info"""
+    schemas = get_schemas()
+    tables = []
+    for schema, table in ((SCHEMA_NARROW, 'sensor_data'), (SCHEMA_WIDE, 'sensor_readings'),
+                          (SCHEMA_IDS, 'sensor_values')):
+        if schema in schemas:
+            tables.append(table)
+    # sensor_data reçoit aussi les mesures du DHT22 (colonne host)
+    if 'sensor_data' not in tables:
+        tables.insert(0, 'sensor_data')
+    tables.append('file_info')
+    return tables
+
+
+def aggregate_query(table, spec, bucket):
+    """Requête d'un agrégat continu : moyenne, minimum, maximum et nombre par bucket"""
+    group_by = ', '.join(spec['group_by'])
+    columns = []
+    for value in spec['values']:
+        prefix = '' if len(spec['values']) == 1 else f"{value}_"
+        columns.extend([
+            f"avg({value}) AS {prefix}avg",
+            f"min({value}) AS {prefix}min",
+            f"max({value}) AS {prefix}max",
+        ])
+    columns.append("count(*) AS samples")
+    return (
+        f"SELECT time_bucket('{bucket}', time) AS bucket, {group_by}, {', '.join(columns)} "
+        f"FROM {table} GROUP BY bucket, {group_by}"
+    )
+
+
+class Provisioner:
+    """Applique la description des tables en ne modifiant que ce qui manque ou diffère"""
+
+    # Taille d'une tranche de remplissage (multiple des buckets 1m, 1h et 1d)
+    BACKFILL_CHUNK = timedelta(days=30)
+
+    def __init__(self, conn, dry_run=False, backfill_existing=False):
+        # Un agrégat continu ne peut pas être créé dans une transaction
+        # (ni rafraîchi : CALL refresh_continuous_aggregate)
+        conn.autocommit = True
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.dry_run = dry_run
+        self.backfill_existing = backfill_existing
+        self.changes = 0
+
+    def query(self, sql, params=None):
+        """Lecture de l'état de la base (exécutée aussi avec --dry-run)"""
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def change(self, description, sql, params=None):
+        """Modification de la base (seulement affichée avec --dry-run)"""
+        self.changes += 1
+        print(f"➕ {description}")
+        if self.dry_run:
+            print(f"   {' '.join(self.cursor.mogrify(sql, params).decode().split())}")
+            return
+        self.cursor.execute(sql, params)
+
+    def check_timescaledb(self):
+        """Version de l'extension TimescaleDB (None si absente)"""
+        rows = self.query("SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'")
+        return rows[0][0] if rows else None
+
+    def relation_exists(self, name):
+        return self.query("SELECT to_regclass(%s) IS NOT NULL", (name,))[0][0]
+
+    def hypertable(self, table):
+        """Informations de l'hypertable : compression activée (None si ce n'est pas une hypertable)"""
+        rows = self.query(
+            "SELECT compression_enabled FROM timescaledb_information.hypertables "
+            "WHERE hypertable_name = %s", (table,))
+        return rows[0] if rows else None
+
+    def job_differs(self, proc_name, hypertable, key, interval):
+        """None si la politique n'existe pas, sinon vrai si son paramètre est différent"""
+        # Un agrégat continu est désigné dans jobs par son hypertable de matérialisation
+        rows = self.query(
+            "SELECT (config->>%s)::interval <> %s::interval FROM timescaledb_information.jobs "
+            "WHERE proc_name = %s AND hypertable_name IN ("
+            "  SELECT %s UNION ALL SELECT materialization_hypertable_name "
+            "  FROM timescaledb_information.continuous_aggregates WHERE view_name = %s)",
+            (key, interval, proc_name, hypertable, hypertable))
+        return rows[0][0] if rows else None
+
+    def create_table(self, table, spec):
+        if self.relation_exists(table):
+            print(f"✓ Table {table}")
+        else:
+            self.change(f"Table {table}", spec['ddl'])
+
+        hypertable = self.hypertable(table)
+        if hypertable is None:
+            # migrate_data : une table existante non vide est convertie sur place
+            self.change(
+                f"Hypertable {table} (chunks de {spec['chunk_interval']})",
+                "SELECT create_hypertable(%s, 'time', chunk_time_interval => %s::interval, "
+                "if_not_exists => TRUE, migrate_data => TRUE)",
+                (table, spec['chunk_interval']))
+        else:
+            rows = self.query(
+                "SELECT time_interval = %s::interval FROM timescaledb_information.dimensions "
+                "WHERE hypertable_name = %s AND column_name = 'time'", (spec['chunk_interval'], table))
+            if rows and not rows[0][0]:
+                # Ne s'applique qu'aux nouveaux chunks
+                self.change(f"Intervalle des chunks de {table} : {spec['chunk_interval']}",
+                            "SELECT set_chunk_time_interval(%s, %s::interval)", (table, spec['chunk_interval']))
+            else:
+                print(f"✓ Hypertable {table}")
+
+        for index in spec['indexes']:
+            name = index.split('EXISTS', 1)[1].split()[0]
+            if self.relation_exists(name):
+                print(f"✓ Index {name}")
+            else:
+                self.change(f"Index {name}", index)
+
+        if 'view' in spec:
+            view, ddl = spec['view']
+            if self.relation_exists(view):
+                print(f"✓ Vue {view}")
+            else:
+                self.change(f"Vue {view} et son trigger d'insertion", ddl)
+
+    def compress(self, table, spec, compress_after):
+        """Compression segmentée par capteur et politique de compression"""
+        enabled = self.hypertable(table)
+        if self.dry_run and enabled is None:
+            enabled = (False,)
+        if not enabled[0]:
+            self.change(
+                f"Compression de {table} (segmentby {spec['segmentby']})",
+                f"ALTER TABLE {table} SET (timescaledb.compress, "
+                f"timescaledb.compress_segmentby = '{spec['segmentby']}', "
+                f"timescaledb.compress_orderby = '{spec['orderby']}')")
+        else:
+            rows = self.query(
+                "SELECT string_agg(attname, ', ' ORDER BY segmentby_column_index) "
+                "FROM timescaledb_information.compression_settings "
+                "WHERE hypertable_name = %s AND segmentby_column_index IS NOT NULL", (table,))
+            current = rows[0][0] if rows else None
+            if current != spec['segmentby']:
+                print(f"⚠️  Compression de {table} déjà configurée avec segmentby '{current}' "
+                      f"(attendu : '{spec['segmentby']}'), non modifiée")
+            else:
+                print(f"✓ Compression de {table}")
+
+        self.policy('policy_compression', table, 'compress_after', compress_after,
+                    "add_compression_policy", "remove_compression_policy", f"Compression après {compress_after}")
+
+    def policy(self, proc_name, hypertable, key, interval, add, remove, description):
+        """Politique à un paramètre (compression, rétention), remplacée si elle diffère"""
+        differs = self.job_differs(proc_name, hypertable, key, interval)
+        if differs is False:
+            print(f"✓ {description} ({hypertable})")
+            return
+        if differs:
+            self.change(f"Suppression de l'ancienne politique {proc_name} ({hypertable})",
+                        f"SELECT {remove}(%s, if_exists => TRUE)", (hypertable,))
+        self.change(f"{description} ({hypertable})",
+                    f"SELECT {add}(%s, %s::interval, if_not_exists => TRUE)", (hypertable, interval))
+
+    def aggregates(self, table, spec):
+        """Agrégats continus 1m, 1h et 1d et leur politique de rafraîchissement"""
+        for suffix, (bucket, start_offset, end_offset, schedule) in AGGREGATES.items():
+            view = f"{table}_{suffix}"
+            if self.relation_exists(view):
+                print(f"✓ Agrégat continu {view}")
+                if self.backfill_existing:
+                    self.backfill(table, view, bucket, start_offset)
+            else:
+                # WITH NO DATA puis remplissage par tranches (pas une seule transaction
+                # sur tout l'historique) ; la politique ne couvre que sa fenêtre
+                self.change(
+                    f"Agrégat continu {view}",
+                    f"CREATE MATERIALIZED VIEW IF NOT EXISTS {view} WITH (timescaledb.continuous) AS "
+                    f"{aggregate_query(table, spec, bucket)} WITH NO DATA")
+                self.backfill(table, view, bucket, start_offset)
+            rows = self.query(
+                "SELECT (config->>'start_offset')::interval = %s::interval "
+                "AND (config->>'end_offset')::interval = %s::interval AND schedule_interval = %s::interval "
+                "FROM timescaledb_information.jobs j "
+                "JOIN timescaledb_information.continuous_aggregates c "
+                "ON c.materialization_hypertable_name = j.hypertable_name "
+                "WHERE j.proc_name = 'policy_refresh_continuous_aggregate' AND c.view_name = %s",
+                (start_offset, end_offset, schedule, view))
+            if rows and rows[0][0]:
+                print(f"✓ Rafraîchissement de {view}")
+                continue
+            if rows:
+                self.change(f"Suppression de l'ancien rafraîchissement de {view}",
+                            "SELECT remove_continuous_aggregate_policy(%s, if_exists => TRUE)", (view,))
+            self.change(
+                f"Rafraîchissement de {view} (toutes les {schedule}, de -{start_offset} à -{end_offset})",
+                "SELECT add_continuous_aggregate_policy(%s, start_offset => %s::interval, "
+                "end_offset => %s::interval, schedule_interval => %s::interval, if_not_exists => TRUE)",
+                (view, start_offset, end_offset, schedule))
+
+    def backfill(self, table, view, bucket, start_offset):
+        """Remplit l'agrégat avec l'historique jusqu'au début de la fenêtre de la
+        politique, par tranches de BACKFILL_CHUNK (une transaction par tranche)"""
+        if not self.relation_exists(table):
+            return  # --dry-run : table pas encore créée, rien à remplir
+        first, end = self.query(
+            f"SELECT time_bucket(%s::interval, min(time)), time_bucket(%s::interval, now() - %s::interval) "
+            f"FROM {table}", (bucket, bucket, start_offset))[0]
+        if first is None or first >= end:
+            return
+        chunks = []
+        current = first
+        while current < end:
+            chunks.append((current, min(current + self.BACKFILL_CHUNK, end)))
+            current = chunks[-1][1]
+        self.changes += 1
+        print(f"➕ Remplissage de {view} ({first:%Y-%m-%d} → {end:%Y-%m-%d}, {len(chunks)} tranches)")
+        if self.dry_run:
+            return
+        for start, stop in chunks:
+            self.cursor.execute("CALL refresh_continuous_aggregate(%s, %s, %s)", (view, start, stop))
+            print(f"   {start:%Y-%m-%d} → {stop:%Y-%m-%d}")
+
+    def provision(self, table, compress_after, retention):
+        spec = TABLES[table]
+        print(f"\n📦 {table}")
+        self.create_table(table, spec)
+        self.compress(table, spec, compress_after)
+        if 'group_by' in spec:
+            self.aggregates(table, spec)
+        # Rétention des données brutes et des agrégats (seulement si configurée)
+        for name in [table] + [f"{table}_{suffix}" for suffix in AGGREGATES]:
+            if retention.get(name):
+                self.policy('policy_retention', name, 'drop_after', retention[name],
+                            "add_retention_policy", "remove_retention_policy",
+                            f"Rétention de {retention[name]}")
+
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Mise en place des tables TimescaleDB (peut être relancé)")
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES),
+                        help="tables à mettre en place (par défaut : selon SENSOR_SCHEMA, et file_info)")
+    parser.add_argument('--compress-after', default=getattr(config, 'PROVISION_COMPRESS_AFTER', '7 days'),
+                        help="âge des chunks compressés (intervalle PostgreSQL)")
+    parser.add_argument('--dry-run', action='store_true', help="afficher les changements sans les faire")
+    parser.add_argument('--backfill', action='store_true',
+                        help="remplir aussi les agrégats continus existants avec l'historique")
+    args = parser.parse_args()
+
+    retention = getattr(config, 'PROVISION_RETENTION', {})
+    conn = psycopg2.connect(connection_string())
+    try:
+        provisioner = Provisioner(conn, args.dry_run, args.backfill)
+        version = provisioner.check_timescaledb()
+        if version is None:
+            print("✗ Extension timescaledb absente (CREATE EXTENSION timescaledb, en superutilisateur)")
+            sys.exit(1)
+        print(f"✓ TimescaleDB {version}")
+
+        for table in args.tables or default_tables():
+            provisioner.provision(table, args.compress_after, retention)
+
+        if not provisioner.changes:
+            print("\n✓ Base déjà à jour")
+        elif args.dry_run:
+            print(f"\nℹ️  {provisioner.changes} changements à faire (--dry-run)")
+        else:
+            print(f"\n✓ {provisioner.changes} changements faits")
+    except psycopg2.Error as e:
+        print(f"✗ Erreur TimescaleDB: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Schéma "ids" des capteurs (config.SENSOR_SCHEMA)
+Les lectures sont écrites dans sensor_values avec des identifiants entiers :
+- sensors      : id, mac, capteur
+- measurements : id, name (MI_TEMPERATURE, MI_HUMIDITY...)
+La vue sensor_data_compat présente les colonnes de sensor_data
+(time, mac, capteur, measurement, value) et accepte les INSERT (rejeu du
+journal local). La résolution texte -> identifiant est mise en cache par le sink
+"""
+
+# Tables, index, vue de compatibilité et trigger d'insertion dans la vue
+DIMENSION_DDL = """
+    CREATE TABLE IF NOT EXISTS sensors (
+        id      SERIAL PRIMARY KEY,
+        mac     TEXT NOT NULL UNIQUE,
+        capteur TEXT
+    );
+    CREATE TABLE IF NOT EXISTS measurements (
+        id   SMALLSERIAL PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS sensor_values (
+        time           TIMESTAMPTZ      NOT NULL,
+        sensor_id      INTEGER          NOT NULL,
+        measurement_id SMALLINT         NOT NULL,
+        value          DOUBLE PRECISION
+    );
+"""
+VALUES_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS sensor_values_sensor_time_idx
+    ON sensor_values (sensor_id, measurement_id, time DESC)
+"""
+COMPAT_VIEW_DDL = """
+    CREATE OR REPLACE VIEW sensor_data_compat AS
+    SELECT v.time, s.mac, s.capteur, m.name AS measurement, v.value
+    FROM sensor_values v
+    JOIN sensors s ON s.id = v.sensor_id
+    JOIN measurements m ON m.id = v.measurement_id;
+
+    CREATE OR REPLACE FUNCTION sensor_data_compat_insert() RETURNS trigger AS $$
+    DECLARE
+        sid INTEGER;
+        mid SMALLINT;
+    BEGIN
+        SELECT id INTO sid FROM sensors WHERE mac = NEW.mac;
+        IF NOT FOUND THEN
+            INSERT INTO sensors (mac, capteur) VALUES (NEW.mac, NEW.capteur)
+            ON CONFLICT (mac) DO UPDATE SET capteur = EXCLUDED.capteur
+            RETURNING id INTO sid;
+        END IF;
+        SELECT id INTO mid FROM measurements WHERE name = NEW.measurement;
+        IF NOT FOUND THEN
+            INSERT INTO measurements (name) VALUES (NEW.measurement)
+            ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+            RETURNING id INTO mid;
+        END IF;
+        INSERT INTO sensor_values (time, sensor_id, measurement_id, value)
+        VALUES (NEW.time, sid, mid, NEW.value);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS sensor_data_compat_insert ON sensor_data_compat;
+    CREATE TRIGGER sensor_data_compat_insert INSTEAD OF INSERT ON sensor_data_compat
+    FOR EACH ROW EXECUTE FUNCTION sensor_data_compat_insert();
+"""
+
+
+def create_tables(conn):
+    """Crée les tables du schéma ids (sensor_values en hypertable si TimescaleDB est installé)"""
+    cursor = conn.cursor()
+    cursor.execute(DIMENSION_DDL)
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+    if cursor.fetchone():
+        cursor.execute("SELECT create_hypertable('sensor_values', 'time', if_not_exists => TRUE)")
+    cursor.execute(VALUES_INDEX_DDL)
+    cursor.execute(COMPAT_VIEW_DDL)
+    conn.commit()
+    cursor.close()
+
+
+class DimensionCache:
+    """Cache mac -> (id, capteur) et mesure -> id, chargé à la première utilisation"""
+
+    def __init__(self):
+        self.sensors = {}
+        self.measurements = {}
+        self.loaded = False
+
+    def load(self, cursor):
+        """Charge les tables de dimension (quelques centaines de lignes)"""
+        cursor.execute("SELECT mac, id, capteur FROM sensors")
+        self.sensors = {mac: (sensor_id, capteur) for mac, sensor_id, capteur in cursor.fetchall()}
+        cursor.execute("SELECT name, id FROM measurements")
+        self.measurements = dict(cursor.fetchall())
+        self.loaded = True
+
+    def resolve(self, cursor, rows):
+        """(time, mac, capteur, measurement, value) -> (time, sensor_id, measurement_id, value)
+        Les capteurs et mesures inconnus (ou renommés) sont créés et validés
+        (commit) avant d'être mis en cache"""
+        if not self.loaded:
+            self.load(cursor)
+        sensors = self.sensors
+        measurements = self.measurements
+        new_sensors = {}
+        new_measurements = {}
+        result = []
+        for timestamp, mac, capteur, measurement, value in rows:
+            sensor = new_sensors.get(mac) or sensors.get(mac)
+            if sensor is None or sensor[1] != capteur:
+                cursor.execute(
+                    "INSERT INTO sensors (mac, capteur) VALUES (%s, %s) "
+                    "ON CONFLICT (mac) DO UPDATE SET capteur = EXCLUDED.capteur RETURNING id",
+                    (mac, capteur))
+                sensor = new_sensors[mac] = (cursor.fetchone()[0], capteur)
+            measurement_id = new_measurements.get(measurement) or measurements.get(measurement)
+            if measurement_id is None:
+                cursor.execute(
+                    "INSERT INTO measurements (name) VALUES (%s) "
+                    "ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name RETURNING id",
+                    (measurement,))
+                measurement_id = new_measurements[measurement] = cursor.fetchone()[0]
+            result.append((timestamp, sensor[0], measurement_id, value))
+
+        if new_sensors or new_measurements:
+            # Valider avant de mettre en cache (un échec de l'insertion des lignes
+            # ne doit pas laisser d'identifiants inexistants dans le cache)
+            cursor.connection.commit()
+            sensors.update(new_sensors)
+            measurements.update(new_measurements)
+        return result
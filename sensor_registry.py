@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Registre des capteurs rechargé à chaud (config.SENSORS_FILE, JSON)
+{
+  "zigbee":    {"0x00158d0001a2b3c4": "Salon"},
+  "bluetooth": {"A4:C1:38:12:34:56": "Chambre"},
+  "gatt":      {"1": "58:2d:34:32:60:33"}
+}
+Une section absente du fichier reprend config.ZIGBEE_SENSORS / config.BLUETOOTH_SENSORS
+(ou la table du script GATT). Le fichier est surveillé (date de modification,
+taille, inode) toutes les SENSORS_RELOAD_INTERVAL secondes : le nouveau registre
+est validé en entier puis appliqué aux listeners en cours (abonnements MQTT,
+tables de correspondance et noms) ; un fichier invalide est ignoré et l'ancien
+registre conservé
+"""
+
+import json
+import os
+import threading
+import time
+import config
+from log_setup import fields, get_logger
+
+log = get_logger('registre')
+
+# Section -> registre par défaut dans config
+CONFIG_SECTIONS = {
+    'zigbee': 'ZIGBEE_SENSORS',
+    'bluetooth': 'BLUETOOTH_SENSORS',
+    'gatt': None,
+}
+
+
+def normalize(section, sensors):
+    """Section validée : identifiant -> nom (bluetooth : MAC en majuscules,
+    gatt : identifiant -> {'mac': ...}) ; ValueError si invalide"""
+    if not isinstance(sensors, dict):
+        raise ValueError(f"section {section} : objet JSON attendu")
+    result = {}
+    for key, value in sensors.items():
+        if section == 'gatt':
+            mac = value.get('mac') if isinstance(value, dict) else value
+            if not isinstance(mac, str):
+                raise ValueError(f"section gatt : adresse MAC attendue pour {key}")
+            result[str(key)] = {'mac': mac}
+        elif isinstance(value, str):
+            result[key.upper() if section == 'bluetooth' else key] = value
+        else:
+            raise ValueError(f"section {section} : nom attendu pour {key}")
+    return result
+
+
+class SensorRegistry:
+    """Registre des capteurs lu depuis un fichier, avec rechargement à chaud"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.sections = {}
+        self.signature = None
+        self.lock = threading.Lock()
+        self.callbacks = []   # [(section, callback)]
+        self.thread = None
+
+    def _signature(self):
+        try:
+            stats = os.stat(self.path)
+        except OSError:
+            return None
+        return (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+
+    def refresh(self):
+        """Relit le fichier s'il a changé ; retourne les sections modifiées"""
+        if not self.path:
+            return set()
+        with self.lock:
+            signature = self._signature()
+            if signature == self.signature:
+                return set()
+            self.signature = signature
+            if signature is None:
+                log.warning("fichier de capteurs absent, registre de config utilisé", extra=fields(path=self.path))
+                sections = {}
+            else:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    if not isinstance(data, dict):
+                        raise ValueError("objet JSON attendu")
+                    # Tout le fichier est validé avant d'être appliqué
+                    sections = {section: normalize(section, data[section]) for section in CONFIG_SECTIONS
+                                if section in data}
+                except (OSError, ValueError) as e:
+                    log.warning("fichier de capteurs invalide, registre inchangé",
+                                extra=fields(path=self.path, erreur=e))
+                    return set()
+            changed = {section for section in CONFIG_SECTIONS
+                       if sections.get(section) != self.sections.get(section)}
+            self.sections = sections
+            callbacks = [(section, callback) for section, callback in self.callbacks if section in changed]
+        for section in sorted(changed):
+            if section in sections:
+                log.info("registre chargé", extra=fields(section=section, capteurs=len(sections[section])))
+            else:
+                log.info("registre de config utilisé", extra=fields(section=section))
+        for section, callback in callbacks:
+            try:
+                callback(self.sensors(section, {}, False))
+            except Exception as e:
+                log.error("application du registre impossible", extra=fields(section=section, erreur=e))
+        return changed
+
+    def sensors(self, section, default=None, refresh=True):
+        """Capteurs d'une section (nouveau dictionnaire à chaque rechargement)
+        Section absente du fichier : registre de config, sinon default"""
+        if refresh:
+            self.refresh()
+        sensors = self.sections.get(section)
+        if sensors is None:
+            name = CONFIG_SECTIONS.get(section)
+            sensors = getattr(config, name, None) if name else None
+        return default if sensors is None else sensors
+
+    def watch(self, section, callback):
+        """Appelle callback(capteurs) à chaque changement de la section
+        Retourne la fonction qui arrête la surveillance"""
+        entry = (section, callback)
+        with self.lock:
+            self.callbacks.append(entry)
+            if self.path and self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name='sensor-registry', daemon=True)
+                self.thread.start()
+
+        def unwatch():
+            with self.lock:
+                if entry in self.callbacks:
+                    self.callbacks.remove(entry)
+        return unwatch
+
+    def _loop(self):
+        interval = getattr(config, 'SENSORS_RELOAD_INTERVAL', 5.0)
+        while True:
+            time.sleep(interval)
+            self.refresh()
+
+
+SENSOR_REGISTRY = SensorRegistry(getattr(config, 'SENSORS_FILE', None))
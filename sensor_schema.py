@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Schéma de sortie des lectures de capteurs (config.SENSOR_SCHEMA)
+- narrow : une ligne sensor_data par mesure (MI_TEMPERATURE, MI_HUMIDITY...)
+- wide   : une ligne sensor_readings par lecture, une colonne typée par mesure
+- both   : les deux (période de transition)
+- ids    : une ligne sensor_values par mesure, capteur et mesure en identifiants
+           entiers (voir sensor_dimensions.py)
+Plusieurs schémas peuvent être combinés : SENSOR_SCHEMA = ("narrow", "ids")
+"""
+
+import config
+
+SCHEMA_NARROW = 'narrow'
+SCHEMA_WIDE = 'wide'
+SCHEMA_BOTH = 'both'
+SCHEMA_IDS = 'ids'
+SCHEMAS = (SCHEMA_NARROW, SCHEMA_WIDE, SCHEMA_IDS)
+
+# Champ d'une lecture -> nom de mesure dans sensor_data
+MEASUREMENTS = {
+    'temperature': 'MI_TEMPERATURE',
+    'humidity': 'MI_HUMIDITY',
+    'battery': 'MI_BATTERY',
+    'voltage': 'MI_BATTERY_MV',
+    'linkquality': 'MI_LINKQUALITY',
+    'rssi': 'MI_RSSI',
+}
+
+# Colonnes de mesure de sensor_readings (dans l'ordre de la table)
+WIDE_FIELDS = ('temperature', 'humidity', 'battery', 'voltage', 'rssi', 'linkquality')
+# Mesures qui décident de l'écriture d'une ligne large avec la bande morte
+# (rssi et linkquality varient à chaque message : écrits avec la ligne retenue)
+MEASURED_FIELDS = ('temperature', 'humidity', 'battery', 'voltage')
+
+# Table large (voir migrate-sensor-data-wide.py)
+WIDE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS sensor_readings (
+        time        TIMESTAMPTZ      NOT NULL,
+        mac         TEXT             NOT NULL,
+        capteur     TEXT,
+        temperature DOUBLE PRECISION,
+        humidity    DOUBLE PRECISION,
+        battery     DOUBLE PRECISION,
+        voltage     INTEGER,
+        rssi        SMALLINT,
+        linkquality SMALLINT
+    )
+"""
+WIDE_INDEX_DDL = """
+    CREATE UNIQUE INDEX IF NOT EXISTS sensor_readings_mac_time_idx
+    ON sensor_readings (mac, time DESC)
+"""
+
+
+def get_schemas(schema=None):
+    """Schémas de sortie configurés (narrow par défaut), sous forme d'ensemble"""
+    schema = schema or getattr(config, 'SENSOR_SCHEMA', SCHEMA_NARROW)
+    names = (schema,) if isinstance(schema, str) else tuple(schema)
+    schemas = set()
+    for name in names:
+        if name == SCHEMA_BOTH:
+            schemas.update((SCHEMA_NARROW, SCHEMA_WIDE))
+        elif name in SCHEMAS:
+            schemas.add(name)
+        else:
+            raise ValueError(f"SENSOR_SCHEMA inconnu: {name}")
+    return schemas
+
+
+def build_rows(timestamp, mac, capteur, values, narrow_fields=None, deadband=None, schema=None):
+    """Construit les lignes d'une lecture selon le schéma configuré
+    values : dictionnaire champ -> valeur (None si absente)
+    narrow_fields : champs écrits dans sensor_data / sensor_values (tous par défaut, hors rssi)
+    Retourne une liste de (requête du sink, lignes)"""
+    schemas = get_schemas(schema)
+    result = []
+
+    # Une ligne par mesure (sensor_data et/ou sensor_values), filtrée une seule fois
+    rows = None
+    if SCHEMA_NARROW in schemas or SCHEMA_IDS in schemas:
+        fields = narrow_fields or ('temperature', 'humidity', 'battery', 'voltage', 'linkquality')
+        rows = [
+            (timestamp, mac, capteur, MEASUREMENTS[field], values[field])
+            for field in fields if values.get(field) is not None
+        ]
+        if deadband:
+            rows = deadband.filter_rows(mac, rows)
+        if rows:
+            if SCHEMA_NARROW in schemas:
+                result.append(('sensor_data', rows))
+            if SCHEMA_IDS in schemas:
+                # Résolution en identifiants par le sink
+                result.append(('sensor_values', rows))
+
+    if SCHEMA_WIDE in schemas:
+        write = True
+        if deadband and rows is None:
+            # Une ligne complète dès qu'une des mesures a changé
+            changed = [
+                deadband.allow(mac, MEASUREMENTS[field], values[field])
+                for field in (narrow_fields or MEASURED_FIELDS) if values.get(field) is not None
+            ]
+            write = any(changed)
+        elif deadband:
+            # Suivre la décision prise pour les lignes par mesure
+            write = bool(rows)
+        if write:
+            row = (timestamp, mac, capteur) + tuple(values.get(field) for field in WIDE_FIELDS)
+            result.append(('sensor_readings', [row]))
+
+    return result
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Journal local (SQLite) des lignes non écrites dans TimescaleDB
+Les lignes sont ajoutées quand la base est injoignable puis rejouées dans
+l'ordre, par gros lots, dès que la connexion est rétablie
+Une ligne refusée par TimescaleDB (colonne ou table absente, valeur invalide,
+contrainte) ne bloque pas le rejeu : elle est déplacée dans la table spool_dead
+du journal, avec l'erreur. Pour la rejouer une fois le schéma corrigé :
+  sqlite3 spool.sqlite "INSERT INTO spool (target, columns, row)
+      SELECT target, columns, row FROM spool_dead ORDER BY id; DELETE FROM spool_dead"
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import execute_values
+import config
+from metrics import REGISTRY
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool.sqlite')
+
+ROWS_DEAD = REGISTRY.counter('spool_rows_dead_total', "Lignes du journal refusées par TimescaleDB (spool_dead)")
+
+# Erreurs propres aux lignes ou au schéma : rejouer ne servirait à rien
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+SCHEMA_ERRORS = (psycopg2.ProgrammingError,)
+
+
+def _encode(value):
+    """Sérialise les dates pour le stockage JSON"""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Type non sérialisable: {type(value).__name__}")
+
+
+def _decode(obj):
+    """Restaure les dates lors de la relecture JSON"""
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class Spool:
+    """Journal append-only des lignes en attente d'écriture"""
+
+    def __init__(self, path=None):
+        self.path = path or getattr(config, 'SPOOL_PATH', DEFAULT_PATH)
+        self.lock = threading.Lock()
+        # Plusieurs scripts (cron) peuvent partager le même journal
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT NOT NULL,
+                columns TEXT NOT NULL,
+                row TEXT NOT NULL
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS spool_dead (
+                id INTEGER PRIMARY KEY,
+                target TEXT NOT NULL,
+                columns TEXT NOT NULL,
+                row TEXT NOT NULL,
+                error TEXT,
+                failed_at TEXT NOT NULL
+            )
+        """)
+        self.rows_dead = 0
+
+    def append(self, table, columns, rows):
+        """Ajoute des lignes au journal"""
+        if not rows:
+            return 0
+        cols = ','.join(columns)
+        records = [(table, cols, json.dumps(list(row), default=_encode)) for row in rows]
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany("INSERT INTO spool (target, columns, row) VALUES (?, ?, ?)", records)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def pending(self):
+        """Nombre de lignes en attente dans le journal"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def drain(self, db_conn, batch_size=5000):
+        """Rejoue le journal dans TimescaleDB, dans l'ordre, par lots
+        Retourne le nombre de lignes écrites"""
+        total = 0
+        while True:
+            with self.lock:
+                count = self._drain_batch(db_conn, batch_size)
+            if not count:
+                return total
+            total += count
+
+    def _drain_batch(self, db_conn, batch_size):
+        """Rejoue le plus ancien lot du journal"""
+        # Verrou d'écriture SQLite : un seul processus rejoue à la fois
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            records = self.db.execute(
+                "SELECT id, target, columns, row FROM spool ORDER BY id LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            if not records:
+                self.db.execute("COMMIT")
+                return 0
+
+            # Regrouper les lignes consécutives d'une même table
+            cursor = db_conn.cursor()
+            groups = []
+            for record in records:
+                key = (record[1], record[2])
+                if not groups or groups[-1][0] != key:
+                    groups.append((key, []))
+                groups[-1][1].append(record)
+            dead = []
+            for key, group in groups:
+                dead.extend(self._insert_group(cursor, key, group))
+            db_conn.commit()
+            cursor.close()
+
+            if dead:
+                failed_at = datetime.now().isoformat(timespec='seconds')
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO spool_dead (id, target, columns, row, error, failed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [record + (error, failed_at) for record, error in dead])
+            self.db.execute("DELETE FROM spool WHERE id <= ?", (records[-1][0],))
+            self.db.execute("COMMIT")
+            if dead:
+                self.rows_dead += len(dead)
+                ROWS_DEAD.inc(len(dead))
+                print(f"✗ {len(dead)} lignes du journal refusées par TimescaleDB, déplacées dans spool_dead "
+                      f"({dead[0][1]})")
+            return len(records)
+        except Exception:
+            self.db.execute("ROLLBACK")
+            try:
+                db_conn.rollback()
+            except Exception:
+                pass
+            raise
+
+    def _insert_group(self, cursor, key, records):
+        """Insère un groupe de lignes d'une même table (point de sauvegarde)
+        Retourne les lignes refusées : liste de (enregistrement du journal, erreur)"""
+        rows = [tuple(json.loads(record[3], object_hook=_decode)) for record in records]
+        cursor.execute("SAVEPOINT spool_group")
+        try:
+            self._insert(cursor, key, rows)
+            cursor.execute("RELEASE SAVEPOINT spool_group")
+            return []
+        except SCHEMA_ERRORS + ROW_ERRORS as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT spool_group")
+            if isinstance(e, SCHEMA_ERRORS) or len(rows) == 1:
+                # Table ou colonne absente : tout le groupe est refusé
+                return [(record, str(e).strip()) for record in records]
+        # Valeur invalide ou contrainte : isoler les lignes fautives
+        dead = []
+        for record, row in zip(records, rows):
+            cursor.execute("SAVEPOINT spool_row")
+            try:
+                self._insert(cursor, key, [row])
+                cursor.execute("RELEASE SAVEPOINT spool_row")
+            except SCHEMA_ERRORS + ROW_ERRORS as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT spool_row")
+                dead.append((record, str(e).strip()))
+        return dead
+
+    def _insert(self, cursor, key, rows):
+        """Insère un groupe de lignes d'une même table"""
+        table, columns = key
+        query = f"INSERT INTO {table} ({', '.join(columns.split(','))}) VALUES %s"
+        execute_values(cursor, query, rows, page_size=len(rows))
+
+    def close(self):
+        """Ferme le journal"""
+        self.db.close()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Écriture dans TimescaleDB partagée par tous les scripts
+- une seule connexion réutilisée par processus
+- requêtes d'insertion préparées une fois par connexion (à la première utilisation),
+  désactivées derrière un pgbouncer en mode transaction (TIMESCALEDB_PREPARE = False
+  ou détection de l'erreur « prepared statement does not exist »)
+- reconnexion automatique avec délai croissant (backoff)
+- journal local (spool) quand la base est injoignable
+"""
+
+import io
+import random
+import threading
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+import config
+from spool import Spool
+from sensor_dimensions import DimensionCache
+from metrics import REGISTRY
+
+# Tables et colonnes connues (nom de requête préparée -> table, colonnes)
+# Adapter le nom de la table selon votre schéma
+STATEMENTS = {
+    'sensor_data': ('sensor_data', ('time', 'mac', 'capteur', 'measurement', 'value')),
+    'sensor_data_host': ('sensor_data', ('time', 'host', 'measurement', 'value')),
+    'sensor_readings': ('sensor_readings', ('time', 'mac', 'capteur', 'temperature', 'humidity',
+                                            'battery', 'voltage', 'rssi', 'linkquality')),
+    'file_info': ('file_info', ('time', 'file_path', 'file_name', 'name', 'host', 'modification_time', 'file_size')),
+    'file_info_fingerprint': ('file_info', ('time', 'file_path', 'file_name', 'name', 'host', 'modification_time',
+                                            'file_size', 'fingerprint')),
+    # Schéma ids (voir sensor_dimensions.py) : les lignes sensor_values sont reçues
+    # au format de sensor_data puis résolues en identifiants avant l'insertion.
+    # Non résolues (base injoignable), elles passent par la vue de compatibilité
+    'sensor_values': ('sensor_data_compat', ('time', 'mac', 'capteur', 'measurement', 'value')),
+    'sensor_values_ids': ('sensor_values', ('time', 'sensor_id', 'measurement_id', 'value')),
+}
+# Erreurs d'une requête préparée perdue ou déjà présente : pooler en mode
+# transaction (la session PostgreSQL change d'une transaction à l'autre)
+PREPARED_STATEMENT_ERRORS = ('26000', '42P05')
+
+# Requêtes dont les lignes sont résolues en identifiants -> requête d'insertion
+RESOLVED_STATEMENTS = {'sensor_values': 'sensor_values_ids'}
+
+# Résultat d'une écriture
+WRITTEN = 'written'     # écrit dans TimescaleDB
+SPOOLED = 'spooled'     # placé dans le journal local
+FAILED = 'failed'       # perdu (erreur de données ou pas de journal)
+
+# Métriques (voir metrics.py)
+WRITE_SECONDS = REGISTRY.histogram('timescaledb_write_seconds', "Durée d'une écriture (requête et commit)")
+COMMIT_FAILURES = REGISTRY.counter('timescaledb_commit_failures_total', "Écritures en échec (base injoignable ou erreur)")
+ROWS_WRITTEN = REGISTRY.counter('timescaledb_rows_written_total', "Lignes écrites dans TimescaleDB")
+ROWS_SPOOLED = REGISTRY.counter('timescaledb_rows_spooled_total', "Lignes placées dans le journal local")
+ROWS_FAILED = REGISTRY.counter('timescaledb_rows_failed_total', "Lignes perdues")
+RECONNECTIONS = REGISTRY.counter('timescaledb_reconnections_total', "Reconnexions à TimescaleDB")
+
+
+def connection_string():
+    """Chaîne de connexion à TimescaleDB construite depuis config"""
+    # TIMESCALEDB_DSN permet par exemple de passer par un pgbouncer local
+    # (mode transaction : TIMESCALEDB_PREPARE = False, voir TimescaleSink.write)
+    dsn = getattr(config, 'TIMESCALEDB_DSN', None)
+    if dsn:
+        return dsn
+    return (
+        f"host={config.TIMESCALEDB_HOST} "
+        f"port={config.TIMESCALEDB_PORT} "
+        f"user={config.TIMESCALEDB_USER} "
+        f"password={config.TIMESCALEDB_PASSWORD} "
+        f"dbname={config.TIMESCALEDB_DATABASE} "
+        f"sslmode={config.TIMESCALEDB_SSLMODE} "
+        f"connect_timeout={getattr(config, 'TIMESCALEDB_CONNECT_TIMEOUT', 5)} "
+        f"application_name=script-telegraf "
+        # Détecter rapidement une connexion coupée (listeners longue durée)
+        f"keepalives=1 keepalives_idle=30 keepalives_interval=10 keepalives_count=3"
+    )
+
+
+def copy_value(value):
+    """Valeur au format texte de COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+def copy_buffer(rows):
+    """Lignes au format texte de COPY (une ligne par enregistrement)"""
+    return io.StringIO(''.join('\t'.join(map(copy_value, row)) + '\n' for row in rows))
+
+
+class TimescaleSink:
+    """Connexion TimescaleDB réutilisable avec reconnexion et journal local"""
+
+    def __init__(self, spool=None, dsn=None, backoff=1.0, max_backoff=None):
+        self.spool = spool
+        self.dsn = dsn or connection_string()
+        self.conn = None
+        self.prepared = set()
+        # PREPARE est lié à la session : inutilisable derrière un pooler en mode transaction
+        self.use_prepared = getattr(config, 'TIMESCALEDB_PREPARE', True)
+        self.dimensions = DimensionCache()
+        self.lock = threading.RLock()
+        # Reconnexion : délai doublé à chaque échec, plafonné
+        self.backoff = backoff
+        self.max_backoff = max_backoff or getattr(config, 'DB_RETRY_INTERVAL', 30.0)
+        self.delay = backoff
+        self.next_attempt = 0.0
+        self.spool_pending = bool(spool and spool.pending())
+        # Compteurs
+        self.rows_written = 0
+        self.rows_spooled = 0
+        self.rows_failed = 0
+        self.reconnections = 0
+
+    @property
+    def connected(self):
+        return self.conn is not None and not self.conn.closed
+
+    def connect(self, attempts=1):
+        """Ouvre la connexion (jusqu'à attempts tentatives espacées par le backoff)
+        Retourne True si la connexion est établie"""
+        with self.lock:
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(self.delay)
+                    self.next_attempt = 0.0
+                if self._try_connect():
+                    return True
+            return False
+
+    def _try_connect(self):
+        """Tente une connexion si le délai de backoff est écoulé"""
+        now = time.monotonic()
+        if now < self.next_attempt:
+            return False
+        try:
+            conn = psycopg2.connect(self.dsn)
+        except psycopg2.Error as e:
+            print(f"✗ Erreur connexion TimescaleDB: {e}")
+            # Délai avant la prochaine tentative (avec un peu d'aléa)
+            self.next_attempt = now + self.delay * random.uniform(0.8, 1.2)
+            self.delay = min(self.delay * 2, self.max_backoff)
+            return False
+
+        if self.conn is not None:
+            self.reconnections += 1
+            RECONNECTIONS.inc()
+            print("✓ Reconnecté à TimescaleDB")
+        self.conn = conn
+        self.prepared = set()
+        self.delay = self.backoff
+        self.next_attempt = 0.0
+
+        # Connexion disponible : rejouer le journal local
+        if self.spool_pending:
+            self._drain_spool()
+        return True
+
+    def _prepare(self, cursor, name):
+        """Prépare la requête d'insertion name pour la connexion courante"""
+        table, columns = STATEMENTS[name]
+        params = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+        cursor.execute(f"PREPARE insert_{name} AS INSERT INTO {table} ({', '.join(columns)}) VALUES ({params})")
+        self.prepared.add(name)
+
+    def _insert(self, cursor, name, rows):
+        """Lot : une seule requête INSERT multi-lignes"""
+        table, columns = STATEMENTS[name]
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+        execute_values(cursor, query, rows, page_size=len(rows))
+
+    def _execute_prepared(self, cursor, name, rows):
+        """Ligne seule : requête préparée (INSERT simple si PREPARE n'est pas
+        utilisable, par exemple derrière un pgbouncer en mode transaction)
+        Retourne le curseur utilisé"""
+        try:
+            if name not in self.prepared:
+                self._prepare(cursor, name)
+            params = ', '.join(['%s'] * len(rows[0]))
+            cursor.execute(f"EXECUTE insert_{name} ({params})", rows[0])
+            return cursor
+        except psycopg2.DatabaseError as e:
+            if getattr(e, 'pgcode', None) not in PREPARED_STATEMENT_ERRORS:
+                raise
+            print(f"ℹ️  Requêtes préparées indisponibles (pooler en mode transaction ?), INSERT simple: {e}")
+        # Les dimensions résolues sont déjà validées (commit) : rien d'autre à annuler
+        cursor.close()
+        self.conn.rollback()
+        self.use_prepared = False
+        self.prepared = set()
+        cursor = self.conn.cursor()
+        self._insert(cursor, name, rows)
+        return cursor
+
+    def _drain_spool(self):
+        """Rejoue le journal local dans TimescaleDB"""
+        try:
+            count = self.spool.drain(self.conn)
+            self.spool_pending = False
+            if count:
+                print(f"✓ {count} lignes rejouées depuis le journal local")
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"✗ Rejeu du journal interrompu: {e}")
+            self._disconnect()
+        except Exception as e:
+            print(f"✗ Erreur rejeu du journal: {e}")
+
+    def _disconnect(self):
+        """Abandonne une connexion coupée"""
+        # self.conn est conservé (fermé) pour distinguer une reconnexion
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+    def write(self, name, rows):
+        """Écrit des lignes avec la requête préparée name (voir STATEMENTS)
+        Retourne WRITTEN, SPOOLED ou FAILED"""
+        if not rows:
+            return WRITTEN
+        with self.lock:
+            if not self.connected and not self._try_connect():
+                return self._spool(name, rows)
+            started = time.perf_counter()
+            try:
+                cursor = self.conn.cursor()
+                if name in RESOLVED_STATEMENTS:
+                    name, rows = RESOLVED_STATEMENTS[name], self.dimensions.resolve(cursor, rows)
+                if len(rows) == 1 and self.use_prepared:
+                    cursor = self._execute_prepared(cursor, name, rows)
+                else:
+                    self._insert(cursor, name, rows)
+                self.conn.commit()
+                cursor.close()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # Base injoignable : conserver les lignes dans le journal local
+                print(f"✗ TimescaleDB injoignable ({len(rows)} lignes): {e}")
+                COMMIT_FAILURES.inc()
+                self._disconnect()
+                return self._spool(name, rows)
+            except Exception as e:
+                print(f"✗ Erreur TimescaleDB ({len(rows)} lignes): {e}")
+                COMMIT_FAILURES.inc()
+                ROWS_FAILED.inc(len(rows))
+                self.rows_failed += len(rows)
+                try:
+                    self.conn.rollback()
+                except Exception:
+                    pass
+                return FAILED
+
+            WRITE_SECONDS.observe(time.perf_counter() - started)
+            ROWS_WRITTEN.inc(len(rows))
+            self.rows_written += len(rows)
+            if self.spool_pending:
+                self._drain_spool()
+            return WRITTEN
+
+    def copy(self, name, rows):
+        """Charge un grand nombre de lignes avec COPY (import en masse)
+        Pas de journal local : en cas d'erreur le lot est annulé
+        Retourne WRITTEN ou FAILED"""
+        if not rows:
+            return WRITTEN
+        with self.lock:
+            if not self.connected and not self._try_connect():
+                self.rows_failed += len(rows)
+                return FAILED
+            started = time.perf_counter()
+            try:
+                cursor = self.conn.cursor()
+                if name in RESOLVED_STATEMENTS:
+                    name, rows = RESOLVED_STATEMENTS[name], self.dimensions.resolve(cursor, rows)
+                table, columns = STATEMENTS[name]
+                cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", copy_buffer(rows))
+                self.conn.commit()
+                cursor.close()
+            except Exception as e:
+                print(f"✗ Erreur COPY TimescaleDB ({len(rows)} lignes): {e}")
+                COMMIT_FAILURES.inc()
+                ROWS_FAILED.inc(len(rows))
+                self.rows_failed += len(rows)
+                try:
+                    self.conn.rollback()
+                except Exception:
+                    pass
+                return FAILED
+            WRITE_SECONDS.observe(time.perf_counter() - started)
+            ROWS_WRITTEN.inc(len(rows))
+            self.rows_written += len(rows)
+            return WRITTEN
+
+    def _spool(self, name, rows):
+        """Place des lignes dans le journal local (ou les compte comme perdues)"""
+        if not self.spool:
+            ROWS_FAILED.inc(len(rows))
+            self.rows_failed += len(rows)
+            return FAILED
+        table, columns = STATEMENTS[name]
+        try:
+            self.spool.append(table, columns, rows)
+        except Exception as e:
+            print(f"✗ Erreur journal local: {e}")
+            ROWS_FAILED.inc(len(rows))
+            self.rows_failed += len(rows)
+            return FAILED
+        ROWS_SPOOLED.inc(len(rows))
+        self.rows_spooled += len(rows)
+        self.spool_pending = True
+        return SPOOLED
+
+    def close(self):
+        """Ferme la connexion et le journal local"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            if self.spool:
+                self.spool.close()
+
+
+# Instance partagée par tous les utilisateurs d'un même processus
+_shared_sink = None
+
+
+def get_sink():
+    """Retourne le sink partagé du processus (connexion ouverte au premier appel)"""
+    global _shared_sink
+    if _shared_sink is None:
+        _shared_sink = TimescaleSink(spool=Spool())
+        if _shared_sink.connect():
+            print("✓ Connecté à TimescaleDB")
+        else:
+            print(f"ℹ️  TimescaleDB injoignable, écriture dans le journal local ({_shared_sink.spool.path})")
+    return _shared_sink
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Écriture par lots dans TimescaleDB depuis un thread dédié
+Les lignes sont placées dans une file d'attente bornée puis insérées en une
+seule requête multi-lignes quand le lot atteint un nombre de lignes ou un âge
+La connexion, la reconnexion et le journal local sont gérés par le sink
+"""
+
+import queue
+import threading
+import time
+import config
+from timescaledb_sink import WRITTEN, SPOOLED
+from metrics import REGISTRY
+
+ROWS_DROPPED = REGISTRY.counter('writer_rows_dropped_total', "Lignes perdues (file d'attente pleine)")
+QUEUE_ROWS = REGISTRY.gauge_function_table('writer_queue_rows', "Lignes en attente d'écriture", ('writer',))
+
+# Politiques en cas de file d'attente pleine
+OVERFLOW_DROP_OLDEST = 'drop_oldest'   # supprimer la ligne la plus ancienne
+OVERFLOW_DROP_NEWEST = 'drop_newest'   # refuser la nouvelle ligne
+OVERFLOW_BLOCK = 'block'               # attendre (au plus block_timeout secondes)
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK)
+
+
+class BatchWriter:
+    """Écrivain TimescaleDB par lots, exécuté dans un thread séparé"""
+
+    def __init__(self, sink, statement, max_rows=500, max_age=2.0,
+                 queue_size=10000, overflow=OVERFLOW_DROP_OLDEST, block_timeout=1.0, name=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politique de débordement inconnue: {overflow}")
+        self.sink = sink
+        self.statement = statement
+        # Nom du thread et étiquette writer de la métrique (par défaut la requête)
+        self.name = name or statement
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Rappel on_lost(requête, lignes) pour les lignes perdues (file pleine ou
+        # FAILED), par exemple DeadbandFilter.forget_rows
+        self.on_lost = None
+        # Compteurs
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_failed = 0
+        self.rows_spooled = 0
+        self.batches_written = 0
+
+    def start(self):
+        """Démarre le thread d'écriture"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name=f"writer-{self.name}", daemon=True)
+        self.thread.start()
+        QUEUE_ROWS.set((self.name,), self.queue.qsize)
+        return self
+
+    def stop(self, timeout=10.0):
+        """Arrête le thread après avoir écrit les lignes restantes"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        QUEUE_ROWS.remove((self.name,))
+
+    def put(self, row, statement=None):
+        """Ajoute une ligne à la file d'attente (ne bloque pas sauf politique 'block')
+        statement : requête du sink à utiliser (par défaut celle de l'écrivain)"""
+        row = (statement or self.statement, row)
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self.queue.put(row, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            # Libérer une place en supprimant la ligne la plus ancienne
+            try:
+                dropped = self.queue.get_nowait()
+                self.rows_dropped += 1
+                ROWS_DROPPED.inc()
+                self._lost(dropped[0], [dropped[1]])
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(row)
+                return True
+            except queue.Full:
+                pass
+
+        self.rows_dropped += 1
+        ROWS_DROPPED.inc()
+        self._lost(row[0], [row[1]])
+        return False
+
+    def put_many(self, rows, statement=None):
+        """Ajoute plusieurs lignes à la file d'attente"""
+        for row in rows:
+            self.put(row, statement)
+
+    def _run(self):
+        """Boucle du thread : constitue les lots et les écrit"""
+        batch = []
+        deadline = None
+        while True:
+            if batch:
+                timeout = max(0.0, deadline - time.monotonic())
+            else:
+                timeout = 0.5
+            try:
+                row = self.queue.get(timeout=timeout)
+                if not batch:
+                    deadline = time.monotonic() + self.max_age
+                batch.append(row)
+            except queue.Empty:
+                pass
+
+            stopping = self.stop_event.is_set()
+            if batch and (len(batch) >= self.max_rows or time.monotonic() >= deadline or stopping):
+                # Vider ce qui est déjà en attente sans dépasser max_rows
+                while len(batch) < self.max_rows:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+            if stopping and not batch and self.queue.empty():
+                break
+
+    def _flush(self, batch):
+        """Écrit un lot via le sink (une requête multi-lignes par table)"""
+        groups = {}
+        for statement, row in batch:
+            groups.setdefault(statement, []).append(row)
+        for statement, rows in groups.items():
+            result = self.sink.write(statement, rows)
+            if result == WRITTEN:
+                self.rows_written += len(rows)
+                self.batches_written += 1
+            elif result == SPOOLED:
+                self.rows_spooled += len(rows)
+            else:
+                self.rows_failed += len(rows)
+                self._lost(statement, rows)
+
+    def _lost(self, statement, rows):
+        if self.on_lost:
+            try:
+                self.on_lost(statement, rows)
+            except Exception as e:
+                print(f"✗ Rappel de lignes perdues: {e}")
+
+
+def create_writer(sink, statement='sensor_data', name=None):
+    """Crée un écrivain par lots configuré depuis config (BATCH_*)
+    name : étiquette de l'écrivain (un par listener dans l'agent de collecte)"""
+    return BatchWriter(
+        sink,
+        statement,
+        name=name,
+        max_rows=getattr(config, 'BATCH_MAX_ROWS', 500),
+        max_age=getattr(config, 'BATCH_MAX_AGE', 2.0),
+        queue_size=getattr(config, 'BATCH_QUEUE_SIZE', 10000),
+        overflow=getattr(config, 'BATCH_OVERFLOW', 'drop_oldest'),
+    )